@@ -0,0 +1,16 @@
+"""
+Entrega de notificaciones (cocina, caja) mediante una cola asíncrona y destinos configurables
+"""
+
+from .dispatcher import NotificationDispatcher, QueueFullError, notification_dispatcher
+from .sinks import FileSink, LogSink, Sink, WebhookSink
+
+__all__ = [
+    'FileSink',
+    'LogSink',
+    'NotificationDispatcher',
+    'QueueFullError',
+    'Sink',
+    'WebhookSink',
+    'notification_dispatcher',
+]
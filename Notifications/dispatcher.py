@@ -0,0 +1,249 @@
+import asyncio
+import contextvars
+import logging
+import os
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from .sinks import Sink, build_sinks
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """
+    La cola de notificaciones sigue llena después de esperar enqueue_timeout
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__("Cola de notificaciones llena, reintente más tarde")
+        self.retry_after = retry_after
+
+
+class NotificationDispatcher:
+    """
+    Cola asíncrona en memoria que entrega las notificaciones a los destinos configurados
+
+    submit encola y retorna de inmediato; los workers toman lotes de la cola, los
+    agrupan por categoría y entregan cada grupo a todos los destinos. La cola es
+    acotada: si se llena, submit espera hasta enqueue_timeout y luego rechaza
+    (QueueFullError) para que el cliente reintente.
+
+    Un destino que falla se reintenta (solo ese destino) hasta retries veces con backoff
+    exponencial; si sigue fallando el lote se descarta para él y se cuenta en dead_letter.
+    """
+
+    def __init__(
+        self,
+        sinks: Optional[List[Sink]] = None,
+        max_queue: Optional[int] = None,
+        workers: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        batch_wait: Optional[float] = None,
+        enqueue_timeout: Optional[float] = None,
+        retries: Optional[int] = None,
+        retry_backoff: Optional[float] = None
+    ):
+        """
+        Args:
+            sinks: Destinos (por defecto se construyen con NOTIFICATIONS_SINKS al iniciar)
+            max_queue: Notificaciones pendientes antes de aplicar backpressure (NOTIFICATIONS_MAX_QUEUE)
+            workers: Tareas que entregan en paralelo (NOTIFICATIONS_WORKERS)
+            batch_size: Máximo de notificaciones por lote (NOTIFICATIONS_BATCH_SIZE)
+            batch_wait: Segundos de espera para acumular un lote (NOTIFICATIONS_BATCH_WAIT)
+            enqueue_timeout: Segundos que submit espera espacio en la cola (NOTIFICATIONS_ENQUEUE_TIMEOUT)
+            retries: Reintentos de un destino que falla (NOTIFICATIONS_RETRIES)
+            retry_backoff: Espera antes del primer reintento, se duplica en cada uno (NOTIFICATIONS_RETRY_BACKOFF)
+        """
+        self.sinks = sinks
+        self.max_queue = max_queue or int(os.environ.get("NOTIFICATIONS_MAX_QUEUE", 1000))
+        self.workers = workers or int(os.environ.get("NOTIFICATIONS_WORKERS", 2))
+        self.batch_size = batch_size or int(os.environ.get("NOTIFICATIONS_BATCH_SIZE", 50))
+        if batch_wait is None:
+            batch_wait = float(os.environ.get("NOTIFICATIONS_BATCH_WAIT", 0.2))
+        self.batch_wait = batch_wait
+        if enqueue_timeout is None:
+            enqueue_timeout = float(os.environ.get("NOTIFICATIONS_ENQUEUE_TIMEOUT", 0.5))
+        self.enqueue_timeout = enqueue_timeout
+        if retries is None:
+            retries = int(os.environ.get("NOTIFICATIONS_RETRIES", 3))
+        self.retries = retries
+        self.retry_backoff = retry_backoff or float(os.environ.get("NOTIFICATIONS_RETRY_BACKOFF", 0.5))
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # Funciones que reciben el resultado de cada entrega (métricas, ...)
+        self._delivery_listeners: List[Callable[..., None]] = []
+        self.enqueued = 0
+        self.delivered = 0
+        self.retried = 0
+        self.dead_letter = 0
+        self.rejected = 0
+        self.last_lag = 0.0
+
+    def add_delivery_listener(self, listener: Callable[..., None]) -> None:
+        """
+        Registra una función que recibe el resultado de cada entrega
+
+        Se llama como listener(sink, categoria, count, lag, error), con lag en segundos
+        desde que se encoló la notificación más antigua del lote y error=None si la
+        entrega fue exitosa.
+        """
+        self._delivery_listeners.append(listener)
+
+    def start(self) -> None:
+        """
+        Inicia los workers en el event loop actual (se llama también en el primer submit)
+        """
+        if self._tasks and not all(task.done() for task in self._tasks):
+            return
+        if self.sinks is None:
+            self.sinks = build_sinks()
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        loop = asyncio.get_running_loop()
+        # Contexto vacío: si start corre dentro de una petición (submit), los workers no heredan su id
+        context = contextvars.Context()
+        self._tasks = [context.run(loop.create_task, self._run()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """
+        Entrega lo pendiente (hasta timeout segundos), detiene los workers y cierra los destinos
+        """
+        if self._queue is not None and self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Se descartan %d notificaciones pendientes al apagar", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for sink in self.sinks or ():
+            try:
+                await sink.aclose()
+            except Exception:
+                logger.exception("Error al cerrar destino de notificaciones")
+
+    async def submit(self, categoria: Any, mensaje: str, adicional: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Encola una notificación para entregarla en segundo plano
+
+        Returns:
+            La notificación encolada (con id y created_at)
+
+        Raises:
+            QueueFullError: si la cola sigue llena después de enqueue_timeout
+        """
+        self.start()
+        notificacion = {
+            "id": uuid.uuid4().hex,
+            "categoria": categoria,
+            "mensaje": mensaje,
+            "adicional": adicional,
+            "created_at": time.time()
+        }
+        item = (time.monotonic(), notificacion)
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self._queue.put(item), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise QueueFullError(max(self.batch_wait, 1.0)) from None
+        self.enqueued += 1
+        return notificacion
+
+    async def _run(self) -> None:
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            try:
+                # Espera breve para acumular un lote si la cola está casi vacía
+                if self.batch_wait > 0 and queue.qsize() < self.batch_size - 1:
+                    await asyncio.sleep(self.batch_wait)
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(queue.get_nowait())
+                    except asyncio.QueueEmpty:
+                        break
+
+                grupos: Dict[Any, List[tuple]] = {}
+                for item in batch:
+                    grupos.setdefault(item[1]["categoria"], []).append(item)
+                for categoria, items in grupos.items():
+                    await self._deliver(categoria, items)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error en el worker de notificaciones")
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _deliver(self, categoria: Any, items: List[tuple]) -> None:
+        notificaciones = [notificacion for _, notificacion in items]
+        results = await asyncio.gather(
+            *(self._deliver_to(sink, categoria, notificaciones) for sink in self.sinks),
+            return_exceptions=True
+        )
+        lag = time.monotonic() - min(enqueued_at for enqueued_at, _ in items)
+        self.last_lag = lag
+        # Una notificación cuenta como entregada solo si llegó a todos los destinos
+        if any(isinstance(result, BaseException) for result in results):
+            self.dead_letter += len(items)
+        else:
+            self.delivered += len(items)
+        for sink, result in zip(self.sinks, results):
+            error = result if isinstance(result, BaseException) else None
+            if error is not None:
+                logger.error(
+                    "Se descartan %d notificaciones para %s tras %d reintentos: %s",
+                    len(items), sink.name, self.retries, error
+                )
+            for listener in self._delivery_listeners:
+                try:
+                    listener(sink.name, categoria, len(items), lag, error)
+                except Exception:
+                    logger.exception("Error en listener de entregas de notificaciones")
+
+    async def _deliver_to(self, sink: Sink, categoria: Any, notificaciones: List[Dict[str, Any]]) -> None:
+        attempt = 0
+        while True:
+            try:
+                await sink.deliver(categoria, notificaciones)
+                return
+            except Exception as e:
+                if attempt >= self.retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt)
+                logger.warning(
+                    "Error al entregar %d notificaciones a %s, reintento en %.1fs: %s",
+                    len(notificaciones), sink.name, delay, e
+                )
+                attempt += 1
+                self.retried += 1
+                await asyncio.sleep(delay)
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": bool(self._tasks) and not all(task.done() for task in self._tasks),
+            "depth": self.depth,
+            "max_queue": self.max_queue,
+            "enqueued": self.enqueued,
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "dead_letter": self.dead_letter,
+            "rejected": self.rejected,
+            "last_lag": self.last_lag
+        }
+
+
+# Instancia global del despachador de notificaciones
+notification_dispatcher = NotificationDispatcher()
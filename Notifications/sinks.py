@@ -0,0 +1,121 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - el cliente async es opcional
+    httpx = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class Sink:
+    """
+    Destino de las notificaciones (webhook, log, archivo, ...)
+
+    deliver recibe un lote de notificaciones de una misma categoría; si lanza una
+    excepción el despachador reintenta el lote en ese destino (ver NotificationDispatcher).
+    """
+
+    name = "sink"
+
+    async def deliver(self, categoria: Any, notificaciones: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        pass
+
+
+class LogSink(Sink):
+    """
+    Escribe cada lote en el log (pruebas locales)
+    """
+
+    name = "log"
+
+    def __init__(self, logger_name: str = "notifications"):
+        self._logger = logging.getLogger(logger_name)
+
+    async def deliver(self, categoria: Any, notificaciones: List[Dict[str, Any]]) -> None:
+        for notificacion in notificaciones:
+            self._logger.info("[%s] %s", categoria, notificacion.get("mensaje"))
+
+
+class FileSink(Sink):
+    """
+    Agrega cada notificación como una línea JSON a un archivo (pruebas locales)
+    """
+
+    name = "file"
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Args:
+            path: Archivo de salida (NOTIFICATIONS_FILE)
+        """
+        self.path = path or os.environ.get("NOTIFICATIONS_FILE", "notifications.jsonl")
+
+    def _write(self, lines: str) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    async def deliver(self, categoria: Any, notificaciones: List[Dict[str, Any]]) -> None:
+        lines = "".join(json.dumps(n, ensure_ascii=False) + "\n" for n in notificaciones)
+        await asyncio.to_thread(self._write, lines)
+
+
+class WebhookSink(Sink):
+    """
+    Envía cada lote en un solo POST JSON: {"categoria": ..., "notificaciones": [...]}
+    """
+
+    name = "webhook"
+
+    def __init__(self, url: Optional[str] = None, timeout: Optional[float] = None):
+        """
+        Args:
+            url: URL del webhook (NOTIFICATIONS_WEBHOOK_URL)
+            timeout: Timeout en segundos de cada envío (NOTIFICATIONS_WEBHOOK_TIMEOUT)
+        """
+        if httpx is None:
+            raise RuntimeError("WebhookSink requiere httpx")
+        self.url = url or os.environ["NOTIFICATIONS_WEBHOOK_URL"]
+        self.timeout = timeout or float(os.environ.get("NOTIFICATIONS_WEBHOOK_TIMEOUT", 5))
+        self._client: Optional["httpx.AsyncClient"] = None
+
+    async def deliver(self, categoria: Any, notificaciones: List[Dict[str, Any]]) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        response = await self._client.post(
+            self.url, json={"categoria": categoria, "notificaciones": notificaciones}
+        )
+        response.raise_for_status()
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+SINKS = {
+    "log": LogSink,
+    "file": FileSink,
+    "webhook": WebhookSink,
+}
+
+
+def build_sinks(names: Optional[str] = None) -> List[Sink]:
+    """
+    Construye los destinos a partir de una lista separada por comas (NOTIFICATIONS_SINKS)
+    """
+    names = names if names is not None else os.environ.get("NOTIFICATIONS_SINKS", "log")
+    sinks = []
+    for name in filter(None, (n.strip() for n in names.split(","))):
+        if name not in SINKS:
+            raise ValueError(f"Destino de notificaciones desconocido: {name}")
+        sinks.append(SINKS[name]())
+    return sinks
@@ -0,0 +1,21 @@
+"""
+Páginas HTML del retorno de Webpay (plantillas precompiladas y CSS estático)
+"""
+
+from .renderer import (
+    CALLBACK_CSS,
+    CALLBACK_CSS_URL,
+    render_error,
+    render_rejected,
+    render_success,
+    static_response,
+)
+
+__all__ = [
+    'CALLBACK_CSS',
+    'CALLBACK_CSS_URL',
+    'render_error',
+    'render_rejected',
+    'render_success',
+    'static_response',
+]
@@ -0,0 +1,95 @@
+import hashlib
+from html import escape
+from pathlib import Path
+from string import Template
+from typing import Any
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+_BASE_DIR = Path(__file__).parent
+_TEMPLATES_DIR = _BASE_DIR / "templates"
+_STATIC_DIR = _BASE_DIR / "static"
+
+
+class StaticAsset:
+    """
+    Archivo estático cargado en memoria una sola vez, con su ETag precalculado
+    """
+
+    __slots__ = ("content", "etag", "media_type")
+
+    def __init__(self, name: str, media_type: str):
+        self.content = (_STATIC_DIR / name).read_bytes()
+        self.etag = '"' + hashlib.sha256(self.content).hexdigest()[:16] + '"'
+        self.media_type = media_type
+
+
+def static_response(request: Request, asset: StaticAsset) -> Response:
+    """
+    Responde un archivo estático con ETag y Cache-Control (304 si el cliente ya lo tiene)
+
+    La URL incluye la versión del contenido, por lo que el navegador o la CDN pueden
+    guardarlo sin revalidar.
+    """
+    headers = {
+        "ETag": asset.etag,
+        "Cache-Control": "public, max-age=31536000, immutable"
+    }
+    if request.headers.get("if-none-match") == asset.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(asset.content, media_type=asset.media_type, headers=headers)
+
+
+CALLBACK_CSS = StaticAsset("callback.css", "text/css; charset=utf-8")
+CALLBACK_CSS_URL = "/static/callback.css?v=" + CALLBACK_CSS.etag.strip('"')
+
+
+class Page:
+    """
+    Plantilla HTML compilada al iniciar; por petición solo se reemplazan los valores dinámicos
+    """
+
+    __slots__ = ("_template", "_static")
+
+    def __init__(self, name: str):
+        self._template = Template((_TEMPLATES_DIR / name).read_text(encoding="utf-8"))
+        self._static = {"css_url": CALLBACK_CSS_URL}
+
+    def render(self, **values: Any) -> str:
+        return self._template.substitute(
+            self._static,
+            **{key: escape(str(value)) for key, value in values.items()}
+        )
+
+
+_SUCCESS = Page("success.html")
+_REJECTED = Page("rejected.html")
+_ERROR = Page("error.html")
+
+
+def render_success(amount: Any, buy_order: Any, auth_code: Any, token: str) -> str:
+    """
+    Página de pago exitoso
+    """
+    return _SUCCESS.render(
+        amount=f"{amount:,}" if isinstance(amount, (int, float)) else amount,
+        buy_order=buy_order,
+        auth_code=auth_code,
+        token_prefix=token[:20]
+    )
+
+
+def render_rejected(status: Any, response_code: Any) -> str:
+    """
+    Página de pago rechazado
+    """
+    return _REJECTED.render(status=status, response_code=response_code)
+
+
+def render_error(title: str, message: Any) -> str:
+    """
+    Página de error (token faltante, error al confirmar, excepción)
+    """
+    return _ERROR.render(title=title, message=message)
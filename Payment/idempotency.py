@@ -0,0 +1,163 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .models import Result
+
+
+class IdempotencyConflictError(Exception):
+    """
+    Se reutilizó una Idempotency-Key con un cuerpo distinto al de la petición original
+    """
+
+
+def _shared_result(entry: "_Entry") -> Result:
+    if entry.result is None:
+        raise RuntimeError("La operación original de esta Idempotency-Key falló")
+    return entry.result
+
+
+def _task_result(task: asyncio.Task) -> Optional[Result]:
+    if task.cancelled() or task.exception() is not None:
+        return None
+    return task.result()
+
+
+class _Entry:
+    """
+    Resultado (o llamada en curso) asociado a una clave de idempotencia
+    """
+
+    __slots__ = ("fingerprint", "result", "expires_at", "event", "future")
+
+    def __init__(self, fingerprint: Optional[str]):
+        self.fingerprint = fingerprint
+        self.result: Optional[Result] = None
+        # None mientras la llamada está en curso
+        self.expires_at: Optional[float] = None
+        # Se activa al terminar la llamada (esperas síncronas o desde otro event loop)
+        self.event = threading.Event()
+        self.future: Optional[asyncio.Future] = None
+
+
+class IdempotencyStore:
+    """
+    Resultados de operaciones por clave de idempotencia
+
+    - La primera petición con una clave ejecuta la operación; las duplicadas que llegan
+      mientras está en curso esperan ese mismo resultado
+    - Las repeticiones posteriores se responden desde memoria hasta que vence el TTL
+    - Memoria acotada con desalojo LRU
+    - No se guardan fallas de disponibilidad de Transbank (ErrorResult con code): el
+      cliente puede reintentar con la misma clave
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[float] = None):
+        """
+        Args:
+            max_entries: Máximo de claves guardadas (IDEMPOTENCY_MAX_ENTRIES)
+            ttl: Segundos que se recuerda un resultado (IDEMPOTENCY_TTL)
+        """
+        self.max_entries = max_entries or int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", 10000))
+        self.ttl = ttl or float(os.environ.get("IDEMPOTENCY_TTL", 86400))
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _claim_locked(self, key: str, fingerprint: Optional[str]) -> tuple:
+        """
+        Retorna (entry, leader); leader indica que esta petición debe ejecutar la operación
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at is not None and entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            entry = None
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                raise IdempotencyConflictError(
+                    "La Idempotency-Key ya se usó con un cuerpo distinto"
+                )
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry, False
+        self.misses += 1
+        entry = _Entry(fingerprint)
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry, True
+
+    def _finish(self, key: str, entry: _Entry, result: Optional[Result]) -> None:
+        with self._lock:
+            entry.result = result
+            keep = result is not None and result.get("code") is None
+            if keep:
+                entry.expires_at = time.monotonic() + self.ttl
+            elif self._entries.get(key) is entry:
+                del self._entries[key]
+        entry.event.set()
+
+    def run(self, key: str, fingerprint: Optional[str], loader: Callable[[], Result]) -> Result:
+        """
+        Ejecuta loader una sola vez por clave (versión síncrona)
+
+        Raises:
+            IdempotencyConflictError: si la clave se usó con otro fingerprint
+        """
+        with self._lock:
+            entry, leader = self._claim_locked(key, fingerprint)
+        if not leader:
+            entry.event.wait()
+            return _shared_result(entry)
+
+        result = None
+        try:
+            result = loader()
+        finally:
+            self._finish(key, entry, result)
+        return result
+
+    async def run_async(
+        self, key: str, fingerprint: Optional[str], loader: Callable[[], Awaitable[Result]]
+    ) -> Result:
+        """
+        Ejecuta loader una sola vez por clave (versión asíncrona)
+
+        Raises:
+            IdempotencyConflictError: si la clave se usó con otro fingerprint
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry, leader = self._claim_locked(key, fingerprint)
+            if leader:
+                # La operación corre en su propia tarea: si el cliente se desconecta la
+                # llamada a Transbank termina igual y su resultado queda guardado
+                entry.future = loop.create_task(loader())
+                entry.future.add_done_callback(lambda task: self._finish(key, entry, _task_result(task)))
+
+        if leader:
+            return await asyncio.shield(entry.future)
+        if not entry.event.is_set():
+            if entry.future is not None and entry.future.get_loop() is loop:
+                await asyncio.wait({entry.future})
+            else:
+                await asyncio.to_thread(entry.event.wait)
+        return _shared_result(entry)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+# Claves Idempotency-Key de las rutas de pago (create, confirm, refund)
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,542 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from . import settlement
+from .models import ErrorResult, Result
+
+
+logger = logging.getLogger(__name__)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    token TEXT PRIMARY KEY,
+    tenant TEXT NOT NULL DEFAULT '',
+    buy_order TEXT,
+    session_id TEXT,
+    amount REAL,
+    status TEXT,
+    vci TEXT,
+    accounting_date TEXT,
+    transaction_date TEXT,
+    authorization_code TEXT,
+    payment_type_code TEXT,
+    response_code INTEGER,
+    installments_amount REAL,
+    installments_number INTEGER,
+    balance REAL,
+    card_number TEXT,
+    refunded_amount REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_buy_order ON transactions (buy_order);
+CREATE INDEX IF NOT EXISTS idx_transactions_session_id ON transactions (session_id);
+CREATE INDEX IF NOT EXISTS idx_transactions_accounting_date ON transactions (accounting_date);
+
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    token TEXT,
+    operation TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_token ON events (token);
+"""
+
+# Campos de la respuesta de commit/status que se guardan tal cual
+_TRANSACTION_FIELDS = (
+    "buy_order",
+    "session_id",
+    "amount",
+    "status",
+    "vci",
+    "accounting_date",
+    "transaction_date",
+    "authorization_code",
+    "payment_type_code",
+    "response_code",
+    "installments_amount",
+    "installments_number",
+    "balance",
+)
+
+_UPSERT_TRANSACTION = """
+INSERT INTO transactions ({columns}, tenant, card_number, created_at, updated_at)
+VALUES ({placeholders}, :tenant, :card_number, :now, :now)
+ON CONFLICT (token) DO UPDATE SET
+    {updates},
+    card_number = COALESCE(excluded.card_number, transactions.card_number),
+    updated_at = excluded.updated_at
+""".format(
+    columns=", ".join(("token",) + _TRANSACTION_FIELDS),
+    placeholders=", ".join(":" + f for f in ("token",) + _TRANSACTION_FIELDS),
+    updates=",\n    ".join(
+        f"{f} = COALESCE(excluded.{f}, transactions.{f})" for f in _TRANSACTION_FIELDS
+    ),
+)
+
+_APPLY_REFUND = """
+UPDATE transactions SET
+    refunded_amount = refunded_amount + :nullified_amount,
+    balance = COALESCE(:balance, balance),
+    status = :status,
+    updated_at = :now
+WHERE token = :token
+"""
+
+# Columnas de la exportación, en el orden del esquema
+EXPORT_COLUMNS = (
+    ("token", "tenant") + _TRANSACTION_FIELDS + ("card_number", "refunded_amount", "created_at", "updated_at")
+)
+
+_STOP = object()
+
+
+class TransactionLedger:
+    """
+    Registro local (SQLite en modo WAL) de los resultados de WebpayService
+
+    Las escrituras se encolan y un hilo de fondo las confirma en lotes, de modo que
+    registrar un resultado no agrega latencia al flujo de pago. Las lecturas usan una
+    conexión por hilo y consultas indexadas por token, buy_order, session_id y
+    accounting_date. Cada transacción guarda la sucursal que la creó ('' para el
+    comercio por defecto) y las lecturas filtran por ella.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        max_queue: Optional[int] = None,
+        export_page_size: Optional[int] = None
+    ):
+        """
+        Args:
+            path: Archivo de la base de datos (LEDGER_PATH)
+            batch_size: Máximo de escrituras por commit (LEDGER_BATCH_SIZE)
+            flush_interval: Segundos de espera para acumular un lote (LEDGER_FLUSH_INTERVAL)
+            max_queue: Escrituras pendientes antes de empezar a descartar (LEDGER_MAX_QUEUE)
+            export_page_size: Filas leídas por consulta al exportar (LEDGER_EXPORT_PAGE_SIZE)
+        """
+        self.path = path or os.environ.get("LEDGER_PATH", "ledger.db")
+        self.batch_size = batch_size or int(os.environ.get("LEDGER_BATCH_SIZE", 200))
+        self.flush_interval = flush_interval or float(os.environ.get("LEDGER_FLUSH_INTERVAL", 0.05))
+        self.max_queue = max_queue or int(os.environ.get("LEDGER_MAX_QUEUE", 10000))
+        self.export_page_size = export_page_size or int(os.environ.get("LEDGER_EXPORT_PAGE_SIZE", 500))
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=self.max_queue)
+        self._writer: Optional[threading.Thread] = None
+        self._writer_pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+        self._local = threading.local()
+        self.dropped = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start(self) -> None:
+        """
+        Crea el esquema e inicia el hilo escritor (se llama también en la primera escritura)
+        """
+        with self._start_lock:
+            if self._writer is not None and self._writer.is_alive() and self._writer_pid == os.getpid():
+                return
+            conn = self._connect()
+            missing = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'settlement'"
+            ).fetchone() is None
+            conn.executescript(_SCHEMA + settlement.SCHEMA)
+            if missing:
+                # Ledger creado antes de los totales de liquidación
+                settlement.rebuild(conn)
+            conn.close()
+            self._writer_pid = os.getpid()
+            self._writer = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+            self._writer.start()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """
+        Confirma las escrituras pendientes y detiene el hilo escritor
+        """
+        writer = self._writer
+        if writer is None or not writer.is_alive():
+            return
+        self._queue.put(_STOP)
+        writer.join(timeout)
+        self._writer = None
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """
+        Espera a que todas las escrituras encoladas hasta ahora estén confirmadas
+        """
+        if self._writer is None or not self._writer.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def record(self, operation: str, token: Optional[str], resultado: Result, **context: Any) -> None:
+        """
+        Encola el resultado de una operación de WebpayService (no bloquea)
+
+        Args:
+            operation: create, commit, status o refund
+            token: Token de la transacción
+            resultado: Resultado retornado por WebpayService
+            context: Datos de la petición (buy_order, session_id, amount, ...)
+        """
+        if self._writer is None or self._writer_pid != os.getpid():
+            self.start()
+        try:
+            self._queue.put_nowait((operation, token, resultado, context, time.time()))
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("Ledger lleno, se descarta el registro %s de %s", operation, token)
+
+    def mark_expired(self, token: str) -> None:
+        """
+        Marca como EXPIRED una transacción creada que nunca se confirmó
+        """
+        self.record("expire", token, ErrorResult("Transacción expirada sin confirmar"))
+
+    def _run(self) -> None:
+        conn = self._connect()
+        try:
+            while True:
+                item = self._queue.get()
+                batch = [item]
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size and item is not _STOP:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    batch.append(item)
+
+                waiters = []
+                stop = False
+                with conn:
+                    for entry in batch:
+                        if entry is _STOP:
+                            stop = True
+                        elif isinstance(entry, threading.Event):
+                            waiters.append(entry)
+                        else:
+                            try:
+                                self._apply(conn, *entry)
+                            except Exception:
+                                logger.exception("Error al escribir en el ledger")
+                for waiter in waiters:
+                    waiter.set()
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _apply(
+        self,
+        conn: sqlite3.Connection,
+        operation: str,
+        token: Optional[str],
+        resultado: Result,
+        context: Dict[str, Any],
+        now: float
+    ) -> None:
+        success = bool(resultado.get("success"))
+        conn.execute(
+            "INSERT INTO events (token, operation, success, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+            (token, operation, int(success), json.dumps({**context, **resultado.to_dict()}, default=str), now)
+        )
+        if not token:
+            return
+        if operation == "expire":
+            conn.execute(
+                "UPDATE transactions SET status = 'EXPIRED', updated_at = ? "
+                "WHERE token = ? AND status = 'INITIALIZED'",
+                (now, token)
+            )
+            return
+        if not success:
+            return
+        tenant = context.get("tenant") or ""
+        if operation in ("commit", "status", "refund"):
+            before = conn.execute(settlement.SELECT_ROW, (token,)).fetchone()
+            self._apply_transaction(conn, operation, token, tenant, resultado, now)
+            settlement.apply_delta(conn, before, conn.execute(settlement.SELECT_ROW, (token,)).fetchone())
+        else:
+            self._apply_transaction(conn, operation, token, tenant, resultado, now)
+
+    def _apply_transaction(
+        self,
+        conn: sqlite3.Connection,
+        operation: str,
+        token: str,
+        tenant: str,
+        resultado: Result,
+        now: float
+    ) -> None:
+        if operation == "create":
+            conn.execute(
+                "INSERT INTO transactions (token, tenant, buy_order, session_id, amount, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 'INITIALIZED', ?, ?) ON CONFLICT (token) DO NOTHING",
+                (token, tenant, resultado.get("buy_order"), resultado.get("session_id"), resultado.get("amount"), now, now)
+            )
+        elif operation in ("commit", "status"):
+            values = {f: resultado.get(f) for f in _TRANSACTION_FIELDS}
+            card_detail = resultado.get("card_detail")
+            values["card_number"] = card_detail.get("card_number") if isinstance(card_detail, dict) else None
+            values["token"] = token
+            values["tenant"] = tenant
+            values["now"] = now
+            conn.execute(_UPSERT_TRANSACTION, values)
+        elif operation == "refund":
+            balance = resultado.get("balance")
+            if resultado.get("type") == "REVERSED":
+                status = "REVERSED"
+            elif balance == 0:
+                status = "NULLIFIED"
+            else:
+                status = "PARTIALLY_NULLIFIED"
+            conn.execute(_APPLY_REFUND, {
+                "token": token,
+                "nullified_amount": resultado.get("nullified_amount") or 0,
+                "balance": balance,
+                "status": status,
+                "now": now
+            })
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            if self._writer is None:
+                self.start()
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, token: str, tenant: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Retorna la transacción registrada para un token de la sucursal (None: comercio por defecto)
+        """
+        row = self._reader().execute(
+            "SELECT * FROM transactions WHERE token = ? AND tenant = ?", (token, tenant or "")
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def find(
+        self,
+        buy_order: Optional[str] = None,
+        session_id: Optional[str] = None,
+        accounting_date: Optional[str] = None,
+        limit: int = 100,
+        tenant: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Busca transacciones de la sucursal por buy_order, session_id y/o accounting_date
+        """
+        conditions = []
+        params: List[Any] = []
+        for column, value in (("buy_order", buy_order), ("session_id", session_id), ("accounting_date", accounting_date)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if not conditions:
+            return []
+        conditions.append("tenant = ?")
+        params.extend((tenant or "", limit))
+        rows = self._reader().execute(
+            f"SELECT * FROM transactions WHERE {' AND '.join(conditions)} ORDER BY created_at DESC LIMIT ?",
+            params
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def final_results(
+        self, keys: List[Tuple[Optional[str], str, str]]
+    ) -> Dict[Tuple[Optional[str], str, str], Dict[str, Any]]:
+        """
+        Busca el resultado final (estado distinto de INITIALIZED) de varias claves a la vez
+
+        Args:
+            keys: Claves (sucursal, "token" | "buy_order", valor)
+
+        Returns:
+            {clave: transacción} solo para las claves con resultado final (la más reciente
+            si un buy_order tiene varias)
+        """
+        grouped: Dict[Tuple[Optional[str], str], List[str]] = {}
+        for tenant, column, value in keys:
+            if column in ("token", "buy_order"):
+                grouped.setdefault((tenant, column), []).append(value)
+
+        found: Dict[Tuple[Optional[str], str, str], Dict[str, Any]] = {}
+        conn = self._reader()
+        for (tenant, column), values in grouped.items():
+            # Por tramos, bajo el máximo de parámetros de SQLite
+            for i in range(0, len(values), 500):
+                chunk = values[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT * FROM transactions WHERE tenant = ? AND {column} IN ({', '.join('?' * len(chunk))})"
+                    " AND status IS NOT NULL AND status != 'INITIALIZED' ORDER BY created_at",
+                    [tenant or "", *chunk]
+                ).fetchall()
+                for row in rows:
+                    found[(tenant, column, row[column])] = dict(row)
+        return found
+
+    def history(self, token: str) -> List[Dict[str, Any]]:
+        """
+        Retorna los eventos registrados (create, commit, status, refund) de un token
+        """
+        rows = self._reader().execute(
+            "SELECT operation, success, payload, created_at FROM events WHERE token = ? ORDER BY id",
+            (token,)
+        ).fetchall()
+        return [
+            {
+                "operation": row["operation"],
+                "success": bool(row["success"]),
+                "result": json.loads(row["payload"]),
+                "created_at": row["created_at"]
+            }
+            for row in rows
+        ]
+
+    def settlement_report(self, accounting_date: str, tenant: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Totales de liquidación de una sucursal en una fecha contable (mantenidos al registrar cada resultado)
+        """
+        return settlement.report(self._reader(), accounting_date, tenant or "")
+
+    def rebuild_settlement(self, accounting_date: Optional[str] = None) -> int:
+        """
+        Recalcula los totales de liquidación desde las transacciones registradas
+
+        Corre en una transacción propia: las escrituras del hilo del ledger quedan antes o
+        después del recálculo, nunca a medias.
+        """
+        if self._writer is None:
+            self.start()
+        conn = self._connect()
+        try:
+            return settlement.rebuild(conn, accounting_date)
+        finally:
+            conn.close()
+
+    def export(
+        self,
+        accounting_date: Optional[str] = None,
+        accounting_date_from: Optional[str] = None,
+        accounting_date_to: Optional[str] = None,
+        status: Optional[List[str]] = None,
+        buy_order_prefix: Optional[str] = None,
+        cursor: Optional[int] = None,
+        limit: Optional[int] = None,
+        tenant: Optional[str] = None
+    ) -> Tuple[Optional[int], Iterator[Dict[str, Any]]]:
+        """
+        Exporta transacciones con paginación por cursor (keyset sobre el rowid)
+
+        Las filas se leen en páginas de export_page_size con una conexión propia, así la
+        memoria usada no depende del total exportado y no se mantiene abierta una
+        transacción de lectura durante toda la descarga.
+
+        Args:
+            accounting_date: Fecha contable exacta (MMDD, como la entrega Transbank)
+            accounting_date_from / accounting_date_to: Rango de fechas contables (inclusivo; si
+                from es mayor que to el rango cruza el cambio de año)
+            status: Estados a incluir
+            buy_order_prefix: Prefijo de la orden de compra
+            cursor: Cursor retornado por la página anterior (exporta las filas siguientes)
+            limit: Máximo de filas de esta página (None exporta hasta el final)
+            tenant: Sucursal (None: comercio por defecto)
+
+        Returns:
+            (cursor de la página siguiente o None si no hay más filas, iterador de filas)
+        """
+        conditions = ["tenant = ?"]
+        params: List[Any] = [tenant or ""]
+        if accounting_date is not None:
+            conditions.append("accounting_date = ?")
+            params.append(accounting_date)
+        if accounting_date_from is not None and accounting_date_to is not None and accounting_date_from > accounting_date_to:
+            # MMDD sin año: un rango que cruza el cambio de año (ej. 1231 a 0102) son dos tramos
+            conditions.append("(accounting_date >= ? OR accounting_date <= ?)")
+            params.extend((accounting_date_from, accounting_date_to))
+        else:
+            if accounting_date_from is not None:
+                conditions.append("accounting_date >= ?")
+                params.append(accounting_date_from)
+            if accounting_date_to is not None:
+                conditions.append("accounting_date <= ?")
+                params.append(accounting_date_to)
+        if status:
+            conditions.append(f"status IN ({', '.join('?' * len(status))})")
+            params.extend(status)
+        if buy_order_prefix:
+            # Rango en vez de LIKE para usar el índice de buy_order
+            conditions.append("buy_order >= ? AND buy_order < ?")
+            params.extend((buy_order_prefix, buy_order_prefix + "\U0010ffff"))
+
+        start = cursor or 0
+        where = " AND ".join(conditions + ["rowid > ?"])
+
+        end = None
+        if limit is not None:
+            # Última fila de la página y, si hay una más, el cursor siguiente
+            rows = self._reader().execute(
+                f"SELECT rowid FROM transactions WHERE {where} ORDER BY rowid LIMIT 2 OFFSET ?",
+                params + [start, limit - 1]
+            ).fetchall()
+            if len(rows) == 2:
+                end = rows[0][0]
+
+        return end, self._export_rows(where, params, start, end)
+
+    def _export_rows(
+        self,
+        where: str,
+        params: List[Any],
+        start: int,
+        end: Optional[int]
+    ) -> Iterator[Dict[str, Any]]:
+        if end is not None:
+            where += " AND rowid <= ?"
+        sql = (
+            f"SELECT rowid, {', '.join(EXPORT_COLUMNS)} FROM transactions "
+            f"WHERE {where} ORDER BY rowid LIMIT ?"
+        )
+        if self._writer is None:
+            self.start()
+        conn = self._connect()
+        try:
+            last = start
+            while True:
+                page = conn.execute(
+                    sql, params + [last] + ([end] if end is not None else []) + [self.export_page_size]
+                ).fetchall()
+                for row in page:
+                    yield {column: row[column] for column in EXPORT_COLUMNS}
+                if len(page) < self.export_page_size:
+                    return
+                last = page[-1][0]
+        finally:
+            conn.close()
+
+
+# Instancia global del ledger
+transaction_ledger = TransactionLedger()
@@ -0,0 +1,122 @@
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+
+class Result:
+    """
+    Base de los resultados de WebpayService
+
+    Mantiene compatibilidad con el API anterior basado en diccionarios
+    (resultado.get("status"), resultado["token"]) sin crear un dict por respuesta.
+    """
+
+    __slots__ = ()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def _read(response: Any, key: str) -> Any:
+    """
+    Lee un campo de la respuesta según versión del SDK
+    Versión 3.x usa diccionarios, versión 2.x usa objetos
+    """
+    if isinstance(response, dict):
+        return response.get(key)
+    return getattr(response, key, None)
+
+
+@dataclass(frozen=True, slots=True)
+class ErrorResult(Result):
+    """
+    Resultado de una operación fallida
+
+    code clasifica las fallas de disponibilidad de Transbank (circuit_open, timeout,
+    upstream_unavailable); es None para errores de negocio.
+    """
+
+    error: str
+    success: bool = False
+    code: Optional[str] = None
+
+
+@dataclass(frozen=True, slots=True)
+class CreateResult(Result):
+    """
+    Resultado de create_transaction
+    """
+
+    url: Optional[str]
+    token: Optional[str]
+    buy_order: str
+    session_id: str
+    amount: float
+    success: bool = True
+
+    @classmethod
+    def from_response(cls, response: Any, buy_order: str, session_id: str, amount: float) -> "CreateResult":
+        return cls(_read(response, "url"), _read(response, "token"), buy_order, session_id, amount)
+
+
+@dataclass(frozen=True, slots=True)
+class TransactionResult(Result):
+    """
+    Resultado de commit_transaction y get_status (misma forma en ambas respuestas)
+    """
+
+    vci: Optional[str]
+    amount: Optional[float]
+    status: Optional[str]
+    buy_order: Optional[str]
+    session_id: Optional[str]
+    card_detail: Optional[Dict[str, Any]]
+    accounting_date: Optional[str]
+    transaction_date: Optional[str]
+    authorization_code: Optional[str]
+    payment_type_code: Optional[str]
+    response_code: Optional[int]
+    installments_amount: Optional[float]
+    installments_number: Optional[int]
+    balance: Optional[float]
+    success: bool = True
+
+    @classmethod
+    def from_response(cls, response: Any) -> "TransactionResult":
+        if isinstance(response, dict):
+            return cls(*map(response.get, _TRANSACTION_FIELDS))
+        return cls(*(getattr(response, name, None) for name in _TRANSACTION_FIELDS))
+
+
+@dataclass(frozen=True, slots=True)
+class RefundResult(Result):
+    """
+    Resultado de refund_transaction
+    """
+
+    type: Optional[str]
+    authorization_code: Optional[str]
+    authorization_date: Optional[str]
+    nullified_amount: Optional[float]
+    balance: Optional[float]
+    response_code: Optional[int]
+    success: bool = True
+
+    @classmethod
+    def from_response(cls, response: Any) -> "RefundResult":
+        if isinstance(response, dict):
+            return cls(*map(response.get, _REFUND_FIELDS))
+        return cls(*(getattr(response, name, None) for name in _REFUND_FIELDS))
+
+
+# Campos que vienen de la respuesta de Transbank (todos menos success)
+_TRANSACTION_FIELDS = TransactionResult.__slots__[:-1]
+_REFUND_FIELDS = RefundResult.__slots__[:-1]
@@ -0,0 +1,224 @@
+import asyncio
+import heapq
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .models import Result
+from .status_cache import TERMINAL_STATES
+from .webpay_service import WebpayService, webpay_service
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending:
+    """
+    Transacción creada que todavía no llega a un estado final
+    """
+
+    __slots__ = ("created_at", "next_check", "attempts", "tenant")
+
+    def __init__(self, created_at: float, next_check: float, tenant: Optional[str] = None):
+        self.created_at = created_at
+        self.next_check = next_check
+        self.attempts = 0
+        self.tenant = tenant
+
+
+class ReconciliationWorker:
+    """
+    Tarea de fondo que resuelve transacciones creadas y nunca confirmadas
+
+    Registra los tokens creados con create_transaction y los descarta cuando llegan a
+    un estado final (por commit o consulta). Los que quedan pendientes se consultan con
+    get_status en lotes acotados y con backoff exponencial; si superan expire_after
+    segundos sin resolverse se marcan como expirados.
+    """
+
+    def __init__(
+        self,
+        service: WebpayService,
+        interval: Optional[float] = None,
+        batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        initial_delay: Optional[float] = None,
+        max_delay: Optional[float] = None,
+        expire_after: Optional[float] = None,
+        max_tracked: Optional[int] = None,
+        on_expired: Optional[Callable[[str], None]] = None,
+        resolve_service: Optional[Callable[[str], WebpayService]] = None
+    ):
+        """
+        Args:
+            service: Servicio usado para consultar los estados
+            interval: Segundos entre revisiones (RECONCILIATION_INTERVAL)
+            batch_size: Máximo de tokens consultados por revisión (RECONCILIATION_BATCH_SIZE)
+            concurrency: Consultas simultáneas hacia Transbank (RECONCILIATION_CONCURRENCY)
+            initial_delay: Segundos antes de la primera consulta (RECONCILIATION_INITIAL_DELAY)
+            max_delay: Máximo de segundos entre consultas de un token (RECONCILIATION_MAX_DELAY)
+            expire_after: Segundos tras los que un token sin resolver expira (RECONCILIATION_EXPIRE_AFTER)
+            max_tracked: Máximo de tokens pendientes en memoria (RECONCILIATION_MAX_TRACKED)
+            on_expired: Función llamada con el token de cada transacción expirada
+            resolve_service: Retorna el servicio de una sucursal (los estados se consultan con
+                las credenciales del comercio que creó la transacción)
+        """
+        self.service = service
+        self.interval = interval or float(os.environ.get("RECONCILIATION_INTERVAL", 5))
+        self.batch_size = batch_size or int(os.environ.get("RECONCILIATION_BATCH_SIZE", 50))
+        self.concurrency = concurrency or int(os.environ.get("RECONCILIATION_CONCURRENCY", 5))
+        self.initial_delay = initial_delay or float(os.environ.get("RECONCILIATION_INITIAL_DELAY", 60))
+        self.max_delay = max_delay or float(os.environ.get("RECONCILIATION_MAX_DELAY", 300))
+        self.expire_after = expire_after or float(os.environ.get("RECONCILIATION_EXPIRE_AFTER", 1200))
+        self.max_tracked = max_tracked or int(os.environ.get("RECONCILIATION_MAX_TRACKED", 50000))
+        self.on_expired = on_expired
+        self.resolve_service = resolve_service
+
+        self._pending: Dict[str, _Pending] = {}
+        # Heap (next_check, token); las entradas obsoletas se descartan al sacarlas
+        self._schedule: List[tuple] = []
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.resolved = 0
+        self.expired = 0
+        self.checks = 0
+
+    def track(self, operation: str, token: Optional[str], resultado: Result, **context: Any) -> None:
+        """
+        Listener de resultados de WebpayService (ver add_result_listener)
+        """
+        if not token or not resultado.get("success"):
+            return
+        if operation == "create":
+            now = time.monotonic()
+            with self._lock:
+                if token in self._pending or len(self._pending) >= self.max_tracked:
+                    return
+                entry = _Pending(now, now + self.initial_delay, context.get("tenant"))
+                self._pending[token] = entry
+                heapq.heappush(self._schedule, (entry.next_check, token))
+        elif operation == "commit" or resultado.get("status") in TERMINAL_STATES:
+            self._resolve(token)
+
+    def _resolve(self, token: str) -> None:
+        with self._lock:
+            if self._pending.pop(token, None) is not None:
+                self.resolved += 1
+
+    def _due(self, now: float) -> List[tuple]:
+        tokens = []
+        with self._lock:
+            while self._schedule and len(tokens) < self.batch_size:
+                next_check, token = self._schedule[0]
+                if next_check > now:
+                    break
+                heapq.heappop(self._schedule)
+                entry = self._pending.get(token)
+                if entry is not None and entry.next_check == next_check:
+                    tokens.append((token, entry.tenant))
+        return tokens
+
+    def _reschedule(self, token: str, now: float) -> None:
+        with self._lock:
+            entry = self._pending.get(token)
+            if entry is None:
+                return
+            entry.attempts += 1
+            delay = min(self.initial_delay * (2 ** entry.attempts), self.max_delay)
+            # Jitter para que los tokens creados juntos no se consulten juntos
+            entry.next_check = now + delay * random.uniform(0.8, 1.2)
+            heapq.heappush(self._schedule, (entry.next_check, token))
+
+    def _expire(self, token: str) -> None:
+        with self._lock:
+            if self._pending.pop(token, None) is None:
+                return
+            self.expired += 1
+        if self.on_expired is not None:
+            try:
+                self.on_expired(token)
+            except Exception:
+                logger.exception("Error al marcar transacción expirada")
+
+    async def run_once(self) -> int:
+        """
+        Consulta un lote de tokens pendientes cuya revisión ya corresponde
+
+        Returns:
+            Cantidad de tokens consultados
+        """
+        now = time.monotonic()
+        due = self._due(now)
+        if not due:
+            return 0
+        by_tenant: Dict[Optional[str], List[str]] = {}
+        for token, tenant in due:
+            by_tenant.setdefault(tenant, []).append(token)
+        for tenant, tokens in by_tenant.items():
+            service = self._service_for(tenant)
+            async for token, resultado in service.iter_status_many(tokens, self.concurrency):
+                self.checks += 1
+                if resultado.get("success") and resultado.get("status") in TERMINAL_STATES:
+                    self._resolve(token)
+                    continue
+                entry = self._pending.get(token)
+                if entry is not None and now - entry.created_at >= self.expire_after:
+                    self._expire(token)
+                else:
+                    self._reschedule(token, now)
+        return len(due)
+
+    def _service_for(self, tenant: Optional[str]) -> WebpayService:
+        if tenant is None or self.resolve_service is None:
+            return self.service
+        try:
+            return self.resolve_service(tenant)
+        except KeyError:
+            logger.warning("Sucursal %s no registrada, se consulta con el comercio por defecto", tenant)
+            return self.service
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error en la conciliación de transacciones pendientes")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """
+        Inicia la tarea de fondo en el event loop actual
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Detiene la tarea de fondo
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": self._task is not None and not self._task.done(),
+                "pending": len(self._pending),
+                "resolved": self.resolved,
+                "expired": self.expired,
+                "checks": self.checks
+            }
+
+
+# Instancia global del worker de conciliación
+reconciliation_worker = ReconciliationWorker(webpay_service)
@@ -0,0 +1,422 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .ledger import transaction_ledger
+from .webpay_service import WebpayService, webpay_service
+
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS refund_jobs (
+    id TEXT PRIMARY KEY,
+    tenant TEXT NOT NULL DEFAULT '',
+    owner TEXT NOT NULL,
+    lease_until REAL NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_refund_jobs_lease ON refund_jobs (lease_until) WHERE finished_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_refund_jobs_finished_at ON refund_jobs (finished_at);
+
+CREATE TABLE IF NOT EXISTS refund_job_items (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    token TEXT NOT NULL,
+    amount REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    started_at REAL,
+    finished_at REAL,
+    PRIMARY KEY (job_id, position)
+);
+"""
+
+# Reembolso que estaba en curso cuando su proceso se detuvo: no se reintenta porque
+# Transbank pudo haberlo aplicado
+INTERRUPTED_RESULT = {
+    "success": False,
+    "error": "Reembolso interrumpido al detenerse el servidor; verifique la transacción antes de reintentarlo"
+}
+
+_CLOSE_JOB = """
+UPDATE refund_jobs SET finished_at = ?
+WHERE id = ? AND finished_at IS NULL AND NOT EXISTS (
+    SELECT 1 FROM refund_job_items WHERE job_id = ? AND status IN ('pending', 'running')
+)
+"""
+
+# Reembolso encolado: (job_id, position, tenant, token, amount)
+_Item = Tuple[str, int, str, str, float]
+
+
+class JobQueueFullError(Exception):
+    """
+    No hay espacio en la cola para todos los reembolsos del trabajo
+    """
+
+
+def job_status(progress: Dict[str, int]) -> str:
+    """
+    Estado de un trabajo según la cantidad de reembolsos en cada estado
+    """
+    if progress["pending"] or progress["running"]:
+        if progress["pending"] == sum(progress.values()):
+            return "queued"
+        return "running"
+    if not progress["failed"]:
+        return "completed"
+    if progress["succeeded"]:
+        return "partial"
+    return "failed"
+
+
+class RefundJobManager:
+    """
+    Trabajos de reembolso asíncronos
+
+    submit guarda el trabajo en SQLite (el archivo del ledger) y encola sus reembolsos en
+    el proceso que lo recibió; un número fijo de workers los ejecuta, de modo que nunca
+    hay más de `workers` reembolsos en curso hacia Transbank por proceso. El progreso de
+    cada reembolso se escribe en SQLite: cualquier worker del servidor responde la
+    consulta de un trabajo y los trabajos terminados se conservan job_ttl segundos.
+
+    Cada trabajo pendiente tiene un dueño con un lease que se renueva mientras el proceso
+    vive. Si el dueño se detiene (reinicio, worker reciclado) otro proceso toma el trabajo
+    al vencer el lease y encola sus reembolsos pendientes; los que estaban en curso se
+    marcan fallidos (INTERRUPTED_RESULT) en vez de repetirse.
+    """
+
+    def __init__(
+        self,
+        service: WebpayService,
+        workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        job_ttl: Optional[float] = None,
+        lease: Optional[float] = None,
+        path: Optional[str] = None,
+        resolve_service: Optional[Callable[[str], WebpayService]] = None
+    ):
+        """
+        Args:
+            service: Servicio del comercio por defecto
+            workers: Reembolsos simultáneos hacia Transbank (REFUND_JOB_WORKERS)
+            max_pending: Reembolsos encolados como máximo por proceso (REFUND_JOB_MAX_PENDING)
+            job_ttl: Segundos que se conserva un trabajo terminado (REFUND_JOB_TTL)
+            lease: Segundos sin renovar tras los que otro proceso toma un trabajo (REFUND_JOB_LEASE)
+            path: Archivo SQLite (por defecto el del ledger)
+            resolve_service: Retorna el servicio de una sucursal (los reembolsos se ejecutan
+                con las credenciales del comercio que creó el trabajo)
+        """
+        self.service = service
+        self.workers = workers or int(os.environ.get("REFUND_JOB_WORKERS", 4))
+        self.max_pending = max_pending or int(os.environ.get("REFUND_JOB_MAX_PENDING", 5000))
+        self.job_ttl = job_ttl or float(os.environ.get("REFUND_JOB_TTL", 3600))
+        self.lease = lease or float(os.environ.get("REFUND_JOB_LEASE", 30))
+        self.path = path
+        self.resolve_service = resolve_service
+
+        self.owner = ""
+        self._local = threading.local()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._maintainer: Optional[asyncio.Task] = None
+        # Reembolsos aceptados que todavía se están guardando (cuentan para max_pending)
+        self._reserved = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path or transaction_ledger.path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks) and not all(task.done() for task in self._tasks)
+
+    def start(self) -> None:
+        """
+        Crea las tablas e inicia los workers en el event loop actual (en cada worker, desde el lifespan)
+        """
+        if self.running:
+            return
+        # Identidad única por proceso (un pid se puede repetir tras un reinicio)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._conn().executescript(SCHEMA)
+        self._queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        # Contexto vacío: si start corre dentro de una petición (submit), los workers no
+        # heredan su id ni su registro de llamadas a Transbank
+        context = contextvars.Context()
+        self._tasks = [context.run(loop.create_task, self._run()) for _ in range(self.workers)]
+        self._maintainer = context.run(loop.create_task, self._maintain())
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        Espera los reembolsos encolados (hasta timeout segundos), detiene los workers y
+        libera los trabajos pendientes para que otro proceso los tome de inmediato
+        """
+        if self._maintainer is not None:
+            self._maintainer.cancel()
+            await asyncio.gather(self._maintainer, return_exceptions=True)
+            self._maintainer = None
+        if self._queue is not None and self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Se detienen los trabajos de reembolso con %d pendientes", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._tasks:
+            self._tasks = []
+            try:
+                await asyncio.to_thread(self._release)
+            except Exception:
+                logger.exception("Error al liberar los trabajos de reembolso")
+
+    async def submit(self, refunds: Iterable[Tuple[str, float]], service: WebpayService) -> str:
+        """
+        Guarda un trabajo y encola sus reembolsos (no espera a Transbank)
+
+        Args:
+            refunds: Pares (token, monto)
+            service: Servicio de la sucursal que ejecuta los reembolsos
+
+        Returns:
+            Id del trabajo
+
+        Raises:
+            JobQueueFullError: si la cola no tiene espacio para todo el trabajo
+        """
+        self.start()
+        refunds = list(refunds)
+        # Se rechaza el trabajo completo antes de encolar una parte
+        if self._queue.qsize() + self._reserved + len(refunds) > self.max_pending:
+            raise JobQueueFullError("Demasiados reembolsos pendientes, reintente más tarde")
+        job_id = uuid.uuid4().hex
+        tenant = service.tenant or ""
+        self._reserved += len(refunds)
+        try:
+            await asyncio.to_thread(self._insert, job_id, tenant, refunds, time.time())
+        finally:
+            self._reserved -= len(refunds)
+        for position, (token, amount) in enumerate(refunds):
+            self._queue.put_nowait((job_id, position, tenant, token, amount))
+        return job_id
+
+    async def get(self, job_id: str, tenant: Optional[str] = None, include_items: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Estado de un trabajo de la sucursal (None si no existe o ya expiró)
+        """
+        return await asyncio.to_thread(self._load, job_id, tenant or "", include_items)
+
+    def _insert(self, job_id: str, tenant: str, refunds: List[Tuple[str, float]], now: float) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO refund_jobs (id, tenant, owner, lease_until, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, tenant, self.owner, now + self.lease, now)
+            )
+            conn.executemany(
+                "INSERT INTO refund_job_items (job_id, position, token, amount) VALUES (?, ?, ?, ?)",
+                [(job_id, position, token, amount) for position, (token, amount) in enumerate(refunds)]
+            )
+
+    def _load(self, job_id: str, tenant: str, include_items: bool) -> Optional[Dict[str, Any]]:
+        conn = self._conn()
+        job = conn.execute(
+            "SELECT id, tenant, created_at, finished_at FROM refund_jobs WHERE id = ? AND tenant = ?",
+            (job_id, tenant)
+        ).fetchone()
+        if job is None:
+            return None
+        items = conn.execute(
+            "SELECT token, amount, status, result, started_at, finished_at FROM refund_job_items "
+            "WHERE job_id = ? ORDER BY position",
+            (job_id,)
+        ).fetchall()
+        progress: Dict[str, int] = {"pending": 0, "running": 0, "succeeded": 0, "failed": 0}
+        for item in items:
+            progress[item["status"]] += 1
+        data = {
+            "job_id": job["id"],
+            "status": job_status(progress),
+            "tenant": job["tenant"] or None,
+            "total": len(items),
+            "progress": progress,
+            "created_at": job["created_at"],
+            "finished_at": job["finished_at"]
+        }
+        if include_items:
+            data["items"] = [
+                {**dict(item), "result": json.loads(item["result"]) if item["result"] else None}
+                for item in items
+            ]
+        return data
+
+    def _start_item(self, job_id: str, position: int, now: float) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "UPDATE refund_job_items SET status = 'running', started_at = ? WHERE job_id = ? AND position = ?",
+                (now, job_id, position)
+            )
+
+    def _finish_item(self, job_id: str, position: int, result: Dict[str, Any], now: float) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "UPDATE refund_job_items SET status = ?, result = ?, finished_at = ? WHERE job_id = ? AND position = ?",
+                (
+                    "succeeded" if result.get("success") else "failed",
+                    json.dumps(result, default=str),
+                    now,
+                    job_id,
+                    position
+                )
+            )
+            conn.execute(_CLOSE_JOB, (now, job_id, job_id))
+
+    def _release(self) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "UPDATE refund_jobs SET lease_until = 0 WHERE owner = ? AND finished_at IS NULL", (self.owner,)
+            )
+
+    def _sweep(self, now: float, capacity: int) -> List[_Item]:
+        """
+        Renueva los leases propios, borra los trabajos expirados y toma trabajos sin dueño
+
+        Returns:
+            Reembolsos pendientes de los trabajos tomados (caben en capacity)
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "UPDATE refund_jobs SET lease_until = ? WHERE owner = ? AND finished_at IS NULL",
+                (now + self.lease, self.owner)
+            )
+            conn.execute(
+                "DELETE FROM refund_job_items WHERE job_id IN (SELECT id FROM refund_jobs WHERE finished_at < ?)",
+                (now - self.job_ttl,)
+            )
+            conn.execute("DELETE FROM refund_jobs WHERE finished_at < ?", (now - self.job_ttl,))
+
+        claimed: List[_Item] = []
+        orphans = conn.execute(
+            "SELECT id, tenant, owner FROM refund_jobs WHERE finished_at IS NULL AND lease_until < ? "
+            "ORDER BY created_at LIMIT 100",
+            (now,)
+        ).fetchall()
+        for job in orphans:
+            with conn:
+                pending = conn.execute(
+                    "SELECT position, token, amount FROM refund_job_items "
+                    "WHERE job_id = ? AND status = 'pending' ORDER BY position",
+                    (job["id"],)
+                ).fetchall()
+                if len(claimed) + len(pending) > capacity:
+                    break
+                # Solo un proceso gana el trabajo: el UPDATE exige el dueño y el lease leídos
+                taken = conn.execute(
+                    "UPDATE refund_jobs SET owner = ?, lease_until = ? WHERE id = ? AND owner = ? AND lease_until < ?",
+                    (self.owner, now + self.lease, job["id"], job["owner"], now)
+                ).rowcount
+                if not taken:
+                    continue
+                conn.execute(
+                    "UPDATE refund_job_items SET status = 'failed', result = ?, finished_at = ? "
+                    "WHERE job_id = ? AND status = 'running'",
+                    (json.dumps(INTERRUPTED_RESULT), now, job["id"])
+                )
+                conn.execute(_CLOSE_JOB, (now, job["id"], job["id"]))
+            logger.info("Trabajo de reembolso %s retomado con %d pendientes", job["id"], len(pending))
+            claimed.extend(
+                (job["id"], item["position"], job["tenant"], item["token"], item["amount"]) for item in pending
+            )
+        return claimed
+
+    async def _maintain(self) -> None:
+        while True:
+            try:
+                capacity = self.max_pending - self._queue.qsize() - self._reserved
+                for item in await asyncio.to_thread(self._sweep, time.time(), capacity):
+                    self._queue.put_nowait(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error al mantener los trabajos de reembolso")
+            await asyncio.sleep(self.lease / 3)
+
+    def _service_for(self, tenant: str) -> WebpayService:
+        if not tenant:
+            return self.service
+        if self.resolve_service is None:
+            raise KeyError(tenant)
+        return self.resolve_service(tenant)
+
+    async def _refund(self, job_id: str, position: int, tenant: str, token: str, amount: float) -> None:
+        await asyncio.to_thread(self._start_item, job_id, position, time.time())
+        try:
+            resultado = (await self._service_for(tenant).refund_transaction_async(token, amount)).to_dict()
+        except KeyError:
+            resultado = {"success": False, "error": f"Sucursal {tenant} no registrada"}
+        except Exception as e:
+            logger.exception("Error en el reembolso de %s", token)
+            resultado = {"success": False, "error": str(e)}
+        # Si se cancela durante la llamada el reembolso queda 'running' y se informa como
+        # interrumpido cuando otro proceso tome el trabajo
+        await asyncio.to_thread(self._finish_item, job_id, position, resultado, time.time())
+
+    async def _run(self) -> None:
+        queue = self._queue
+        while True:
+            item = await queue.get()
+            try:
+                await self._refund(*item)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error al registrar el reembolso de %s", item[3])
+            finally:
+                queue.task_done()
+
+    async def stats(self) -> Dict[str, Any]:
+        row = await asyncio.to_thread(
+            lambda: self._conn().execute(
+                "SELECT COUNT(*) AS jobs, COALESCE(SUM(finished_at IS NULL), 0) AS active_jobs, "
+                "COALESCE(SUM(finished_at IS NULL AND owner = ?), 0) AS owned_jobs FROM refund_jobs",
+                (self.owner,)
+            ).fetchone()
+        )
+        return {
+            "running": self.running,
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            **dict(row)
+        }
+
+
+# Instancia global de los trabajos de reembolso
+refund_jobs = RefundJobManager(webpay_service)
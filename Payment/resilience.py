@@ -0,0 +1,199 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - el cliente async es opcional
+    httpx = None
+
+
+class CircuitOpenError(Exception):
+    """
+    El circuito hacia Transbank está abierto: la llamada se rechaza sin intentarla
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Transbank no disponible, reintente en {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def _requests_error(name: str) -> tuple:
+    """
+    Clase de error de requests (usado por el SDK) sin importarlo: si requests no está
+    cargado, ningún error puede venir de él
+    """
+    requests = sys.modules.get("requests")
+    return (getattr(requests, name),) if requests is not None else ()
+
+
+def is_timeout(error: BaseException) -> bool:
+    if isinstance(error, _requests_error("Timeout")):
+        return True
+    return httpx is not None and isinstance(error, httpx.TimeoutException)
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """
+    Indica si un error refleja que Transbank no está disponible (timeout, conexión, 5xx)
+
+    Los errores de negocio (4xx, ej. "transacción ya confirmada") no cuentan: Transbank
+    respondió correctamente.
+    """
+    if isinstance(error, _requests_error("RequestException")):
+        return True
+    if httpx is not None and isinstance(error, httpx.TransportError):
+        return True
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and code >= 500
+
+
+def error_code(error: BaseException) -> Optional[str]:
+    """
+    Clasifica un error para que las rutas elijan el código HTTP (503/504)
+    """
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if is_timeout(error):
+        return "timeout"
+    if is_upstream_failure(error):
+        return "upstream_unavailable"
+    return None
+
+
+def retry_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    Espera antes del reintento `attempt` (desde 0): backoff exponencial con jitter completo
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker por tasa de error sobre las últimas `window` llamadas
+
+    - closed: las llamadas pasan; si la tasa de fallas supera failure_rate (con al menos
+      min_calls llamadas en la ventana) el circuito se abre
+    - open: las llamadas fallan de inmediato con CircuitOpenError durante reset_timeout
+    - half_open: se deja pasar una llamada de prueba; si resulta bien se cierra, si no
+      se vuelve a abrir. Solo la llamada de prueba (identificada por el valor que retorna
+      before_call) resuelve este estado; si se cancela, se libera el cupo de prueba sin
+      cambiar el estado
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_rate: Optional[float] = None,
+        window: Optional[int] = None,
+        min_calls: Optional[int] = None,
+        reset_timeout: Optional[float] = None
+    ):
+        """
+        Args:
+            failure_rate: Fracción de fallas que abre el circuito (WEBPAY_BREAKER_FAILURE_RATE)
+            window: Cantidad de llamadas recientes consideradas (WEBPAY_BREAKER_WINDOW)
+            min_calls: Llamadas mínimas en la ventana para evaluar la tasa (WEBPAY_BREAKER_MIN_CALLS)
+            reset_timeout: Segundos que el circuito queda abierto (WEBPAY_BREAKER_RESET_TIMEOUT)
+        """
+        self.failure_rate = failure_rate or float(os.environ.get("WEBPAY_BREAKER_FAILURE_RATE", 0.5))
+        self.window = window or int(os.environ.get("WEBPAY_BREAKER_WINDOW", 20))
+        self.min_calls = min_calls or int(os.environ.get("WEBPAY_BREAKER_MIN_CALLS", 10))
+        self.reset_timeout = reset_timeout or float(os.environ.get("WEBPAY_BREAKER_RESET_TIMEOUT", 30))
+
+        self.state = self.CLOSED
+        self._outcomes: deque = deque(maxlen=self.window)
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial: Optional[object] = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def before_call(self) -> Optional[object]:
+        """
+        Verifica si la llamada puede hacerse; lanza CircuitOpenError si no
+
+        Returns:
+            None para una llamada normal, o el identificador de la llamada de prueba
+            (half_open) que se debe pasar a record
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return None
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and self._trial is None:
+                self._trial = object()
+                return self._trial
+            self.rejected += 1
+            raise CircuitOpenError(max(remaining, 1.0))
+
+    def record(self, error: Optional[BaseException], trial: Optional[object] = None) -> None:
+        """
+        Registra el resultado de una llamada que before_call dejó pasar
+
+        Args:
+            error: Error de la llamada (None si resultó bien)
+            trial: Valor retornado por before_call para esta llamada
+        """
+        # Cancelada (CancelledError, KeyboardInterrupt): no dice nada de Transbank
+        cancelled = error is not None and not isinstance(error, Exception)
+        failed = error is not None and is_upstream_failure(error)
+        with self._lock:
+            if trial is not None:
+                if trial is not self._trial:
+                    return
+                self._trial = None
+                if cancelled:
+                    return
+                if failed:
+                    self._open()
+                else:
+                    self._reset(self.CLOSED)
+                return
+
+            # Una llamada iniciada con el circuito cerrado que termina en open o half_open
+            # no resuelve el estado: eso le corresponde a la llamada de prueba
+            if cancelled or self.state != self.CLOSED:
+                return
+            if len(self._outcomes) == self._outcomes.maxlen and self._outcomes[0]:
+                self._failures -= 1
+            self._outcomes.append(failed)
+            if failed:
+                self._failures += 1
+            if (
+                len(self._outcomes) >= self.min_calls
+                and self._failures / len(self._outcomes) >= self.failure_rate
+            ):
+                self._open()
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+
+    def _reset(self, state: str) -> None:
+        self.state = state
+        self._outcomes.clear()
+        self._failures = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = len(self._outcomes)
+            retry_after = 0.0
+            if self.state == self.OPEN:
+                retry_after = max(self._opened_at + self.reset_timeout - time.monotonic(), 0.0)
+            return {
+                "state": self.state,
+                "failure_rate": self._failures / calls if calls else 0.0,
+                "calls": calls,
+                "rejected": self.rejected,
+                "retry_after": retry_after
+            }
@@ -0,0 +1,204 @@
+"""
+Totales de liquidación por fecha contable
+
+La tabla settlement guarda, por sucursal, accounting_date y payment_type_code, los totales
+autorizados, reembolsados y en cuotas. El ledger la actualiza con deltas en la misma
+transacción SQLite en que registra cada resultado de commit, status o refund: se calcula
+el aporte de la transacción antes y después de la escritura y se suma la diferencia.
+rebuild recalcula los totales desde la tabla transactions con la misma regla.
+
+    python -m Payment.settlement rebuild                 # recalcula todas las fechas
+    python -m Payment.settlement rebuild --date 0320     # solo una fecha contable
+    python -m Payment.settlement show --date 0320 [--tenant sucursal-centro]
+"""
+
+import argparse
+import json
+import sqlite3
+from typing import Any, Dict, Optional, Tuple
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settlement (
+    tenant TEXT NOT NULL DEFAULT '',
+    accounting_date TEXT NOT NULL,
+    payment_type_code TEXT NOT NULL,
+    authorized_count INTEGER NOT NULL DEFAULT 0,
+    authorized_amount REAL NOT NULL DEFAULT 0,
+    refunded_count INTEGER NOT NULL DEFAULT 0,
+    refunded_amount REAL NOT NULL DEFAULT 0,
+    installments_count INTEGER NOT NULL DEFAULT 0,
+    installments_amount REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (tenant, accounting_date, payment_type_code)
+);
+"""
+
+# Estados de una transacción que fue autorizada (aunque luego se haya reembolsado)
+COUNTED_STATUSES = ("AUTHORIZED", "PARTIALLY_NULLIFIED", "NULLIFIED", "REVERSED")
+
+_METRICS = (
+    "authorized_count",
+    "authorized_amount",
+    "refunded_count",
+    "refunded_amount",
+    "installments_count",
+    "installments_amount",
+)
+
+SELECT_ROW = (
+    "SELECT tenant, accounting_date, payment_type_code, status, amount, refunded_amount, installments_number "
+    "FROM transactions WHERE token = ?"
+)
+
+_APPLY_DELTA = """
+INSERT INTO settlement (tenant, accounting_date, payment_type_code, {columns})
+VALUES (:tenant, :accounting_date, :payment_type_code, {placeholders})
+ON CONFLICT (tenant, accounting_date, payment_type_code) DO UPDATE SET
+    {updates}
+""".format(
+    columns=", ".join(_METRICS),
+    placeholders=", ".join(":" + m for m in _METRICS),
+    updates=",\n    ".join(f"{m} = {m} + excluded.{m}" for m in _METRICS),
+)
+
+# Misma regla que contribution(), agregada por sucursal, fecha y tipo de pago
+_REBUILD = """
+INSERT INTO settlement (tenant, accounting_date, payment_type_code, {columns})
+SELECT
+    tenant,
+    accounting_date,
+    COALESCE(payment_type_code, ''),
+    COUNT(*),
+    COALESCE(SUM(amount), 0),
+    SUM(CASE WHEN refunded > 0 THEN 1 ELSE 0 END),
+    COALESCE(SUM(refunded), 0),
+    SUM(CASE WHEN installments_number > 0 THEN 1 ELSE 0 END),
+    COALESCE(SUM(CASE WHEN installments_number > 0 THEN amount ELSE 0 END), 0)
+FROM (
+    SELECT *, CASE WHEN status = 'REVERSED' THEN amount ELSE refunded_amount END AS refunded
+    FROM transactions
+    WHERE accounting_date IS NOT NULL AND status IN ({statuses}) {{where}}
+)
+GROUP BY tenant, accounting_date, COALESCE(payment_type_code, '')
+""".format(
+    columns=", ".join(_METRICS),
+    statuses=", ".join(f"'{s}'" for s in COUNTED_STATUSES),
+)
+
+Key = Tuple[str, str, str]
+
+
+def contribution(row: Optional[sqlite3.Row]) -> Optional[Tuple[Key, Dict[str, float]]]:
+    """
+    Aporte de una fila de transactions a los totales (None si no cuenta)
+    """
+    if row is None or row["accounting_date"] is None or row["status"] not in COUNTED_STATUSES:
+        return None
+    amount = row["amount"] or 0
+    refunded = amount if row["status"] == "REVERSED" else (row["refunded_amount"] or 0)
+    installments = (row["installments_number"] or 0) > 0
+    return (row["tenant"], row["accounting_date"], row["payment_type_code"] or ""), {
+        "authorized_count": 1,
+        "authorized_amount": amount,
+        "refunded_count": 1 if refunded > 0 else 0,
+        "refunded_amount": refunded,
+        "installments_count": 1 if installments else 0,
+        "installments_amount": amount if installments else 0,
+    }
+
+
+def apply_delta(conn: sqlite3.Connection, before: Optional[sqlite3.Row], after: Optional[sqlite3.Row]) -> None:
+    """
+    Suma a settlement la diferencia entre el aporte de una transacción antes y después de
+    una escritura (se llama dentro de la transacción SQLite del ledger)
+    """
+    old, new = contribution(before), contribution(after)
+    if old == new:
+        return
+    deltas: Dict[Key, Dict[str, float]] = {}
+    for entry, sign in ((old, -1), (new, 1)):
+        if entry is None:
+            continue
+        key, values = entry
+        delta = deltas.setdefault(key, dict.fromkeys(_METRICS, 0))
+        for metric, value in values.items():
+            delta[metric] += sign * value
+    for (tenant, accounting_date, payment_type_code), delta in deltas.items():
+        if any(delta.values()):
+            conn.execute(_APPLY_DELTA, {
+                "tenant": tenant,
+                "accounting_date": accounting_date,
+                "payment_type_code": payment_type_code,
+                **delta
+            })
+
+
+def rebuild(conn: sqlite3.Connection, accounting_date: Optional[str] = None) -> int:
+    """
+    Recalcula los totales desde transactions (todas las fechas o una, de todas las sucursales)
+
+    Returns:
+        Filas (sucursal, fecha, tipo de pago) escritas
+    """
+    with conn:
+        if accounting_date is None:
+            conn.execute("DELETE FROM settlement")
+            cursor = conn.execute(_REBUILD.format(where=""))
+        else:
+            conn.execute("DELETE FROM settlement WHERE accounting_date = ?", (accounting_date,))
+            cursor = conn.execute(_REBUILD.format(where="AND accounting_date = ?"), (accounting_date,))
+        return cursor.rowcount
+
+
+def report(conn: sqlite3.Connection, accounting_date: str, tenant: str = "") -> Dict[str, Any]:
+    """
+    Totales de una sucursal en una fecha contable (lee solo las filas de esa fecha)
+    """
+    rows = conn.execute(
+        f"SELECT payment_type_code, {', '.join(_METRICS)} FROM settlement "
+        "WHERE tenant = ? AND accounting_date = ?",
+        (tenant, accounting_date)
+    ).fetchall()
+    totals = dict.fromkeys(_METRICS, 0)
+    by_payment_type = {}
+    for row in rows:
+        for metric in _METRICS:
+            totals[metric] += row[metric]
+        by_payment_type[row["payment_type_code"] or "unknown"] = {
+            "count": row["authorized_count"],
+            "amount": row["authorized_amount"],
+            "refunded_amount": row["refunded_amount"],
+        }
+    return {
+        "tenant": tenant or None,
+        "accounting_date": accounting_date,
+        "authorized": {"count": totals["authorized_count"], "amount": totals["authorized_amount"]},
+        "refunded": {"count": totals["refunded_count"], "amount": totals["refunded_amount"]},
+        "net_amount": totals["authorized_amount"] - totals["refunded_amount"],
+        "installments": {"count": totals["installments_count"], "amount": totals["installments_amount"]},
+        "by_payment_type": by_payment_type,
+    }
+
+
+def main() -> None:
+    from .ledger import TransactionLedger
+
+    parser = argparse.ArgumentParser(description="Totales de liquidación del ledger local")
+    parser.add_argument("command", choices=("rebuild", "show"))
+    parser.add_argument("--date", help="Fecha contable (MMDD); rebuild sin fecha recalcula todas")
+    parser.add_argument("--path", help="Archivo del ledger (por defecto LEDGER_PATH)")
+    parser.add_argument("--tenant", help="Sucursal de show (por defecto el comercio por defecto)")
+    args = parser.parse_args()
+
+    ledger = TransactionLedger(path=args.path)
+    if args.command == "rebuild":
+        rows = ledger.rebuild_settlement(args.date)
+        print(f"settlement recalculado: {rows} filas")
+    else:
+        if not args.date:
+            parser.error("show requiere --date")
+        print(json.dumps(ledger.settlement_report(args.date, args.tenant), indent=2))
+
+
+if __name__ == "__main__":
+    main()
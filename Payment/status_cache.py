@@ -0,0 +1,206 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .models import ErrorResult, Result
+
+
+# Estados en los que una transacción ya no cambia por sí sola
+# (un reembolso posterior invalida la entrada explícitamente)
+TERMINAL_STATES = frozenset({
+    "AUTHORIZED",
+    "FAILED",
+    "REVERSED",
+    "NULLIFIED",
+    "PARTIALLY_NULLIFIED",
+    "CAPTURED",
+})
+
+
+class _Flight:
+    """
+    Consulta en curso hacia Transbank compartida por todas las peticiones del mismo token
+    """
+
+    __slots__ = ("event", "future", "result", "stale")
+
+    def __init__(self):
+        self.event: Optional[threading.Event] = None
+        self.future: Optional[asyncio.Future] = None
+        self.result: Optional[Result] = None
+        # Se marca si la entrada se actualizó o invalidó mientras la consulta estaba en curso
+        self.stale = False
+
+
+class StatusCache:
+    """
+    Caché de resultados de get_status por token (WebpayService usa (sucursal, token))
+
+    - Estados finales (AUTHORIZED, REVERSED, NULLIFIED, ...) se guardan hasta ser desalojados
+    - Estados pendientes (INITIALIZED, ...) expiran después de un TTL corto
+    - Memoria acotada con desalojo LRU
+    - Consultas simultáneas del mismo token comparten una sola llamada (single-flight)
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, pending_ttl: Optional[float] = None):
+        """
+        Args:
+            max_entries: Máximo de tokens en caché, 0 desactiva el almacenamiento (STATUS_CACHE_MAX_ENTRIES)
+            pending_ttl: Segundos que se guarda un estado no final (STATUS_CACHE_PENDING_TTL)
+        """
+        if max_entries is None:
+            max_entries = int(os.environ.get("STATUS_CACHE_MAX_ENTRIES", 10000))
+        if pending_ttl is None:
+            pending_ttl = float(os.environ.get("STATUS_CACHE_PENDING_TTL", 2.0))
+        self.max_entries = max_entries
+        self.pending_ttl = pending_ttl
+
+        # token -> (resultado, expira_en); expira_en es None para estados finales
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[Result]:
+        """
+        Retorna el resultado en caché si sigue vigente
+        """
+        with self._lock:
+            return self._get_locked(token)
+
+    def _get_locked(self, token: str) -> Optional[Result]:
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        result, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[token]
+            return None
+        self._entries.move_to_end(token)
+        return result
+
+    def set(self, token: str, result: Result) -> None:
+        """
+        Guarda (o refresca) el resultado de una transacción
+        Solo se guardan resultados exitosos
+        """
+        with self._lock:
+            flight = self._inflight.get(token)
+            if flight is not None:
+                flight.stale = True
+            self._store_locked(token, result)
+
+    def _store_locked(self, token: str, result: Result) -> None:
+        if not result.get("success") or self.max_entries <= 0:
+            self._entries.pop(token, None)
+            return
+        if result.get("status") in TERMINAL_STATES:
+            expires_at = None
+        elif self.pending_ttl > 0:
+            expires_at = time.monotonic() + self.pending_ttl
+        else:
+            self._entries.pop(token, None)
+            return
+        self._entries[token] = (result, expires_at)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, token: str) -> None:
+        """
+        Elimina la entrada de un token (por ejemplo después de un reembolso)
+        """
+        with self._lock:
+            flight = self._inflight.get(token)
+            if flight is not None:
+                flight.stale = True
+            self._entries.pop(token, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_load(self, token: str, loader: Callable[[str], Result]) -> Result:
+        """
+        Retorna el estado en caché o lo obtiene con loader (versión síncrona)
+        """
+        with self._lock:
+            cached = self._get_locked(token)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            self.misses += 1
+            flight = self._inflight.get(token)
+            leader = flight is None or flight.event is None
+            if leader:
+                flight = _Flight()
+                flight.event = threading.Event()
+                self._inflight[token] = flight
+
+        if not leader:
+            flight.event.wait()
+            return flight.result
+
+        try:
+            flight.result = loader(token)
+        except BaseException as e:
+            flight.result = ErrorResult(str(e))
+            raise
+        finally:
+            with self._lock:
+                if self._inflight.get(token) is flight:
+                    del self._inflight[token]
+                if not flight.stale:
+                    self._store_locked(token, flight.result)
+            flight.event.set()
+        return flight.result
+
+    async def get_or_load_async(
+        self, token: str, loader: Callable[[str], Awaitable[Result]]
+    ) -> Result:
+        """
+        Retorna el estado en caché o lo obtiene con loader (versión asíncrona)
+        """
+        with self._lock:
+            cached = self._get_locked(token)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            self.misses += 1
+            flight = self._inflight.get(token)
+            leader = flight is None or flight.future is None
+            if leader:
+                flight = _Flight()
+                # La consulta corre en su propia tarea: si el líder se cancela (cliente
+                # desconectado) los demás reciben igual el resultado de Transbank
+                flight.future = asyncio.get_running_loop().create_task(loader(token))
+                flight.future.add_done_callback(lambda task: self._finish(token, flight, task))
+                self._inflight[token] = flight
+
+        # shield: si esta petición se cancela no se cancela la consulta compartida;
+        # si la consulta falla todos reciben la misma excepción
+        return await asyncio.shield(flight.future)
+
+    def _finish(self, token: str, flight: _Flight, task: "asyncio.Task[Result]") -> None:
+        with self._lock:
+            if self._inflight.get(token) is flight:
+                del self._inflight[token]
+            if task.cancelled() or task.exception() is not None:
+                return
+            flight.result = task.result()
+            if not flight.stale:
+                self._store_locked(token, flight.result)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "inflight": len(self._inflight),
+                "hits": self.hits,
+                "misses": self.misses
+            }
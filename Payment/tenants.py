@@ -0,0 +1,162 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+from .webpay_service import WebpayService, webpay_service
+
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownTenantError(KeyError):
+    """
+    La sucursal pedida no está registrada
+    """
+
+
+def load_tenants() -> Dict[str, Dict[str, str]]:
+    """
+    Lee las credenciales de las sucursales desde TENANTS_FILE (archivo JSON) o TENANTS (JSON)
+
+    Formato: {"sucursal-centro": {"commerce_code": "...", "api_key": "..."}, ...}
+    """
+    path = os.environ.get("TENANTS_FILE")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    raw = os.environ.get("TENANTS")
+    return json.loads(raw) if raw else {}
+
+
+class TenantRegistry:
+    """
+    Registro de sucursales (comercios) y de sus servicios de Webpay
+
+    Cada sucursal tiene sus credenciales y, al usarse, un WebpayService con su propio
+    pool de conexiones que se reutiliza entre peticiones. Solo se mantienen activos
+    max_active servicios: el usado hace más tiempo se desaloja (LRU) y su cliente se
+    cierra después de close_delay segundos, para no cortar peticiones en curso.
+    """
+
+    def __init__(
+        self,
+        default: WebpayService,
+        tenants: Optional[Dict[str, Dict[str, str]]] = None,
+        max_active: Optional[int] = None,
+        pool_size: Optional[int] = None,
+        keepalive_connections: Optional[int] = None,
+        close_delay: Optional[float] = None
+    ):
+        """
+        Args:
+            default: Servicio usado cuando la petición no indica sucursal
+            tenants: Credenciales por sucursal (por defecto load_tenants())
+            max_active: Servicios de sucursal activos a la vez (TENANT_MAX_ACTIVE)
+            pool_size: Conexiones máximas por sucursal (TENANT_POOL_SIZE)
+            keepalive_connections: Conexiones ociosas por sucursal (TENANT_KEEPALIVE_CONNECTIONS)
+            close_delay: Segundos antes de cerrar el cliente de una sucursal desalojada (TENANT_CLOSE_DELAY)
+        """
+        self.default = default
+        self.credentials: Dict[str, Dict[str, str]] = dict(tenants if tenants is not None else load_tenants())
+        self.max_active = max_active or int(os.environ.get("TENANT_MAX_ACTIVE", 200))
+        self.pool_size = pool_size or int(os.environ.get("TENANT_POOL_SIZE", 20))
+        self.keepalive_connections = keepalive_connections or int(
+            os.environ.get("TENANT_KEEPALIVE_CONNECTIONS", 5)
+        )
+        if close_delay is None:
+            close_delay = float(os.environ.get("TENANT_CLOSE_DELAY", 60))
+        self.close_delay = close_delay
+
+        self._active: "OrderedDict[str, WebpayService]" = OrderedDict()
+        # Cierres en curso (el event loop solo guarda referencias débiles a las tareas)
+        self._closing: Set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def register(self, tenant: str, commerce_code: str, api_key: str) -> None:
+        """
+        Agrega o actualiza las credenciales de una sucursal
+        """
+        with self._lock:
+            self.credentials[tenant] = {"commerce_code": commerce_code, "api_key": api_key}
+            stale = self._active.pop(tenant, None)
+        if stale is not None:
+            self._schedule_close(stale)
+
+    def get(self, tenant: Optional[str]) -> WebpayService:
+        """
+        Retorna el servicio de la sucursal (el servicio por defecto si tenant es None)
+
+        Raises:
+            UnknownTenantError: si la sucursal no está registrada
+        """
+        if not tenant:
+            return self.default
+        with self._lock:
+            service = self._active.get(tenant)
+            if service is not None:
+                self._active.move_to_end(tenant)
+                return service
+            credentials = self.credentials.get(tenant)
+            if credentials is None:
+                raise UnknownTenantError(tenant)
+            service = self.default.for_tenant(
+                tenant,
+                credentials["commerce_code"],
+                credentials["api_key"],
+                pool_size=self.pool_size,
+                keepalive_connections=self.keepalive_connections
+            )
+            self._active[tenant] = service
+            evicted = []
+            while len(self._active) > self.max_active:
+                evicted.append(self._active.popitem(last=False)[1])
+                self.evicted += 1
+        for old in evicted:
+            self._schedule_close(old)
+        return service
+
+    def _schedule_close(self, service: WebpayService) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.call_later(self.close_delay, self._close, loop, service)
+
+    def _close(self, loop: asyncio.AbstractEventLoop, service: WebpayService) -> None:
+        task = loop.create_task(service.aclose())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def active(self) -> List[WebpayService]:
+        with self._lock:
+            return list(self._active.values())
+
+    async def aclose(self) -> None:
+        """
+        Cierra los clientes de todas las sucursales activas
+        """
+        for service in self.active():
+            try:
+                await service.aclose()
+            except Exception:
+                logger.exception("Error al cerrar el cliente de la sucursal %s", service.tenant)
+        with self._lock:
+            self._active.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "registered": len(self.credentials),
+                "active": len(self._active),
+                "max_active": self.max_active,
+                "evicted": self.evicted
+            }
+
+
+# Instancia global del registro de sucursales
+tenant_registry = TenantRegistry(webpay_service)
@@ -1,238 +1,590 @@
-from transbank.webpay.webpay_plus.transaction import Transaction
+import asyncio
+import logging
 import os
-from typing import Dict, Any
+import time
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Dict, Any, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+from .models import CreateResult, ErrorResult, RefundResult, Result, TransactionResult
+from .idempotency import IdempotencyStore
+from .resilience import CircuitBreaker, error_code, is_upstream_failure, retry_delay
+from .status_cache import StatusCache
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - el cliente async es opcional
+    httpx = None
+
+if TYPE_CHECKING:
+    # El SDK de Transbank solo se importa si se usa el respaldo síncrono (ver _get_transaction)
+    from transbank.webpay.webpay_plus.transaction import Transaction
+
+
+logger = logging.getLogger(__name__)
+
+# Host y endpoint de la API REST de Webpay Plus (ambiente de INTEGRACIÓN)
+WEBPAY_INTEGRATION_HOST = "https://webpay3gint.transbank.cl"
+WEBPAY_TRANSACTIONS_PATH = "/rswebpaytransaction/api/webpay/v1.2/transactions"
+
+# Credenciales oficiales de integración de Transbank
+# Código de comercio de integración
+INTEGRATION_COMMERCE_CODE = "597055555532"
+# API Key de integración (también llamada "secret key")
+INTEGRATION_API_KEY = "579B532A7440BB0C9079DED94D31EA1615BACEB56610332264630D42D0A36B1C"
+
+# Largos máximos que el SDK valida antes de llamar a Transbank (ApiConstants)
+BUY_ORDER_LENGTH = 26
+SESSION_ID_LENGTH = 61
+RETURN_URL_LENGTH = 255
+TOKEN_LENGTH = 64
+
+
+class WebpayError(Exception):
+    """
+    Error devuelto por la API REST de Webpay (equivalente a TransbankError del SDK)
+    """
+
+    def __init__(self, message: str, code: Optional[int] = None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+def _require_text(value: Optional[str], max_length: int, name: str) -> None:
+    """
+    Misma validación que el SDK (ValidationUtil.has_text_with_max_length): el cliente HTTP
+    rechaza con el mismo error, sin llamar a Transbank
+    """
+    if not value or not value.strip():
+        raise WebpayError(f"'{name}' can't be null or white space")
+    if len(value) > max_length:
+        raise WebpayError(f"'{name}' is too long, the maximum length is {max_length}")
 
 
 class WebpayService:
     """
     Servicio para gestionar transacciones con Webpay Plus en ambiente de INTEGRACIÓN
     Implementa: crear, confirmar, obtener estado y reembolsar transacciones
+
+    Expone dos APIs equivalentes:
+    - Síncrona (create_transaction, ...): usa el SDK de Transbank, se mantiene como respaldo
+    - Asíncrona (create_transaction_async, ...): usa un único cliente httpx con pool
+      de conexiones keep-alive compartido por todas las peticiones
     """
-    
-    def __init__(self):
+
+    def __init__(
+        self,
+        commerce_code: Optional[str] = None,
+        api_key: Optional[str] = None,
+        pool_size: Optional[int] = None,
+        keepalive_connections: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        timeout: Optional[float] = None,
+        use_async_client: Optional[bool] = None,
+        status_cache: Optional[StatusCache] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        commit_store: Optional[IdempotencyStore] = None,
+        tenant: Optional[str] = None
+    ):
         """
         Inicializa el servicio de Webpay para AMBIENTE DE INTEGRACIÓN
-        Usa las credenciales oficiales de integración de Transbank
+        Sin credenciales configuradas usa las oficiales de integración de Transbank
+
+        Args:
+            commerce_code: Código de comercio (TRANSBANK_COMMERCE_CODE)
+            api_key: API Key del comercio (TRANSBANK_API_KEY)
+            pool_size: Máximo de conexiones simultáneas hacia Transbank (WEBPAY_POOL_SIZE)
+            keepalive_connections: Conexiones ociosas que se mantienen abiertas (WEBPAY_KEEPALIVE_CONNECTIONS)
+            keepalive_expiry: Segundos que una conexión ociosa se mantiene viva (WEBPAY_KEEPALIVE_EXPIRY)
+            timeout: Timeout por defecto en segundos de cada llamada (WEBPAY_TIMEOUT);
+                cada operación se puede ajustar con WEBPAY_TIMEOUT_CREATE, _COMMIT, _STATUS y _REFUND
+            use_async_client: Si es False, la API asíncrona delega en el SDK (WEBPAY_ASYNC_CLIENT)
+            status_cache: Caché de get_status (por defecto se configura con STATUS_CACHE_*)
+            breaker: Circuit breaker hacia Transbank (por defecto se configura con WEBPAY_BREAKER_*)
+            commit_store: Resultados de commit por token (por defecto retiene COMMIT_DEDUP_TTL segundos)
+            tenant: Sucursal a la que pertenece el servicio (None para el comercio por defecto)
+        """
+        self.commerce_code = commerce_code or os.environ.get("TRANSBANK_COMMERCE_CODE", INTEGRATION_COMMERCE_CODE)
+        self.api_key = api_key or os.environ.get("TRANSBANK_API_KEY", INTEGRATION_API_KEY)
+        self.tenant = tenant
+
+        # Configuración del pool de conexiones del cliente asíncrono
+        # WEBPAY_BASE_URL permite apuntar a un servidor local (ver bench/mock_transbank.py);
+        # el SDK síncrono siempre usa el host de Transbank
+        self.base_url = os.environ.get("WEBPAY_BASE_URL", WEBPAY_INTEGRATION_HOST)
+        self.pool_size = pool_size or int(os.environ.get("WEBPAY_POOL_SIZE", 100))
+        self.keepalive_connections = keepalive_connections or int(
+            os.environ.get("WEBPAY_KEEPALIVE_CONNECTIONS", 20)
+        )
+        self.keepalive_expiry = keepalive_expiry or float(os.environ.get("WEBPAY_KEEPALIVE_EXPIRY", 30))
+        self.timeout = timeout or float(os.environ.get("WEBPAY_TIMEOUT", 30))
+        # Timeout por operación: una consulta de estado no debe esperar lo mismo que un commit
+        self.timeouts: Dict[str, float] = {
+            operation: float(os.environ.get(f"WEBPAY_TIMEOUT_{operation.upper()}", default))
+            for operation, default in (
+                ("create", self.timeout),
+                ("commit", self.timeout),
+                ("status", min(self.timeout, 5.0)),
+                ("refund", self.timeout),
+            )
+        }
+        # Reintentos de get_status (solo lectura, se puede repetir sin efectos)
+        self.status_retries = int(os.environ.get("WEBPAY_STATUS_RETRIES", 2))
+        self.retry_base_delay = float(os.environ.get("WEBPAY_RETRY_BASE_DELAY", 0.1))
+        self.retry_max_delay = float(os.environ.get("WEBPAY_RETRY_MAX_DELAY", 1.0))
+        if use_async_client is None:
+            use_async_client = os.environ.get("WEBPAY_ASYNC_CLIENT", "true").lower() not in ("0", "false", "no")
+        self.use_async_client = use_async_client and httpx is not None
+        # Consultas simultáneas hacia Transbank al consultar estados en lote
+        self.batch_concurrency = int(os.environ.get("STATUS_BATCH_CONCURRENCY", 10))
+
+        self._transactions: Dict[str, "Transaction"] = {}
+        self._client = None
+
+        # Si Transbank está caído las llamadas fallan de inmediato en vez de acumularse
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        # Un solo commit por token: el retorno de Webpay (/payment/callback) y un
+        # /payments/confirm del cliente para el mismo token comparten la misma llamada
+        self.commit_store = commit_store if commit_store is not None else IdempotencyStore(
+            ttl=float(os.environ.get("COMMIT_DEDUP_TTL", 900))
+        )
+
+        # Caché de estados: consultas repetidas del mismo token no llegan a Transbank
+        self.status_cache = status_cache if status_cache is not None else StatusCache()
+
+        # Funciones que reciben cada resultado obtenido de Transbank (ledger, ...)
+        self._result_listeners: List[Callable[..., None]] = []
+        # Funciones que reciben la duración de cada llamada a Transbank (métricas, ...)
+        self._call_listeners: List[Callable[..., None]] = []
+        # Llamadas a Transbank en curso por operación
+        self.inflight: Dict[str, int] = {"create": 0, "commit": 0, "status": 0, "refund": 0}
+
+    def add_result_listener(self, listener: Callable[..., None]) -> None:
+        """
+        Registra una función que recibe cada resultado obtenido de Transbank
+
+        Se llama como listener(operation, token, resultado, **context), donde operation
+        es create, commit, status o refund. No debe bloquear: corre en el flujo de pago.
+        """
+        self._result_listeners.append(listener)
+
+    def add_call_listener(self, listener: Callable[..., None]) -> None:
+        """
+        Registra una función que recibe la duración de cada llamada a Transbank
+
+        Se llama como listener(operation, duration, error), con la duración en segundos
+        y error=None si la llamada fue exitosa. Debe ser barata: corre en el flujo de pago.
+        """
+        self._call_listeners.append(listener)
+
+    def _observe_call(self, operation: str, duration: float, error: Optional[BaseException]) -> None:
+        for listener in self._call_listeners:
+            try:
+                listener(operation, duration, error)
+            except Exception:
+                logger.exception("Error en listener de llamadas a Webpay")
+
+    def _key(self, token: str) -> Tuple[Optional[str], str]:
+        """
+        Clave de un token en status_cache y commit_store (compartidos entre sucursales)
+        """
+        return (self.tenant, token)
+
+    def _notify(self, operation: str, token: Optional[str], resultado: Result, **context: Any) -> None:
+        if self.tenant is not None:
+            context["tenant"] = self.tenant
+        for listener in self._result_listeners:
+            try:
+                listener(operation, token, resultado, **context)
+            except Exception:
+                logger.exception("Error en listener de resultados de Webpay")
+
+    def _get_transaction(self, operation: str) -> "Transaction":
         """
-        # Credenciales oficiales de integración de Transbank
-        # Código de comercio de integración
-        self.commerce_code = "597055555532"
-        # API Key de integración (también llamada "secret key")
-        self.api_key = "579B532A7440BB0C9079DED94D31EA1615BACEB56610332264630D42D0A36B1C"
-    
-    def _get_transaction(self) -> Transaction:
+        Obtiene la instancia de Transaction para el ambiente de INTEGRACIÓN
+        Se construye una por operación (cada una con su timeout) y se reutiliza entre llamadas
+        """
+        transaction = self._transactions.get(operation)
+        if transaction is None:
+            # Importación diferida: con el cliente async el SDK no se carga al iniciar
+            from transbank.webpay.webpay_plus.transaction import Transaction
+
+            transaction = Transaction.build_for_integration(self.commerce_code, self.api_key)
+            transaction.options.timeout = self.timeouts[operation]
+            self._transactions[operation] = transaction
+        return transaction
+
+    def for_tenant(
+        self,
+        tenant: str,
+        commerce_code: str,
+        api_key: str,
+        pool_size: Optional[int] = None,
+        keepalive_connections: Optional[int] = None
+    ) -> "WebpayService":
         """
-        Crea una instancia de Transaction para el ambiente de INTEGRACIÓN
+        Crea el servicio de otra sucursal (otras credenciales, su propio pool de conexiones)
+
+        Comparte con este servicio lo que no depende del comercio: circuit breaker (mismo
+        Transbank), listeners y contadores de llamadas en curso. La caché de estados y de
+        commits también se comparte, pero con claves (sucursal, token): una sucursal nunca
+        recibe el resultado obtenido con las credenciales de otra.
         """
-        return Transaction.build_for_integration(self.commerce_code, self.api_key)
-    
-    def create_transaction(self, buy_order: str, session_id: str, amount: float, return_url: str) -> Dict[str, Any]:
+        service = WebpayService(
+            commerce_code=commerce_code,
+            api_key=api_key,
+            pool_size=pool_size,
+            keepalive_connections=keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+            timeout=self.timeout,
+            use_async_client=self.use_async_client,
+            status_cache=self.status_cache,
+            breaker=self.breaker,
+            commit_store=self.commit_store,
+            tenant=tenant
+        )
+        service.base_url = self.base_url
+        service.timeouts = self.timeouts
+        service._result_listeners = self._result_listeners
+        service._call_listeners = self._call_listeners
+        service.inflight = self.inflight
+        return service
+
+    def preload(self) -> None:
+        """
+        Carga el SDK de Transbank y construye sus instancias, si se usa el respaldo síncrono
+
+        Se llama antes de crear los workers del servidor (Server/serve.py) y en el
+        lifespan, para no pagar la importación del SDK en la primera petición. El
+        cliente httpx no se crea aquí: sus conexiones no deben compartirse entre
+        procesos (ver connect).
+        """
+        if self.use_async_client:
+            return
+        for operation in self.timeouts:
+            self._get_transaction(operation)
+
+    def connect(self) -> None:
+        """
+        Crea el cliente HTTP del worker (se llama en el lifespan, después del fork)
+        """
+        if self.use_async_client:
+            self._get_client()
+
+    def _get_client(self) -> "httpx.AsyncClient":
+        """
+        Obtiene el cliente HTTP asíncrono compartido (se crea en el primer uso)
+        """
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={
+                    "Tbk-Api-Key-Id": self.commerce_code,
+                    "Tbk-Api-Key-Secret": self.api_key,
+                    "Content-Type": "application/json"
+                },
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.keepalive_connections,
+                    keepalive_expiry=self.keepalive_expiry
+                ),
+                timeout=self.timeout
+            )
+        return self._client
+
+    def _call_sdk(self, operation: str, *args: Any) -> Any:
+        """
+        Ejecuta una operación del SDK de Transbank (create, commit, status, refund) midiendo su duración
+        """
+        trial = self.breaker.before_call()
+        self.inflight[operation] += 1
+        start = time.perf_counter()
+        error = None
+        try:
+            return getattr(self._get_transaction(operation), operation)(*args)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.inflight[operation] -= 1
+            self.breaker.record(error, trial)
+            self._observe_call(operation, time.perf_counter() - start, error)
+
+    async def _request(
+        self, operation: str, method: str, path: str, payload: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Ejecuta una llamada a la API REST de Webpay usando el pool de conexiones
+        """
+        trial = self.breaker.before_call()
+        self.inflight[operation] += 1
+        start = time.perf_counter()
+        error = None
+        try:
+            response = await self._get_client().request(
+                method, WEBPAY_TRANSACTIONS_PATH + path, json=payload, timeout=self.timeouts[operation]
+            )
+            if not 200 <= response.status_code < 300:
+                try:
+                    data = response.json()
+                except ValueError:
+                    data = {}
+                message = data.get("error_message") or data.get("description") or response.text
+                raise WebpayError(message, response.status_code)
+            return response.json() if response.content else {}
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.inflight[operation] -= 1
+            self.breaker.record(error, trial)
+            self._observe_call(operation, time.perf_counter() - start, error)
+
+    async def aclose(self) -> None:
+        """
+        Cierra el cliente HTTP compartido y libera las conexiones del pool
+        """
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _should_retry(self, attempt: int, error: BaseException) -> bool:
+        return attempt < self.status_retries and is_upstream_failure(error) and self.breaker.state == CircuitBreaker.CLOSED
+
+    def _retry_sync(self, call: Callable[..., Any], *args: Any) -> Any:
+        """
+        Ejecuta una llamada idempotente reintentando fallas de Transbank con backoff y jitter
+        """
+        attempt = 0
+        while True:
+            try:
+                return call(*args)
+            except Exception as e:
+                if not self._should_retry(attempt, e):
+                    raise
+            time.sleep(retry_delay(attempt, self.retry_base_delay, self.retry_max_delay))
+            attempt += 1
+
+    async def _retry_async(self, call: Callable[..., Awaitable[Any]], *args: Any) -> Any:
+        """
+        Versión asíncrona de _retry_sync
+        """
+        attempt = 0
+        while True:
+            try:
+                return await call(*args)
+            except Exception as e:
+                if not self._should_retry(attempt, e):
+                    raise
+            await asyncio.sleep(retry_delay(attempt, self.retry_base_delay, self.retry_max_delay))
+            attempt += 1
+
+    def create_transaction(self, buy_order: str, session_id: str, amount: float, return_url: str) -> Result:
         """
         Crea una nueva transacción de pago
-        
+
         Args:
             buy_order: Orden de compra (máx 26 caracteres)
             session_id: ID de sesión único
             amount: Monto de la transacción
             return_url: URL a la que Webpay redirigirá después del pago
-            
+
         Returns:
-            Dict con success, url y token de la transacción
+            CreateResult con url y token de la transacción (ErrorResult si falla)
         """
         try:
-            tx = self._get_transaction()
-            response = tx.create(buy_order, session_id, amount, return_url)
-            
-            # Manejar respuesta según versión del SDK
-            # Versión 3.x usa diccionarios, versión 2.x usa objetos
-            if isinstance(response, dict):
-                # Versión 3.x
-                return {
-                    "success": True,
-                    "url": response.get('url'),
-                    "token": response.get('token'),
-                    "buy_order": buy_order,
-                    "session_id": session_id,
-                    "amount": amount
-                }
-            else:
-                # Versión 2.x
-                return {
-                    "success": True,
-                    "url": response.url,
-                    "token": response.token,
-                    "buy_order": buy_order,
-                    "session_id": session_id,
-                    "amount": amount
-                }
+            response = self._call_sdk("create", buy_order, session_id, amount, return_url)
+            resultado = CreateResult.from_response(response, buy_order, session_id, amount)
         except Exception as e:
-            return {
-                "success": False,
-                "error": f"Error al crear transacción: {str(e)}"
-            }
-    
-    def commit_transaction(self, token: str) -> Dict[str, Any]:
+            resultado = ErrorResult(f"Error al crear transacción: {str(e) or type(e).__name__}", code=error_code(e))
+        self._notify("create", resultado.get("token"), resultado,
+                     buy_order=buy_order, session_id=session_id, amount=amount)
+        return resultado
+
+    def commit_transaction(self, token: str) -> Result:
         """
         Confirma una transacción después del pago
-        
+
         Args:
             token: Token de la transacción a confirmar
-            
+
         Returns:
-            Dict con toda la información de la transacción confirmada
+            TransactionResult con toda la información de la transacción confirmada
         """
+        return self.commit_store.run(self._key(token), None, lambda: self._commit(token))
+
+    def _commit(self, token: str) -> Result:
         try:
-            tx = self._get_transaction()
-            response = tx.commit(token)
-            
-            # Manejar respuesta según versión del SDK
-            if isinstance(response, dict):
-                # Versión 3.x
-                return {
-                    "success": True,
-                    "vci": response.get('vci'),
-                    "amount": response.get('amount'),
-                    "status": response.get('status'),
-                    "buy_order": response.get('buy_order'),
-                    "session_id": response.get('session_id'),
-                    "card_detail": response.get('card_detail'),
-                    "accounting_date": response.get('accounting_date'),
-                    "transaction_date": response.get('transaction_date'),
-                    "authorization_code": response.get('authorization_code'),
-                    "payment_type_code": response.get('payment_type_code'),
-                    "response_code": response.get('response_code'),
-                    "installments_amount": response.get('installments_amount'),
-                    "installments_number": response.get('installments_number'),
-                    "balance": response.get('balance')
-                }
-            else:
-                # Versión 2.x
-                return {
-                    "success": True,
-                    "vci": response.vci,
-                    "amount": response.amount,
-                    "status": response.status,
-                    "buy_order": response.buy_order,
-                    "session_id": response.session_id,
-                    "card_detail": response.card_detail,
-                    "accounting_date": response.accounting_date,
-                    "transaction_date": response.transaction_date,
-                    "authorization_code": response.authorization_code,
-                    "payment_type_code": response.payment_type_code,
-                    "response_code": response.response_code,
-                    "installments_amount": response.installments_amount,
-                    "installments_number": response.installments_number,
-                    "balance": response.balance
-                }
+            response = self._call_sdk("commit", token)
+            resultado = TransactionResult.from_response(response)
         except Exception as e:
-            return {
-                "success": False,
-                "error": f"Error al confirmar transacción: {str(e)}"
-            }
-    
-    def get_status(self, token: str) -> Dict[str, Any]:
+            resultado = ErrorResult(f"Error al confirmar transacción: {str(e) or type(e).__name__}", code=error_code(e))
+        self.status_cache.set(self._key(token), resultado)
+        self._notify("commit", token, resultado)
+        return resultado
+
+    def get_status(self, token: str) -> Result:
         """
         Obtiene el estado actual de una transacción
-        
+
         Args:
             token: Token de la transacción
-            
+
         Returns:
-            Dict con el estado completo de la transacción
+            TransactionResult con el estado completo de la transacción
         """
+        return self.status_cache.get_or_load(self._key(token), lambda key: self._fetch_status(token))
+
+    def _fetch_status(self, token: str) -> Result:
         try:
-            tx = self._get_transaction()
-            response = tx.status(token)
-            
-            # Manejar respuesta según versión del SDK
-            if isinstance(response, dict):
-                # Versión 3.x
-                return {
-                    "success": True,
-                    "vci": response.get('vci'),
-                    "amount": response.get('amount'),
-                    "status": response.get('status'),
-                    "buy_order": response.get('buy_order'),
-                    "session_id": response.get('session_id'),
-                    "card_detail": response.get('card_detail'),
-                    "accounting_date": response.get('accounting_date'),
-                    "transaction_date": response.get('transaction_date'),
-                    "authorization_code": response.get('authorization_code'),
-                    "payment_type_code": response.get('payment_type_code'),
-                    "response_code": response.get('response_code'),
-                    "installments_amount": response.get('installments_amount'),
-                    "installments_number": response.get('installments_number'),
-                    "balance": response.get('balance')
-                }
-            else:
-                # Versión 2.x
-                return {
-                    "success": True,
-                    "vci": response.vci,
-                    "amount": response.amount,
-                    "status": response.status,
-                    "buy_order": response.buy_order,
-                    "session_id": response.session_id,
-                    "card_detail": response.card_detail,
-                    "accounting_date": response.accounting_date,
-                    "transaction_date": response.transaction_date,
-                    "authorization_code": response.authorization_code,
-                    "payment_type_code": response.payment_type_code,
-                    "response_code": response.response_code,
-                    "installments_amount": response.installments_amount,
-                    "installments_number": response.installments_number,
-                    "balance": response.balance
-                }
+            response = self._retry_sync(self._call_sdk, "status", token)
+            resultado = TransactionResult.from_response(response)
         except Exception as e:
-            return {
-                "success": False,
-                "error": f"Error al obtener estado de transacción: {str(e)}"
-            }
-    
-    def refund_transaction(self, token: str, amount: float) -> Dict[str, Any]:
+            resultado = ErrorResult(f"Error al obtener estado de transacción: {str(e) or type(e).__name__}", code=error_code(e))
+        self._notify("status", token, resultado)
+        return resultado
+
+    def refund_transaction(self, token: str, amount: float) -> Result:
         """
         Realiza un reembolso de una transacción
-        
+
         Args:
             token: Token de la transacción a reembolsar
             amount: Monto a reembolsar
-            
+
         Returns:
-            Dict con el resultado del reembolso
+            RefundResult con el resultado del reembolso
+        """
+        try:
+            response = self._call_sdk("refund", token, amount)
+            resultado = RefundResult.from_response(response)
+        except Exception as e:
+            resultado = ErrorResult(f"Error al realizar reembolso: {str(e) or type(e).__name__}", code=error_code(e))
+        self.status_cache.invalidate(self._key(token))
+        self._notify("refund", token, resultado, amount=amount)
+        return resultado
+
+    async def create_transaction_async(self, buy_order: str, session_id: str, amount: float, return_url: str) -> Result:
+        """
+        Versión asíncrona de create_transaction
+        """
+        if not self.use_async_client:
+            return await asyncio.to_thread(self.create_transaction, buy_order, session_id, amount, return_url)
+        try:
+            _require_text(buy_order, BUY_ORDER_LENGTH, "buy_order")
+            _require_text(session_id, SESSION_ID_LENGTH, "session_id")
+            _require_text(return_url, RETURN_URL_LENGTH, "return_url")
+            response = await self._request("create", "POST", "", {
+                "buy_order": buy_order,
+                "session_id": session_id,
+                "amount": amount,
+                "return_url": return_url
+            })
+            resultado = CreateResult.from_response(response, buy_order, session_id, amount)
+        except Exception as e:
+            resultado = ErrorResult(f"Error al crear transacción: {str(e) or type(e).__name__}", code=error_code(e))
+        self._notify("create", resultado.get("token"), resultado,
+                     buy_order=buy_order, session_id=session_id, amount=amount)
+        return resultado
+
+    async def commit_transaction_async(self, token: str) -> Result:
+        """
+        Versión asíncrona de commit_transaction
+        """
+        return await self.commit_store.run_async(self._key(token), None, lambda: self._commit_async(token))
+
+    async def _commit_async(self, token: str) -> Result:
+        if not self.use_async_client:
+            return await asyncio.to_thread(self._commit, token)
+        try:
+            _require_text(token, TOKEN_LENGTH, "token")
+            response = await self._request("commit", "PUT", f"/{quote(token, safe='')}")
+            resultado = TransactionResult.from_response(response)
+        except Exception as e:
+            resultado = ErrorResult(f"Error al confirmar transacción: {str(e) or type(e).__name__}", code=error_code(e))
+        self.status_cache.set(self._key(token), resultado)
+        self._notify("commit", token, resultado)
+        return resultado
+
+    async def get_status_async(self, token: str) -> Result:
+        """
+        Versión asíncrona de get_status
+        """
+        return await self.status_cache.get_or_load_async(
+            self._key(token), lambda key: self._fetch_status_async(token)
+        )
+
+    async def _fetch_status_async(self, token: str) -> Result:
+        if not self.use_async_client:
+            return await asyncio.to_thread(self._fetch_status, token)
+        try:
+            _require_text(token, TOKEN_LENGTH, "token")
+            response = await self._retry_async(self._request, "status", "GET", f"/{quote(token, safe='')}")
+            resultado = TransactionResult.from_response(response)
+        except Exception as e:
+            resultado = ErrorResult(f"Error al obtener estado de transacción: {str(e) or type(e).__name__}", code=error_code(e))
+        self._notify("status", token, resultado)
+        return resultado
+
+    async def iter_status_many(
+        self, tokens: Iterable[str], concurrency: Optional[int] = None
+    ) -> AsyncIterator[Tuple[str, Result]]:
+        """
+        Consulta el estado de varias transacciones y entrega cada resultado apenas está listo
+
+        Args:
+            tokens: Tokens a consultar (los repetidos se consultan una sola vez)
+            concurrency: Máximo de consultas simultáneas hacia Transbank
+
+        Yields:
+            Tuplas (token, resultado) en orden de llegada
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.batch_concurrency)
+
+        async def consultar(token: str) -> Tuple[str, Result]:
+            async with semaphore:
+                return token, await self.get_status_async(token)
+
+        tasks = [asyncio.ensure_future(consultar(token)) for token in dict.fromkeys(tokens)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # Si el consumidor abandona (ej. el cliente se desconecta) no quedan consultas colgando
+            for task in tasks:
+                task.cancel()
+
+    async def get_status_many(
+        self, tokens: Iterable[str], concurrency: Optional[int] = None
+    ) -> Dict[str, Result]:
+        """
+        Consulta el estado de varias transacciones con concurrencia acotada
+
+        Returns:
+            Dict token -> resultado, en el orden en que se recibieron los tokens
+        """
+        tokens = list(dict.fromkeys(tokens))
+        resultados = {token: None for token in tokens}
+        async for token, resultado in self.iter_status_many(tokens, concurrency):
+            resultados[token] = resultado
+        return resultados
+
+    async def refund_transaction_async(self, token: str, amount: float) -> Result:
+        """
+        Versión asíncrona de refund_transaction
         """
+        if not self.use_async_client:
+            return await asyncio.to_thread(self.refund_transaction, token, amount)
         try:
-            tx = self._get_transaction()
-            response = tx.refund(token, amount)
-            
-            # Manejar respuesta según versión del SDK
-            if isinstance(response, dict):
-                # Versión 3.x
-                return {
-                    "success": True,
-                    "type": response.get('type'),
-                    "authorization_code": response.get('authorization_code'),
-                    "authorization_date": response.get('authorization_date'),
-                    "nullified_amount": response.get('nullified_amount'),
-                    "balance": response.get('balance'),
-                    "response_code": response.get('response_code')
-                }
-            else:
-                # Versión 2.x
-                return {
-                    "success": True,
-                    "type": response.type,
-                    "authorization_code": response.authorization_code,
-                    "authorization_date": response.authorization_date,
-                    "nullified_amount": response.nullified_amount,
-                    "balance": response.balance,
-                    "response_code": response.response_code
-                }
+            _require_text(token, TOKEN_LENGTH, "token")
+            response = await self._request("refund", "POST", f"/{quote(token, safe='')}/refunds", {"amount": amount})
+            resultado = RefundResult.from_response(response)
         except Exception as e:
-            return {
-                "success": False,
-                "error": f"Error al realizar reembolso: {str(e)}"
-            }
+            resultado = ErrorResult(f"Error al realizar reembolso: {str(e) or type(e).__name__}", code=error_code(e))
+        self.status_cache.invalidate(self._key(token))
+        self._notify("refund", token, resultado, amount=amount)
+        return resultado
 
 
 # Instancia global del servicio
-webpay_service = WebpayService()
\ No newline at end of file
+webpay_service = WebpayService()
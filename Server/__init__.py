@@ -0,0 +1,3 @@
+"""
+Infraestructura HTTP del servicio: métricas y middlewares
+"""
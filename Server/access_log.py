@@ -0,0 +1,271 @@
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, List, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from Payment.resilience import error_code
+
+
+REQUEST_ID_HEADER = b"x-request-id"
+# Se acepta el X-Request-ID del cliente solo si es corto y sin caracteres de control
+_VALID_REQUEST_ID = re.compile(r"^[\w.:@/+=-]{1,128}$")
+
+# Id de correlación de la petición en curso (None fuera de una petición)
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+class _UpstreamCalls(list):
+    """
+    Llamadas a Transbank de una petición; closed cuando la petición ya se registró
+
+    Las tareas creadas durante la petición heredan el contexto: las que terminan después
+    (una consulta compartida cuyo líder se desconectó, una operación idempotente que
+    sigue en segundo plano) ven closed y registran sus llamadas por separado.
+    """
+
+    closed = False
+
+
+# Llamadas a Transbank de la petición en curso
+_upstream_calls: ContextVar[Optional[_UpstreamCalls]] = ContextVar("upstream_calls", default=None)
+
+access_logger = logging.getLogger("payments.access")
+upstream_logger = logging.getLogger("payments.upstream")
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Un objeto JSON por línea; los campos vienen en extra={"fields": {...}}
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        data.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler que descarta registros si la cola está llena en vez de bloquear la petición
+    """
+
+    def __init__(self, log_queue: "queue.Queue"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El formato JSON se aplica en el hilo del listener, no en la petición
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class AccessLog:
+    """
+    Log estructurado (JSON) de peticiones y llamadas a Transbank
+
+    Los registros pasan por una cola acotada y un QueueListener los escribe desde su
+    propio hilo, así la escritura a disco o stdout nunca corre en la petición. Solo se
+    registra una fracción sample_rate de las peticiones; las lentas (slow_ms) y las que
+    fallan (5xx o error de Transbank) se registran siempre.
+    """
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        sample_rate: Optional[float] = None,
+        slow_ms: Optional[float] = None,
+        path: Optional[str] = None,
+        max_queue: Optional[int] = None
+    ):
+        """
+        Args:
+            enabled: Activa el log (ACCESS_LOG_ENABLED)
+            sample_rate: Fracción de peticiones registradas, 0 a 1 (ACCESS_LOG_SAMPLE_RATE)
+            slow_ms: Peticiones más lentas que esto se registran siempre (ACCESS_LOG_SLOW_MS)
+            path: Archivo de destino; vacío escribe a stdout (ACCESS_LOG_FILE)
+            max_queue: Registros pendientes antes de descartar (ACCESS_LOG_MAX_QUEUE)
+        """
+        if enabled is None:
+            enabled = os.environ.get("ACCESS_LOG_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.enabled = enabled
+        if sample_rate is None:
+            sample_rate = float(os.environ.get("ACCESS_LOG_SAMPLE_RATE", 1.0))
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms or float(os.environ.get("ACCESS_LOG_SLOW_MS", 1000))
+        self.path = path if path is not None else os.environ.get("ACCESS_LOG_FILE", "")
+        self.max_queue = max_queue or int(os.environ.get("ACCESS_LOG_MAX_QUEUE", 10000))
+
+        self.handler = DroppingQueueHandler(queue.Queue(maxsize=self.max_queue))
+        self._listener: Optional[QueueListener] = None
+        for target in (access_logger, upstream_logger):
+            target.addHandler(self.handler)
+            target.setLevel(logging.INFO)
+            target.propagate = False
+
+    def start(self) -> None:
+        """
+        Inicia el hilo que escribe los registros (en cada worker, desde el lifespan)
+        """
+        if self._listener is not None:
+            return
+        output = logging.FileHandler(self.path, encoding="utf-8") if self.path else logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter())
+        self._listener = QueueListener(self.handler.queue, output, respect_handler_level=False)
+        self._listener.start()
+
+    def stop(self) -> None:
+        """
+        Escribe los registros pendientes y detiene el hilo
+        """
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.stop()
+            for output in listener.handlers:
+                output.close()
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def observe_upstream_call(self, operation: str, duration: float, error: Optional[BaseException]) -> None:
+        """
+        Listener de llamadas de WebpayService (ver add_call_listener)
+
+        Dentro de una petición la llamada se agrega a su registro de acceso; fuera de una
+        (conciliación, trabajos de reembolso) se registra sola.
+        """
+        if not self.enabled:
+            return
+        call = {
+            "operation": operation,
+            "duration_ms": round(duration * 1000, 2),
+            "outcome": "success" if error is None else error_code(error) or "error",
+        }
+        if error is not None:
+            call["error"] = f"{type(error).__name__}: {error}"
+        calls = _upstream_calls.get()
+        if calls is not None and not calls.closed:
+            calls.append(call)
+        elif error is not None or self.sampled():
+            upstream_logger.info("upstream", extra={"fields": {"request_id": request_id.get(), **call}})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "queued": self.handler.queue.qsize(),
+            "dropped": self.handler.dropped
+        }
+
+
+class AccessLogMiddleware:
+    """
+    Middleware ASGI que asigna el id de correlación y registra cada petición
+
+    Usa el encabezado X-Request-ID del cliente (o genera uno), lo retorna en la respuesta
+    y lo deja en request_id para los registros de la petición. Se agrega antes que
+    TenantMiddleware para ver la ruta ya resuelta y la sucursal.
+    """
+
+    def __init__(self, app: ASGIApp, access_log: AccessLog):
+        self.app = app
+        self.access_log = access_log
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        rid = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER:
+                value = value.decode("latin-1")
+                if _VALID_REQUEST_ID.match(value):
+                    rid = value
+                break
+        rid = rid or uuid.uuid4().hex
+        header = (REQUEST_ID_HEADER, rid.encode("latin-1"))
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [header]
+            await send(message)
+
+        calls = _UpstreamCalls()
+        rid_token = request_id.set(rid)
+        calls_token = _upstream_calls.set(calls)
+        start = time.perf_counter()
+        error: Optional[BaseException] = None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            calls.closed = True
+            request_id.reset(rid_token)
+            _upstream_calls.reset(calls_token)
+            if self.access_log.enabled:
+                self._log(scope, rid, status_code, (time.perf_counter() - start) * 1000, calls, error)
+
+    def _log(
+        self,
+        scope: Scope,
+        rid: str,
+        status_code: int,
+        duration_ms: float,
+        calls: List[Dict[str, Any]],
+        error: Optional[BaseException]
+    ) -> None:
+        failed = error is not None or status_code >= 500 or any(c["outcome"] != "success" for c in calls)
+        if not (failed or duration_ms >= self.access_log.slow_ms or self.access_log.sampled()):
+            return
+        route = scope.get("route")
+        client = scope.get("client")
+        fields = {
+            "request_id": rid,
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": getattr(route, "path", None),
+            "status": status_code,
+            "duration_ms": round(duration_ms, 2),
+            "client": client[0] if client else None,
+            "tenant": scope.get("tenant"),
+        }
+        if calls:
+            fields["upstream"] = {
+                "calls": calls,
+                "duration_ms": round(sum(c["duration_ms"] for c in calls), 2),
+                "outcome": next((c["outcome"] for c in calls if c["outcome"] != "success"), "success"),
+            }
+        if error is not None:
+            fields["error"] = f"{type(error).__name__}: {error}"
+        access_logger.log(logging.WARNING if failed else logging.INFO, "request", extra={"fields": fields})
+
+
+# Instancia global del log de acceso
+access_log = AccessLog()
@@ -0,0 +1,251 @@
+"""
+Captura opcional del tráfico de la API para reproducirlo con bench.replay
+
+Con TRAFFIC_CAPTURE_FILE se registra, por petición, el instante relativo, la ruta
+(plantilla), el estado, la duración y la forma del cuerpo (monto, cantidad de tokens).
+No se guardan tokens, buy_order ni session_id: cada token se reemplaza por una referencia
+HMAC con una clave aleatoria por captura, que solo sirve para encadenar create, callback,
+status y refund de una misma transacción dentro del archivo.
+
+Cada worker escribe su propio archivo con su pid en el nombre (capture.jsonl ->
+capture.<pid>.jsonl); bench.replay acepta varios y los une por started_at + offset_ms.
+
+Formato (una línea JSON por registro, la primera es el encabezado):
+    {"version": 1, "started_at": 1730457300.1, "pid": 4242}
+    [offset_ms, "POST", "/payments/create", 200, duration_ms, ref, {"amount": 10000}]
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_VERSION = 1
+# Cuerpos más grandes no se inspeccionan (se registra solo la ruta)
+_MAX_BODY = 64 * 1024
+# Rutas cuyo token viene en la respuesta
+_RESPONSE_TOKEN_ROUTES = ("/payments/create",)
+_STOP = object()
+
+
+class TrafficCapture:
+    """
+    Escribe la captura desde un hilo propio; la petición solo encola los datos crudos
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        sample_rate: Optional[float] = None,
+        max_records: Optional[int] = None,
+        max_queue: Optional[int] = None
+    ):
+        """
+        Args:
+            path: Archivo de la captura; vacío la desactiva (TRAFFIC_CAPTURE_FILE)
+            sample_rate: Fracción de peticiones capturadas (TRAFFIC_CAPTURE_SAMPLE_RATE)
+            max_records: Registros tras los que se deja de capturar (TRAFFIC_CAPTURE_MAX_RECORDS)
+            max_queue: Registros pendientes antes de descartar (TRAFFIC_CAPTURE_MAX_QUEUE)
+        """
+        self.path = path if path is not None else os.environ.get("TRAFFIC_CAPTURE_FILE", "")
+        if sample_rate is None:
+            sample_rate = float(os.environ.get("TRAFFIC_CAPTURE_SAMPLE_RATE", 1.0))
+        self.sample_rate = sample_rate
+        self.max_records = max_records or int(os.environ.get("TRAFFIC_CAPTURE_MAX_RECORDS", 1000000))
+        self.max_queue = max_queue or int(os.environ.get("TRAFFIC_CAPTURE_MAX_QUEUE", 10000))
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=self.max_queue)
+        self._writer: Optional[threading.Thread] = None
+        self._key = secrets.token_bytes(16)
+        self._started = time.monotonic()
+        self._started_at = time.time()
+        self.records = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def start(self) -> None:
+        """
+        Inicia el hilo escritor (en cada worker, desde el lifespan)
+        """
+        if not self.enabled or self._writer is not None:
+            return
+        # Cada worker escribe su propio archivo; los offsets se miden desde started_at
+        root, ext = os.path.splitext(self.path)
+        path = f"{root}.{os.getpid()}{ext}"
+        self._started = time.monotonic()
+        self._started_at = time.time()
+        self._writer = threading.Thread(target=self._run, args=(path,), name="traffic-capture", daemon=True)
+        self._writer.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(_STOP)
+            writer.join(timeout)
+
+    def wants(self) -> bool:
+        return (
+            self._writer is not None
+            and self.records < self.max_records
+            and (self.sample_rate >= 1 or random.random() < self.sample_rate)
+        )
+
+    def offer(self, entry: Tuple[Any, ...]) -> None:
+        try:
+            self._queue.put_nowait(entry)
+            self.records += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def offset_ms(self) -> float:
+        return (time.monotonic() - self._started) * 1000
+
+    def _ref(self, token: Any) -> Optional[str]:
+        if not isinstance(token, str) or not token:
+            return None
+        return hmac.new(self._key, token.encode(), hashlib.sha256).hexdigest()[:12]
+
+    def sanitize(
+        self,
+        offset: float,
+        method: str,
+        route: str,
+        path_params: Dict[str, Any],
+        query: bytes,
+        status: int,
+        duration_ms: float,
+        body: bytes,
+        response: bytes
+    ) -> List[Any]:
+        """
+        Convierte los datos crudos de una petición en un registro sin datos identificables
+        """
+        shape: Dict[str, Any] = {}
+        token = path_params.get("token")
+        if route == "/payment/callback":
+            token = (parse_qs(query.decode("latin-1")).get("token_ws") or [None])[0]
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            if isinstance(data.get("amount"), (int, float)):
+                shape["amount"] = round(data["amount"])
+            token = data.get("token", token)
+            if isinstance(data.get("tokens"), list):
+                shape["refs"] = [self._ref(t) for t in data["tokens"]]
+            if isinstance(data.get("refunds"), list):
+                shape["refunds"] = [
+                    [self._ref(r.get("token")), round(r.get("amount") or 0)]
+                    for r in data["refunds"] if isinstance(r, dict)
+                ]
+        if route in _RESPONSE_TOKEN_ROUTES and response:
+            try:
+                token = json.loads(response).get("token")
+            except (ValueError, AttributeError):
+                token = None
+        return [round(offset, 1), method, route, status, round(duration_ms, 2), self._ref(token), shape or None]
+
+    def _run(self, path: str) -> None:
+        with open(path, "a", encoding="utf-8") as f:
+            header = {"version": CAPTURE_VERSION, "started_at": self._started_at, "pid": os.getpid()}
+            f.write(json.dumps(header) + "\n")
+            while True:
+                entry = self._queue.get()
+                batch = [entry]
+                while entry is not _STOP and len(batch) < 500:
+                    try:
+                        entry = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    batch.append(entry)
+                for item in batch:
+                    if item is _STOP:
+                        continue
+                    try:
+                        f.write(json.dumps(self.sanitize(*item), separators=(",", ":")) + "\n")
+                    except Exception:
+                        logger.exception("Error al escribir la captura de tráfico")
+                f.flush()
+                if batch[-1] is _STOP:
+                    return
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "records": self.records, "dropped": self.dropped}
+
+
+class CaptureMiddleware:
+    """
+    Middleware ASGI que entrega cada petición a TrafficCapture (solo si está activa)
+    """
+
+    def __init__(self, app: ASGIApp, capture: TrafficCapture):
+        self.app = app
+        self.capture = capture
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.capture.wants():
+            await self.app(scope, receive, send)
+            return
+
+        offset = self.capture.offset_ms()
+        body: List[bytes] = []
+        response: List[bytes] = []
+        size = 0
+        status_code = 500
+
+        async def receive_wrapper() -> Message:
+            nonlocal size
+            message = await receive()
+            if message["type"] == "http.request" and size < _MAX_BODY:
+                chunk = message.get("body", b"")
+                body.append(chunk)
+                size += len(chunk)
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body" and status_code == 200:
+                if getattr(scope.get("route"), "path", None) in _RESPONSE_TOKEN_ROUTES:
+                    response.append(message.get("body", b""))
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", None)
+            if route is not None:
+                self.capture.offer((
+                    offset,
+                    scope["method"],
+                    route,
+                    dict(scope.get("path_params") or {}),
+                    scope.get("query_string", b""),
+                    status_code,
+                    (time.perf_counter() - start) * 1000,
+                    b"".join(body) if size < _MAX_BODY else b"",
+                    b"".join(response)
+                ))
+
+
+# Instancia global de la captura (inactiva sin TRAFFIC_CAPTURE_FILE)
+traffic_capture = TrafficCapture()
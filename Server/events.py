@@ -0,0 +1,214 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from Payment.models import Result
+
+
+logger = logging.getLogger(__name__)
+
+# Estados que no son un resultado final del pago
+PENDING_STATUSES = ("INITIALIZED",)
+
+Key = Tuple[Optional[str], str, str]
+
+# Busca en el ledger el resultado final de varias claves: {clave: transacción}
+LedgerLookup = Callable[[List[Key]], Dict[Key, Dict[str, Any]]]
+
+
+class TooManySubscribersError(Exception):
+    """
+    Se alcanzó el máximo de suscriptores del proceso
+    """
+
+
+class PaymentEventHub:
+    """
+    Pub/sub en memoria de los resultados de pago, por token o buy_order
+
+    Se registra como listener de resultados de WebpayService: cada commit (por
+    /payment/callback o /payments/confirm) y cada consulta de estado con resultado final
+    se publica a los suscriptores de su token y de su buy_order. Cada suscriptor es solo
+    un Future en un dict, así miles de conexiones en espera usan poca memoria. Los
+    resultados recientes se guardan para quien se suscribe justo después del commit.
+
+    Un commit ejecutado por otro worker no pasa por este hub: cada ledger_interval
+    segundos una sola consulta al ledger (lookup, en un hilo) revisa todas las claves con
+    suscriptores, en vez de una consulta por conexión.
+
+    Las suscripciones ocupan conexiones del límite de uvicorn (WEB_LIMIT_CONCURRENCY): por
+    defecto pueden usar la mitad, así el resto de las rutas conserva la otra mitad.
+    """
+
+    def __init__(
+        self,
+        max_subscribers: Optional[int] = None,
+        recent_size: Optional[int] = None,
+        recent_ttl: Optional[float] = None,
+        ledger_interval: Optional[float] = None,
+        lookup: Optional[LedgerLookup] = None
+    ):
+        """
+        Args:
+            max_subscribers: Suscriptores simultáneos como máximo (PAYMENT_EVENTS_MAX_SUBSCRIBERS,
+                por defecto la mitad de WEB_LIMIT_CONCURRENCY)
+            recent_size: Resultados recientes guardados (PAYMENT_EVENTS_RECENT_SIZE)
+            recent_ttl: Segundos que se guarda un resultado reciente (PAYMENT_EVENTS_RECENT_TTL)
+            ledger_interval: Segundos entre revisiones del ledger (PAYMENT_EVENTS_LEDGER_INTERVAL)
+            lookup: Consulta al ledger de las claves con suscriptores
+        """
+        self.max_subscribers = max_subscribers or _max_subscribers()
+        self.recent_size = recent_size or int(os.environ.get("PAYMENT_EVENTS_RECENT_SIZE", 10000))
+        self.recent_ttl = recent_ttl or float(os.environ.get("PAYMENT_EVENTS_RECENT_TTL", 300))
+        self.ledger_interval = ledger_interval or float(os.environ.get("PAYMENT_EVENTS_LEDGER_INTERVAL", 15))
+        self.lookup = lookup
+
+        self._subscribers: Dict[Key, Set[asyncio.Future]] = {}
+        self._recent: "OrderedDict[Key, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._count = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self._sweeper: Optional[asyncio.Task] = None
+        self.published = 0
+        self.delivered = 0
+        self.ledger_sweeps = 0
+
+    def start(self) -> None:
+        """
+        Asocia el hub al event loop actual (los resultados de otros hilos se publican en él)
+        e inicia la revisión periódica del ledger
+        """
+        self._loop = asyncio.get_running_loop()
+        if self.lookup is not None and (self._sweeper is None or self._sweeper.done()):
+            # Contexto vacío: si start corre dentro de una petición (subscribe), la revisión no hereda su id
+            self._sweeper = contextvars.Context().run(self._loop.create_task, self._sweep_ledger())
+
+    async def stop(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+    def record(self, operation: str, token: Optional[str], resultado: Result, **context: Any) -> None:
+        """
+        Listener de WebpayService: publica commits y estados finales
+        """
+        if operation not in ("commit", "status") or not token:
+            return
+        status = resultado.get("status")
+        # Un error de comunicación no es un resultado del pago (la conciliación lo resolverá)
+        if status is None or status in PENDING_STATUSES:
+            return
+        tenant = context.get("tenant")
+        event = {"operation": operation, "token": token, "tenant": tenant, **resultado.to_dict()}
+        keys = [(tenant, "token", token)]
+        if resultado.get("buy_order"):
+            keys.append((tenant, "buy_order", resultado.get("buy_order")))
+
+        loop = self._loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if loop is None or running is loop:
+            self._publish(keys, event)
+        elif not loop.is_closed():
+            # Commit por la ruta síncrona (hilo del threadpool)
+            loop.call_soon_threadsafe(self._publish, keys, event)
+
+    def _publish(self, keys: list, event: Dict[str, Any]) -> None:
+        now = time.monotonic()
+        self.published += 1
+        with self._lock:
+            for key in keys:
+                self._recent[key] = (now, event)
+                self._recent.move_to_end(key)
+            while len(self._recent) > self.recent_size:
+                self._recent.popitem(last=False)
+        for key in keys:
+            self._deliver(key, event)
+
+    def _deliver(self, key: Key, event: Dict[str, Any]) -> None:
+        for future in self._subscribers.pop(key, ()):
+            if not future.done():
+                future.set_result(event)
+                self.delivered += 1
+
+    async def _sweep_ledger(self) -> None:
+        while True:
+            await asyncio.sleep(self.ledger_interval)
+            keys = list(self._subscribers)
+            if not keys:
+                continue
+            try:
+                found = await asyncio.to_thread(self.lookup, keys)
+            except Exception:
+                logger.exception("Error al revisar el ledger para /payments/events")
+                continue
+            self.ledger_sweeps += 1
+            for key, transaction in found.items():
+                self._deliver(key, {"operation": "ledger", **transaction, "tenant": key[0]})
+
+    def recent(self, key: Key) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._recent.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.recent_ttl:
+            return None
+        return entry[1]
+
+    def subscribe(self, key: Key) -> asyncio.Future:
+        """
+        Retorna un Future que se resuelve con el próximo resultado de la clave
+
+        Raises:
+            TooManySubscribersError: si se alcanzó max_subscribers
+        """
+        if self._count >= self.max_subscribers:
+            raise TooManySubscribersError("Demasiados suscriptores, reintente más tarde")
+        if self._loop is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._subscribers.setdefault(key, set()).add(future)
+        self._count += 1
+        future.add_done_callback(lambda f: self._discard(key, f))
+        return future
+
+    def _discard(self, key: Key, future: asyncio.Future) -> None:
+        self._count -= 1
+        subscribers = self._subscribers.get(key)
+        if subscribers is not None:
+            subscribers.discard(future)
+            if not subscribers:
+                del self._subscribers[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": self._count,
+            "keys": len(self._subscribers),
+            "recent": len(self._recent),
+            "published": self.published,
+            "delivered": self.delivered,
+            "ledger_sweeps": self.ledger_sweeps
+        }
+
+
+def _max_subscribers() -> int:
+    limit = int(os.environ.get("WEB_LIMIT_CONCURRENCY", 1000))
+    configured = int(os.environ.get("PAYMENT_EVENTS_MAX_SUBSCRIBERS", limit // 2 if limit else 10000))
+    if limit and configured >= limit:
+        # Con todas las conexiones ocupadas por suscripciones el resto de las rutas respondería 503
+        logger.warning(
+            "PAYMENT_EVENTS_MAX_SUBSCRIBERS=%d no cabe en WEB_LIMIT_CONCURRENCY=%d; se usa %d",
+            configured, limit, limit // 2
+        )
+        return limit // 2
+    return configured
+
+
+# Instancia global del hub de resultados de pago
+payment_events = PaymentEventHub()
@@ -0,0 +1,299 @@
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import anyio.to_thread
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from Notifications.dispatcher import NotificationDispatcher
+from Payment.resilience import CircuitBreaker
+from Payment.webpay_service import WebpayError, WebpayService
+
+
+# Buckets en segundos: cubren desde respuestas locales hasta timeouts de Transbank
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    pairs = [
+        '{}="{}"'.format(name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in items
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in items
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [conteo por bucket (no acumulado)..., conteo +Inf, suma]
+        self._values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._values.items()]
+        lines = self.header()
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = 'le="{}"'.format(_format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Registro mínimo de métricas en formato de texto de Prometheus
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Latencia de las peticiones HTTP por ruta", ("method", "route", "status")
+))
+http_requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "Peticiones HTTP en curso"
+))
+http_errors = registry.register(Counter(
+    "http_errors_total", "Respuestas con error por ruta y tipo", ("route", "type")
+))
+upstream_duration = registry.register(Histogram(
+    "webpay_upstream_duration_seconds", "Latencia de las llamadas a Transbank por operación", ("operation", "outcome")
+))
+upstream_in_flight = registry.register(Gauge(
+    "webpay_upstream_in_flight", "Llamadas a Transbank en curso por operación", ("operation",)
+))
+upstream_errors = registry.register(Counter(
+    "webpay_upstream_errors_total", "Errores de las llamadas a Transbank por operación y tipo", ("operation", "type")
+))
+upstream_circuit_state = registry.register(Gauge(
+    "webpay_circuit_state", "Estado del circuit breaker hacia Transbank (0 cerrado, 1 semiabierto, 2 abierto)"
+))
+notifications_queue_depth = registry.register(Gauge(
+    "notifications_queue_depth", "Notificaciones esperando entrega"
+))
+notifications_dead_letter = registry.register(Gauge(
+    "notifications_dead_letter", "Notificaciones descartadas tras agotar los reintentos de entrega"
+))
+notifications_delivery_lag = registry.register(Histogram(
+    "notifications_delivery_lag_seconds", "Tiempo desde que se encola una notificación hasta su entrega", ("sink",)
+))
+notifications_delivered = registry.register(Counter(
+    "notifications_delivered_total", "Notificaciones entregadas por destino y resultado", ("sink", "outcome")
+))
+threadpool_busy = registry.register(Gauge(
+    "threadpool_busy_threads", "Hilos ocupados por pool", ("pool",)
+))
+threadpool_capacity = registry.register(Gauge(
+    "threadpool_capacity_threads", "Máximo de hilos por pool", ("pool",)
+))
+threadpool_queued = registry.register(Gauge(
+    "threadpool_queued_tasks", "Tareas esperando un hilo libre por pool", ("pool",)
+))
+
+
+_CIRCUIT_STATES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+
+def error_type(error: BaseException) -> str:
+    """
+    Tipo de error para las etiquetas: código HTTP de Transbank o nombre de la excepción
+    """
+    if isinstance(error, WebpayError) and error.code is not None:
+        return f"http_{error.code}"
+    return type(error).__name__
+
+
+def observe_upstream_call(operation: str, duration: float, error: Optional[BaseException]) -> None:
+    """
+    Listener de llamadas de WebpayService (ver add_call_listener)
+    """
+    upstream_duration.observe(duration, operation, "success" if error is None else "error")
+    if error is not None:
+        upstream_errors.inc(operation, error_type(error))
+
+
+def observe_notification_delivery(
+    sink: str, categoria: Any, count: int, lag: float, error: Optional[BaseException]
+) -> None:
+    """
+    Listener de entregas de NotificationDispatcher (ver add_delivery_listener)
+    """
+    notifications_delivery_lag.observe(lag, sink)
+    notifications_delivered.inc(sink, "success" if error is None else "error", amount=count)
+
+
+def collect(service: WebpayService, notifications: Optional[NotificationDispatcher] = None) -> None:
+    """
+    Actualiza las métricas que se leen al momento de exportar (debe correr en el event loop)
+    """
+    if notifications is not None:
+        notifications_queue_depth.set(value=notifications.depth)
+        notifications_dead_letter.set(value=notifications.dead_letter)
+    for operation, count in service.inflight.items():
+        upstream_in_flight.set(operation, value=count)
+    upstream_circuit_state.set(value=_CIRCUIT_STATES[service.breaker.state])
+
+    # Pool de anyio: rutas síncronas (def) de FastAPI/Starlette
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    threadpool_busy.set("anyio", value=limiter.borrowed_tokens)
+    threadpool_capacity.set("anyio", value=limiter.total_tokens)
+    threadpool_queued.set("anyio", value=limiter.statistics().tasks_waiting)
+
+    # Executor por defecto de asyncio: asyncio.to_thread (SDK síncrono de respaldo)
+    # (atributos internos de ThreadPoolExecutor, se omiten si no existen)
+    executor = getattr(asyncio.get_running_loop(), "_default_executor", None)
+    try:
+        threads = len(executor._threads)
+        threadpool_busy.set("asyncio", value=threads - executor._idle_semaphore._value)
+        threadpool_capacity.set("asyncio", value=executor._max_workers)
+        threadpool_queued.set("asyncio", value=executor._work_queue.qsize())
+    except AttributeError:
+        pass
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI que mide latencia, peticiones en curso y errores por ruta
+
+    La ruta se etiqueta con su plantilla (/payments/status/{token}), no con la URL,
+    para que la cantidad de series no crezca con cada token.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        error: Optional[BaseException] = None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            http_requests_in_flight.dec()
+            route = scope.get("route")
+            route_label = getattr(route, "path", "unmatched")
+            http_request_duration.observe(
+                time.perf_counter() - start, scope["method"], route_label, str(status_code)
+            )
+            if error is not None:
+                http_errors.inc(route_label, type(error).__name__)
+            elif status_code >= 400:
+                http_errors.inc(route_label, str(status_code))
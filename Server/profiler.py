@@ -0,0 +1,337 @@
+"""
+Perfilador por muestreo y captura de peticiones lentas
+
+- SamplingProfiler toma la pila de todos los hilos cada interval segundos durante un
+  tiempo fijo y la entrega en formato "collapsed" (una pila por línea, marcos separados
+  por ';' y la cantidad de muestras al final), que leen flamegraph.pl y speedscope.
+- SlowRequestTrap muestrea solo las peticiones de las rutas vigiladas mientras están en
+  curso. Si la petición corre en el event loop se usa la pila real del hilo; si está
+  suspendida, la cadena de await de su tarea (por ejemplo, esperando a Transbank o al
+  threadpool). Al terminar, las que superan el umbral se guardan con sus pilas.
+"""
+
+import asyncio
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from types import FrameType
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Header, HTTPException
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .access_log import request_id
+
+
+def _label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def thread_stack(frame: Optional[FrameType]) -> List[str]:
+    """
+    Marcos de una pila de hilo, desde la raíz hasta el marco en ejecución
+    """
+    stack = []
+    while frame is not None:
+        stack.append(_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def await_chain(task: "asyncio.Task") -> List[str]:
+    """
+    Marcos de la cadena de await de una tarea suspendida, desde la raíz hasta lo esperado
+
+    Si la cadena termina esperando otra tarea guardada en el marco (ej. la tarea líder de
+    IdempotencyStore), sigue con la cadena de esa tarea tras un marcador "<Task>".
+    """
+    stack = []
+    awaitable: Any = task.get_coro()
+    frame = None
+    hops = 0
+    while awaitable is not None:
+        current = (
+            getattr(awaitable, "cr_frame", None)
+            or getattr(awaitable, "gi_frame", None)
+            or getattr(awaitable, "ag_frame", None)
+        )
+        if current is None:
+            # Si se espera otra tarea (ej. el líder de IdempotencyStore), se sigue su cadena
+            other = _pending_task(frame) if frame is not None and hops < 3 else None
+            if other is None:
+                # Future o awaitable sin marco: se anota su tipo
+                stack.append(f"<{type(awaitable).__name__}>")
+                break
+            stack.append("<Task>")
+            awaitable = other.get_coro()
+            hops += 1
+            continue
+        frame = current
+        stack.append(_label(frame))
+        awaitable = (
+            getattr(awaitable, "cr_await", None)
+            or getattr(awaitable, "gi_yieldfrom", None)
+            or getattr(awaitable, "ag_await", None)
+        )
+    return stack
+
+
+def _pending_task(frame: FrameType) -> Optional["asyncio.Task"]:
+    # Variables locales del marco y sus atributos directos (ej. entry.future)
+    candidates = []
+    for value in list(frame.f_locals.values()):
+        candidates.append(value)
+        if isinstance(value, type):
+            continue
+        attrs = getattr(value, "__dict__", None)
+        if isinstance(attrs, dict):
+            candidates.extend(list(attrs.values()))
+        for name in getattr(type(value), "__slots__", ()):
+            candidates.append(getattr(value, name, None))
+    tasks = {id(c): c for c in candidates if isinstance(c, asyncio.Task) and not c.done()}
+    return next(iter(tasks.values())) if len(tasks) == 1 else None
+
+
+def collapse(stacks: Iterable[Tuple[str, ...]]) -> str:
+    counts = Counter(stacks)
+    return "".join(f"{';'.join(stack)} {count}\n" for stack, count in counts.most_common())
+
+
+class SamplingProfiler:
+    """
+    Muestrea las pilas de todos los hilos del proceso (una ejecución a la vez)
+    """
+
+    def __init__(self, max_seconds: Optional[float] = None):
+        """
+        Args:
+            max_seconds: Duración máxima de un perfil (PROFILER_MAX_SECONDS)
+        """
+        self.max_seconds = max_seconds or float(os.environ.get("PROFILER_MAX_SECONDS", 60))
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def run(self, seconds: float, interval: float) -> Tuple[str, int]:
+        """
+        Muestrea durante `seconds` (bloquea: llamar desde un hilo)
+
+        Returns:
+            (pilas en formato collapsed, cantidad de muestras)
+
+        Raises:
+            RuntimeError: si ya hay un perfil en curso
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("Ya hay un perfil en curso")
+        try:
+            own = threading.get_ident()
+            names = {}
+            stacks: List[Tuple[str, ...]] = []
+            samples = 0
+            deadline = time.monotonic() + min(seconds, self.max_seconds)
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    if ident not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    stacks.append((names.get(ident, str(ident)),) + tuple(thread_stack(frame)))
+                samples += 1
+                time.sleep(interval)
+            return collapse(stacks), samples
+        finally:
+            self._lock.release()
+
+
+class SlowRequestTrap:
+    """
+    Guarda muestras de pila de las peticiones lentas de las rutas vigiladas
+
+    Desactivada por defecto, como la captura de tráfico: se activa con SLOW_REQUEST_MS.
+    """
+
+    def __init__(
+        self,
+        threshold_ms: Optional[float] = None,
+        interval: Optional[float] = None,
+        endpoints: Optional[Iterable[str]] = None,
+        keep: Optional[int] = None,
+        max_active: Optional[int] = None
+    ):
+        """
+        Args:
+            threshold_ms: Duración desde la que se guarda la petición; 0 desactiva (SLOW_REQUEST_MS, por defecto 0)
+            interval: Segundos entre muestras (SLOW_REQUEST_SAMPLE_INTERVAL)
+            endpoints: Funciones de ruta vigiladas (SLOW_REQUEST_ENDPOINTS, separadas por coma)
+            keep: Peticiones lentas guardadas, las más recientes (SLOW_REQUEST_KEEP)
+            max_active: Peticiones muestreadas por muestra como máximo (SLOW_REQUEST_MAX_ACTIVE)
+        """
+        if threshold_ms is None:
+            threshold_ms = float(os.environ.get("SLOW_REQUEST_MS", 0))
+        self.threshold_ms = threshold_ms
+        self.interval = interval or float(os.environ.get("SLOW_REQUEST_SAMPLE_INTERVAL", 0.02))
+        if endpoints is None:
+            endpoints = os.environ.get(
+                "SLOW_REQUEST_ENDPOINTS", "crear_pago,confirmar_pago,payment_callback"
+            ).split(",")
+        self.endpoints = {e.strip() for e in endpoints if e.strip()}
+        self.keep = keep or int(os.environ.get("SLOW_REQUEST_KEEP", 50))
+        self.max_active = max_active or int(os.environ.get("SLOW_REQUEST_MAX_ACTIVE", 100))
+
+        # tarea -> (scope, muestras)
+        self._active: Dict["asyncio.Task", Tuple[Scope, List[Tuple[str, ...]]]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self.slow: Deque[Dict[str, Any]] = deque(maxlen=self.keep)
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0 and bool(self.endpoints)
+
+    def start(self) -> None:
+        """
+        Inicia el hilo de muestreo (en cada worker, desde el lifespan)
+        """
+        if not self.enabled or self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._sampler = threading.Thread(target=self._run, name="slow-request-trap", daemon=True)
+        self._sampler.start()
+
+    @property
+    def running(self) -> bool:
+        return self._sampler is not None and self._sampler.is_alive()
+
+    def watching(self, scope: Scope) -> bool:
+        endpoint = scope.get("endpoint")
+        return getattr(endpoint, "__name__", None) in self.endpoints
+
+    def enter(self, task: "asyncio.Task", scope: Scope) -> List[Tuple[str, ...]]:
+        samples: List[Tuple[str, ...]] = []
+        with self._lock:
+            self._active[task] = (scope, samples)
+        if not self._wake.is_set():
+            self._wake.set()
+        return samples
+
+    def exit(self, task: "asyncio.Task", scope: Scope, duration_ms: float, status: int) -> None:
+        with self._lock:
+            _, samples = self._active.pop(task, (None, []))
+        if duration_ms < self.threshold_ms or not self.watching(scope):
+            return
+        self.slow.append({
+            "request_id": request_id.get(),
+            "endpoint": scope["endpoint"].__name__,
+            "path": scope["path"],
+            "status": status,
+            "duration_ms": round(duration_ms, 2),
+            "finished_at": time.time(),
+            "samples": len(samples),
+            "stacks": collapse(samples),
+        })
+
+    def _sample(self) -> None:
+        with self._lock:
+            active = list(self._active.items())
+        if not active:
+            return
+        # Tarea que corre ahora en el event loop (lectura desde otro hilo, puede estar desfasada)
+        try:
+            running = asyncio.current_task(self._loop) if self._loop is not None else None
+        except RuntimeError:
+            running = None
+        loop_frame = sys._current_frames().get(self._loop_thread) if running is not None else None
+        sampled = 0
+        for task, (scope, samples) in active:
+            if sampled >= self.max_active:
+                break
+            if not self.watching(scope):
+                continue
+            try:
+                if task is running and loop_frame is not None:
+                    stack = ("cpu",) + tuple(thread_stack(loop_frame))
+                else:
+                    stack = ("await",) + tuple(await_chain(task))
+            except Exception:
+                continue
+            samples.append(stack)
+            sampled += 1
+
+    def _run(self) -> None:
+        while True:
+            if not self._active:
+                # Sin peticiones en curso el hilo queda en espera
+                self._wake.wait()
+                self._wake.clear()
+            self._sample()
+            time.sleep(self.interval)
+
+
+class SlowRequestMiddleware:
+    """
+    Middleware ASGI que registra cada petición HTTP en SlowRequestTrap
+
+    Se agrega antes que los demás middlewares para ver la función de la ruta
+    (scope["endpoint"]) y el X-Request-ID del log de acceso.
+    """
+
+    def __init__(self, app: ASGIApp, trap: SlowRequestTrap):
+        self.app = app
+        self.trap = trap
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.trap.running:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        task = asyncio.current_task()
+        self.trap.enter(task, scope)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.trap.exit(task, scope, (time.perf_counter() - start) * 1000, status_code)
+
+
+def require_admin(
+    authorization: Optional[str] = Header(None),
+    x_admin_token: Optional[str] = Header(None)
+) -> None:
+    """
+    Dependencia de FastAPI: exige ADMIN_TOKEN (Authorization: Bearer o X-Admin-Token)
+
+    Sin ADMIN_TOKEN configurado las rutas de administración responden 404.
+    """
+    expected = os.environ.get("ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+    provided = x_admin_token
+    if provided is None and authorization and authorization.lower().startswith("bearer "):
+        provided = authorization[7:]
+    if provided is None or not hmac.compare_digest(provided.encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="Token de administración inválido", headers={"WWW-Authenticate": "Bearer"})
+
+
+# Instancias globales
+sampling_profiler = SamplingProfiler()
+slow_request_trap = SlowRequestTrap()
@@ -0,0 +1,213 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket en memoria por clave (session_id, IP, ...)
+
+    Cada clave acumula `rate` fichas por segundo hasta `burst`; cada petición consume
+    una. Las claves inactivas se desalojan (LRU) para acotar la memoria.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: Optional[int] = None):
+        """
+        Args:
+            rate: Fichas por segundo
+            burst: Máximo de fichas acumuladas (peticiones seguidas permitidas)
+            max_keys: Máximo de claves en memoria (RATE_LIMIT_MAX_KEYS)
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys or int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000))
+        # clave -> (fichas, última actualización)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str) -> float:
+        """
+        Consume una ficha de la clave
+
+        Returns:
+            0 si la petición se admite; si no, segundos hasta la próxima ficha
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class ConcurrencyLimiter:
+    """
+    Límite global de peticiones simultáneas (sin cola: si no hay cupo se rechaza)
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.active -= 1
+
+
+def client_ip(request: Request) -> str:
+    """
+    IP del cliente; detrás de un balanceador es la de X-Forwarded-For solo si el proxy
+    está en FORWARDED_ALLOW_IPS (ver Server/serve.py), si no todos comparten la del proxy
+    """
+    return request.client.host if request.client else "unknown"
+
+
+async def session_or_ip(request: Request) -> str:
+    """
+    Clave del cliente: encabezado X-Session-Id o, si no viene, la IP
+    """
+    return request.headers.get("x-session-id") or client_ip(request)
+
+
+async def body_session_id(request: Request) -> str:
+    """
+    Clave del cliente: session_id del cuerpo JSON (ya leído por FastAPI), o session_or_ip
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    if isinstance(body, dict) and body.get("session_id"):
+        return str(body["session_id"])
+    return await session_or_ip(request)
+
+
+async def ip_key(request: Request) -> str:
+    return client_ip(request)
+
+
+# Límites por defecto por ruta: (fichas por segundo, ráfaga)
+DEFAULT_LIMITS: Dict[str, Tuple[float, float]] = {
+    "create": (2, 5),
+    "confirm": (2, 5),
+    "refund": (1, 3),
+    "refund_jobs": (1, 3),
+    "status": (10, 20),
+    "status_batch": (1, 3),
+    "notifications": (10, 20),
+    "events": (5, 10),
+}
+
+
+class AdmissionControl:
+    """
+    Control de admisión de las rutas: token bucket por cliente y cupo global
+
+    Los token buckets están desactivados por defecto (RATE_LIMIT_ENABLED=true los activa):
+    las claves por IP solo distinguen clientes si el servidor recibe su IP real o confía en
+    el proxy. El cupo global hacia Transbank se aplica siempre que esté configurado.
+
+    Los límites se configuran por ruta con RATE_LIMIT_<RUTA>="fichas_por_segundo:ráfaga"
+    (ej. RATE_LIMIT_STATUS=10:20; "0" desactiva el límite de esa ruta). Las rutas que
+    llaman a Transbank comparten además un máximo de peticiones simultáneas
+    (UPSTREAM_MAX_CONCURRENCY). Los rechazos se responden antes de llamar a Transbank:
+    429 con Retry-After por cliente y 503 con Retry-After si se agota el cupo global.
+    """
+
+    def __init__(self, enabled: Optional[bool] = None, max_concurrency: Optional[int] = None):
+        """
+        Args:
+            enabled: Activa los límites por cliente (RATE_LIMIT_ENABLED, por defecto desactivados)
+            max_concurrency: Peticiones simultáneas hacia Transbank, 0 sin límite (UPSTREAM_MAX_CONCURRENCY)
+        """
+        if enabled is None:
+            enabled = os.environ.get("RATE_LIMIT_ENABLED", "false").lower() in ("1", "true", "yes")
+        self.enabled = enabled
+        if max_concurrency is None:
+            max_concurrency = int(os.environ.get("UPSTREAM_MAX_CONCURRENCY", 200))
+        self.upstream = ConcurrencyLimiter(max_concurrency) if max_concurrency > 0 else None
+        self.limiters: Dict[str, Optional[TokenBucketLimiter]] = {}
+        self.rejected: Dict[str, int] = {}
+
+    def limiter_for(self, route: str) -> Optional[TokenBucketLimiter]:
+        if route not in self.limiters:
+            rate, burst = DEFAULT_LIMITS.get(route, (0, 0))
+            config = os.environ.get(f"RATE_LIMIT_{route.upper()}")
+            if config is not None:
+                rate, _, burst = config.partition(":")
+                rate = float(rate)
+                burst = float(burst) if burst else max(rate, 1)
+            self.limiters[route] = TokenBucketLimiter(rate, burst) if rate > 0 else None
+        return self.limiters[route]
+
+    def _reject(self, route: str, status_code: int, retry_after: float, detail: str) -> HTTPException:
+        self.rejected[route] = self.rejected.get(route, 0) + 1
+        return HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(int(retry_after + 0.999), 1))}
+        )
+
+    def limit(
+        self,
+        route: str,
+        key: Callable[[Request], Awaitable[str]] = session_or_ip,
+        upstream: bool = True
+    ) -> Callable[[Request], AsyncIterator[None]]:
+        """
+        Crea la dependencia de FastAPI que aplica los límites de una ruta
+
+        Args:
+            route: Nombre de la ruta (define RATE_LIMIT_<RUTA>)
+            key: Función que obtiene la clave del cliente a partir de la petición
+            upstream: Si la ruta llama a Transbank y consume cupo global
+        """
+        async def dependency(request: Request) -> AsyncIterator[None]:
+            limiter = self.limiter_for(route) if self.enabled else None
+            if limiter is not None:
+                wait = limiter.acquire(f"{route}:{await key(request)}")
+                if wait > 0:
+                    raise self._reject(route, 429, wait, "Demasiadas peticiones, reintente más tarde")
+            if not upstream or self.upstream is None:
+                yield
+                return
+            if not self.upstream.try_acquire():
+                raise self._reject(route, 503, 1, "Servicio saturado, reintente más tarde")
+            try:
+                yield
+            finally:
+                self.upstream.release()
+
+        return dependency
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            "upstream_active": self.upstream.active if self.upstream is not None else None,
+            "upstream_limit": self.upstream.limit if self.upstream is not None else None,
+            "rejected": dict(self.rejected)
+        }
+
+
+# Instancia global del control de admisión
+admission = AdmissionControl()
@@ -0,0 +1,159 @@
+"""
+Punto de entrada del servidor
+
+    python -m Server.serve                              # producción (WEB_WORKERS, por defecto 1)
+    ENVIRONMENT=development python -m Server.serve      # desarrollo: un proceso con --reload
+
+En producción usa gunicorn con workers de uvicorn si gunicorn está instalado: la app
+(y WebpayService) se importa una sola vez en el proceso maestro antes de crear los
+workers (preload). Si gunicorn no está disponible (ej. Windows) usa el supervisor de
+uvicorn, que inicia cada worker desde cero. uvloop y httptools se usan cuando están
+instalados.
+
+Por defecto corre un solo worker: la deduplicación de commits, las Idempotency-Key y los
+límites de tasa viven en la memoria de cada proceso, así que con WEB_WORKERS > 1 un
+reintento que cae en otro worker no se deduplica y cada worker aplica su propio cupo
+(el límite efectivo se multiplica por la cantidad de workers).
+"""
+
+import importlib.util
+import os
+from typing import Any, Dict
+
+import uvicorn
+
+
+APP = "main:app"
+
+
+def settings() -> Dict[str, Any]:
+    """
+    Configuración del servidor desde variables de entorno
+    """
+    return {
+        "host": os.environ.get("HOST", "0.0.0.0"),
+        "port": int(os.environ.get("PORT", 8000)),
+        # Procesos worker (por defecto uno: ver el docstring del módulo antes de subirlo)
+        "workers": int(os.environ.get("WEB_WORKERS", 1)),
+        # Conexiones pendientes de aceptar en el socket
+        "backlog": int(os.environ.get("WEB_BACKLOG", 2048)),
+        # Segundos que se mantiene abierta una conexión keep-alive ociosa
+        "keepalive": int(os.environ.get("WEB_KEEPALIVE", 5)),
+        # Conexiones simultáneas por worker antes de responder 503 (0 sin límite)
+        "limit_concurrency": int(os.environ.get("WEB_LIMIT_CONCURRENCY", 1000)) or None,
+        # Peticiones por worker antes de reciclarlo (0 nunca)
+        "max_requests": int(os.environ.get("WEB_MAX_REQUESTS", 0)) or None,
+        # Segundos para terminar las peticiones en curso al apagar
+        "graceful_timeout": int(os.environ.get("WEB_GRACEFUL_TIMEOUT", 30)),
+        # Proxies (balanceador) cuyos X-Forwarded-For/-Proto se aceptan: definen la IP del
+        # cliente que usan el rate limiting y el log de acceso ("*" confía en cualquiera)
+        "forwarded_allow_ips": os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+    }
+
+
+def is_development() -> bool:
+    return os.environ.get("ENVIRONMENT", "production").lower() in ("development", "dev")
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def preload():
+    """
+    Importa la app y prepara WebpayService antes de crear los workers
+
+    Solo se construyen objetos sin estado de red: el cliente HTTP, el hilo del ledger
+    y las tareas de fondo se crean en cada worker (lifespan o primer uso).
+    """
+    from main import app
+    from Payment.webpay_service import webpay_service
+
+    webpay_service.preload()
+    return app
+
+
+def run_development(config: Dict[str, Any]) -> None:
+    uvicorn.run(APP, host=config["host"], port=config["port"], reload=True)
+
+
+def run_uvicorn(config: Dict[str, Any]) -> None:
+    uvicorn.run(
+        APP,
+        host=config["host"],
+        port=config["port"],
+        workers=config["workers"],
+        backlog=config["backlog"],
+        timeout_keep_alive=config["keepalive"],
+        limit_concurrency=config["limit_concurrency"],
+        limit_max_requests=config["max_requests"],
+        timeout_graceful_shutdown=config["graceful_timeout"],
+        proxy_headers=True,
+        forwarded_allow_ips=config["forwarded_allow_ips"],
+        loop="auto",
+        http="auto",
+    )
+
+
+def _worker_class(config: Dict[str, Any]) -> type:
+    try:
+        from uvicorn_worker import UvicornWorker
+    except ImportError:
+        from uvicorn.workers import UvicornWorker
+
+    class PaymentsWorker(UvicornWorker):
+        CONFIG_KWARGS = {
+            "loop": "auto",
+            "http": "auto",
+            "limit_concurrency": config["limit_concurrency"],
+            "timeout_graceful_shutdown": config["graceful_timeout"],
+            "proxy_headers": True,
+        }
+
+    return PaymentsWorker
+
+
+def run_gunicorn(config: Dict[str, Any]) -> None:
+    from gunicorn.app.base import BaseApplication
+
+    class PaymentsApplication(BaseApplication):
+        def __init__(self, options: Dict[str, Any]):
+            self.options = options
+            super().__init__()
+
+        def load_config(self) -> None:
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return preload()
+
+    options = {
+        "bind": f"{config['host']}:{config['port']}",
+        "workers": config["workers"],
+        "worker_class": _worker_class(config),
+        "preload_app": True,
+        "backlog": config["backlog"],
+        "keepalive": config["keepalive"],
+        "graceful_timeout": config["graceful_timeout"],
+        "forwarded_allow_ips": config["forwarded_allow_ips"],
+    }
+    if config["max_requests"]:
+        options["max_requests"] = config["max_requests"]
+        # Evita que todos los workers se reciclen al mismo tiempo
+        options["max_requests_jitter"] = max(config["max_requests"] // 10, 1)
+    PaymentsApplication(options).run()
+
+
+def main() -> None:
+    config = settings()
+    if is_development():
+        run_development(config)
+    elif _installed("gunicorn"):
+        run_gunicorn(config)
+    else:
+        run_uvicorn(config)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+from typing import Optional
+
+from fastapi import HTTPException, Request
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from Payment.tenants import UnknownTenantError, tenant_registry
+from Payment.webpay_service import WebpayService
+
+
+TENANT_HEADER = b"x-tenant-id"
+TENANT_PREFIX = "/tenants/"
+
+
+class TenantMiddleware:
+    """
+    Middleware ASGI que identifica la sucursal de cada petición
+
+    La sucursal viene en el prefijo de la ruta (/tenants/{sucursal}/payments/create) o
+    en el encabezado X-Tenant-Id. El prefijo se quita antes del enrutamiento, así las
+    mismas rutas atienden a todas las sucursales; por ejemplo, el return_url de Webpay
+    puede ser /tenants/{sucursal}/payment/callback.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        tenant: Optional[str] = None
+        path = scope["path"]
+        if path.startswith(TENANT_PREFIX):
+            tenant, _, rest = path[len(TENANT_PREFIX):].partition("/")
+            # Se modifica el scope original (no una copia): el router deja en él la ruta
+            # encontrada (scope["route"]), que MetricsMiddleware lee al terminar
+            scope["path"] = "/" + rest
+            raw_path = scope.get("raw_path")
+            if raw_path:
+                scope["raw_path"] = b"/" + raw_path[len(TENANT_PREFIX):].partition(b"/")[2]
+        else:
+            for name, value in scope["headers"]:
+                if name == TENANT_HEADER:
+                    tenant = value.decode("latin-1")
+                    break
+        scope["tenant"] = tenant or None
+        await self.app(scope, receive, send)
+
+
+async def servicio_webpay(request: Request) -> WebpayService:
+    """
+    Dependencia de FastAPI: WebpayService de la sucursal de la petición
+    """
+    try:
+        return tenant_registry.get(request.scope.get("tenant"))
+    except UnknownTenantError:
+        raise HTTPException(status_code=404, detail="Sucursal no registrada")
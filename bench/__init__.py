@@ -0,0 +1,3 @@
+"""
+Herramientas de benchmark sin red: servidor local que imita Webpay Plus y carga sobre main.py
+"""
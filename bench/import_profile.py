@@ -0,0 +1,102 @@
+"""
+Perfil del tiempo de importación de la API (arranque en frío)
+
+Uso:
+    python -m bench.import_profile                     # reporte de los módulos más lentos
+    python -m bench.import_profile --budget-ms 800     # falla (exit 1) si main tarda más
+    python -m bench.import_profile --forbid transbank  # falla si main importa el SDK
+
+Usa `python -X importtime` en un proceso nuevo por corrida y toma la corrida más rápida
+para reducir el ruido. Pensado para CI: una importación pesada que se agregue al
+arranque aparece como regresión.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Módulos que no deben cargarse al iniciar la API (se importan bajo demanda)
+DEFAULT_FORBIDDEN = ("transbank", "requests")
+
+
+def profile(module: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Importa `module` en un proceso nuevo
+
+    Returns:
+        Dict módulo -> (microsegundos propios, microsegundos acumulados)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def forbidden_imports(modules: Dict[str, Tuple[int, int]], forbidden: List[str]) -> List[str]:
+    return sorted(
+        name for name in modules
+        if any(name == prefix or name.startswith(prefix + ".") for prefix in forbidden)
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Perfil del tiempo de importación de la API")
+    parser.add_argument("--module", default="main", help="Módulo a importar")
+    parser.add_argument("--runs", type=int, default=3, help="Corridas (se reporta la más rápida)")
+    parser.add_argument("--top", type=int, default=20, help="Módulos a mostrar")
+    parser.add_argument("--budget-ms", type=float, help="Falla si la importación supera este tiempo")
+    parser.add_argument(
+        "--forbid", default=",".join(DEFAULT_FORBIDDEN),
+        help="Paquetes que no deben importarse al iniciar (separados por coma, vacío para omitir)"
+    )
+    parser.add_argument("--json", dest="json_path", help="Guardar el reporte en un archivo JSON")
+    args = parser.parse_args()
+
+    runs = [profile(args.module) for _ in range(max(args.runs, 1))]
+    modules = min(runs, key=lambda m: m[args.module][1])
+    total_ms = modules[args.module][1] / 1000
+
+    print(f"import {args.module}: {total_ms:.1f} ms (mejor de {len(runs)})\n")
+    print(f"{'módulo':<50} {'propio ms':>10} {'acumulado ms':>13}")
+    slowest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+    for name, (self_us, cumulative_us) in slowest:
+        print(f"{name:<50} {self_us / 1000:>10.1f} {cumulative_us / 1000:>13.1f}")
+
+    failures = []
+    forbidden = forbidden_imports(modules, [p.strip() for p in args.forbid.split(",") if p.strip()])
+    if forbidden:
+        failures.append(f"módulos que deberían cargarse bajo demanda: {', '.join(forbidden)}")
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        failures.append(f"la importación tarda {total_ms:.1f} ms (presupuesto {args.budget_ms:.0f} ms)")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({
+                "module": args.module,
+                "total_ms": total_ms,
+                "modules": {name: {"self_ms": s / 1000, "cumulative_ms": c / 1000} for name, (s, c) in modules.items()},
+                "forbidden": forbidden
+            }, f, indent=2)
+
+    for failure in failures:
+        print(f"\nERROR: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
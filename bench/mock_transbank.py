@@ -0,0 +1,184 @@
+"""
+Servidor local que imita la API REST de Webpay Plus (create, commit, status, refund)
+
+Uso:
+    python -m bench.mock_transbank --port 9100 --latency-ms 150 --jitter-ms 50 --error-rate 0.01
+
+Y en el servicio de pagos:
+    WEBPAY_BASE_URL=http://127.0.0.1:9100 uvicorn main:app
+
+Como en Transbank, cada token solo existe para el código de comercio que lo creó
+(encabezado Tbk-Api-Key-Id): otro comercio recibe "Transaction not found".
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import secrets
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+TRANSACTIONS_PATH = "/rswebpaytransaction/api/webpay/v1.2/transactions"
+
+# Configuración de latencia y errores (variables de entorno para poder usarla con uvicorn)
+LATENCY_MS = float(os.environ.get("MOCK_LATENCY_MS", 150))
+JITTER_MS = float(os.environ.get("MOCK_JITTER_MS", 50))
+ERROR_RATE = float(os.environ.get("MOCK_ERROR_RATE", 0))
+MAX_TRANSACTIONS = int(os.environ.get("MOCK_MAX_TRANSACTIONS", 200000))
+
+app = FastAPI(title="Mock Webpay Plus", docs_url=None, redoc_url=None)
+
+# token -> transacción
+_transactions: Dict[str, Dict[str, Any]] = {}
+
+
+async def _simulate() -> Optional[JSONResponse]:
+    """
+    Aplica la latencia configurada; según ERROR_RATE retorna un error inyectado (si no, None)
+    """
+    delay = LATENCY_MS + random.uniform(-JITTER_MS, JITTER_MS)
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+    if ERROR_RATE and random.random() < ERROR_RATE:
+        return JSONResponse({"error_message": "Error inyectado por el mock"}, status_code=500)
+    return None
+
+
+def _not_found() -> JSONResponse:
+    return JSONResponse({"error_message": "Transaction not found"}, status_code=422)
+
+
+def _lookup(token: str, request: Request) -> Optional[Dict[str, Any]]:
+    tx = _transactions.get(token)
+    if tx is None or tx["commerce_code"] != request.headers.get("tbk-api-key-id"):
+        return None
+    return tx
+
+
+def _status_body(tx: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "vci": tx.get("vci"),
+        "amount": tx["amount"],
+        "status": tx["status"],
+        "buy_order": tx["buy_order"],
+        "session_id": tx["session_id"],
+        "card_detail": {"card_number": "6623"},
+        "accounting_date": tx["accounting_date"],
+        "transaction_date": tx["transaction_date"],
+        "authorization_code": tx.get("authorization_code"),
+        "payment_type_code": tx.get("payment_type_code"),
+        "response_code": tx.get("response_code"),
+        "installments_amount": 0,
+        "installments_number": 0,
+        "balance": tx["balance"]
+    }
+
+
+@app.post(TRANSACTIONS_PATH)
+async def create(request: Request):
+    error = await _simulate()
+    if error is not None:
+        return error
+    body = await request.json()
+    token = secrets.token_hex(32)
+    if len(_transactions) >= MAX_TRANSACTIONS:
+        _transactions.pop(next(iter(_transactions)))
+    now = datetime.now(timezone.utc)
+    _transactions[token] = {
+        "commerce_code": request.headers.get("tbk-api-key-id"),
+        "buy_order": body.get("buy_order"),
+        "session_id": body.get("session_id"),
+        "amount": body.get("amount"),
+        "balance": body.get("amount"),
+        "status": "INITIALIZED",
+        "accounting_date": now.strftime("%m%d"),
+        "transaction_date": now.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+    }
+    return {
+        "token": token,
+        "url": "https://webpay3gint.transbank.cl/webpayserver/initTransaction"
+    }
+
+
+@app.put(TRANSACTIONS_PATH + "/{token}")
+async def commit(token: str, request: Request):
+    error = await _simulate()
+    if error is not None:
+        return error
+    tx = _lookup(token, request)
+    if tx is None:
+        return _not_found()
+    if tx["status"] != "INITIALIZED":
+        return JSONResponse({"error_message": "Invalid status '2' for transaction while authorizing"}, status_code=422)
+    tx.update(
+        status="AUTHORIZED",
+        vci="TSY",
+        authorization_code="1213",
+        payment_type_code="VD",
+        response_code=0,
+        balance=0
+    )
+    return _status_body(tx)
+
+
+@app.get(TRANSACTIONS_PATH + "/{token}")
+async def status(token: str, request: Request):
+    error = await _simulate()
+    if error is not None:
+        return error
+    tx = _lookup(token, request)
+    if tx is None:
+        return _not_found()
+    return _status_body(tx)
+
+
+@app.post(TRANSACTIONS_PATH + "/{token}/refunds")
+async def refund(token: str, request: Request):
+    error = await _simulate()
+    if error is not None:
+        return error
+    tx = _lookup(token, request)
+    if tx is None:
+        return _not_found()
+    if tx["status"] not in ("AUTHORIZED", "PARTIALLY_NULLIFIED"):
+        return JSONResponse({"error_message": "Transaction not authorized"}, status_code=422)
+    amount = (await request.json()).get("amount", 0)
+    refunded = tx.get("refunded", 0) + amount
+    if refunded > tx["amount"]:
+        return JSONResponse({"error_message": "Amount exceeds balance"}, status_code=422)
+    tx["refunded"] = refunded
+    tx["balance"] = tx["amount"] - refunded
+    tx["status"] = "NULLIFIED" if tx["balance"] == 0 else "PARTIALLY_NULLIFIED"
+    return {
+        "type": "NULLIFIED",
+        "authorization_code": "123456",
+        "authorization_date": datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+        "nullified_amount": amount,
+        "balance": tx["balance"],
+        "response_code": 0
+    }
+
+
+def main() -> None:
+    global LATENCY_MS, JITTER_MS, ERROR_RATE
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Mock local de la API de Webpay Plus")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=LATENCY_MS)
+    parser.add_argument("--jitter-ms", type=float, default=JITTER_MS)
+    parser.add_argument("--error-rate", type=float, default=ERROR_RATE)
+    args = parser.parse_args()
+
+    LATENCY_MS, JITTER_MS, ERROR_RATE = args.latency_ms, args.jitter_ms, args.error_rate
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
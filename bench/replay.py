@@ -0,0 +1,324 @@
+"""
+Reproduce una captura de tráfico (Server.capture) contra la API y un Transbank simulado
+
+Uso:
+    # Captura en la instancia real (opt-in; un archivo capture.<pid>.jsonl por worker)
+    TRAFFIC_CAPTURE_FILE=capture.jsonl python -m Server.serve
+
+    # Reproduce a 1x, 10x y 100x levantando mock y API locales
+    python -m bench.replay capture.*.jsonl --spawn --speeds 1,10,100
+
+    # Contra una instancia ya levantada (apuntando a bench.mock_transbank)
+    python -m bench.replay capture.*.jsonl --target http://127.0.0.1:8000 --speeds 10
+
+Las peticiones se envían en lazo abierto según el instante capturado dividido por la
+velocidad, sin esperar a las anteriores, así la carga sigue el patrón real (ráfaga de
+create, callbacks, consultas de estado, reembolsos). Cada referencia de token de la
+captura se asocia al token que entrega el create reproducido; las que no tienen create
+en la captura usan transacciones creadas antes de empezar (no se miden).
+
+Reporta por velocidad las latencias por ruta, el throughput ofrecido y logrado, el
+retraso respecto del calendario y el techo de throughput (la velocidad más alta en que
+la API siguió el ritmo).
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from .run_benchmark import create_body, create_tokens, spawn_stack
+from .stats import format_table, percentile, summarize
+
+
+# Registro capturado: [offset_ms, método, ruta, estado, duración_ms, ref, forma]
+Record = List[Any]
+
+# Rutas que no se reproducen (streams largos o sin datos suficientes en la captura)
+SKIPPED_ROUTES = ("/payments/events", "/metrics")
+# Consultas mínimas para rutas cuyo query string no se captura
+DEFAULT_QUERIES = {
+    "/payments/ledger": "?accounting_date=0101",
+    "/payments/ledger/export": "?limit=100",
+    "/reports/settlement": "?date=0101",
+}
+# Primera operación de un token que exige una transacción ya confirmada
+_NEEDS_COMMIT = (
+    "/payments/status/{token}", "/payments/refund", "/payments/ledger/{token}",
+    "/payments/status/batch", "/payments/refund/jobs"
+)
+# Fracción del throughput ofrecido bajo la cual se considera que la API no siguió el ritmo
+SATURATION_RATIO = 0.9
+
+
+def load(paths: List[str], limit: Optional[int] = None) -> List[Record]:
+    """
+    Lee una o varias capturas (una por worker) y las une en una sola línea de tiempo
+
+    Los offsets de cada archivo se miden desde su started_at; se llevan al started_at
+    más antiguo para intercalar las peticiones de todos los workers.
+    """
+    captures = []
+    for path in paths:
+        started_at, records = 0.0, []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if line.startswith("{"):
+                    started_at = json.loads(line).get("started_at", 0.0)
+                    continue
+                record = json.loads(line)
+                if record[2] not in SKIPPED_ROUTES:
+                    records.append(record)
+        captures.append((started_at, records))
+
+    origin = min((started_at for started_at, _ in captures), default=0.0)
+    merged = []
+    for started_at, records in captures:
+        shift = (started_at - origin) * 1000
+        for record in records:
+            record[0] += shift
+            merged.append(record)
+    merged.sort(key=lambda r: r[0])
+    return merged[:limit] if limit else merged
+
+
+def _refs(record: Record) -> List[str]:
+    shape = record[6] or {}
+    refs = [record[5]] if record[5] else []
+    refs += [ref for ref in shape.get("refs", []) if ref]
+    refs += [ref for ref, _ in shape.get("refunds", []) if ref]
+    return refs
+
+
+def orphans(records: List[Record]) -> Dict[str, bool]:
+    """
+    Referencias usadas sin un create previo en la captura -> si necesitan estar confirmadas
+    """
+    created, needed = set(), {}
+    for record in records:
+        if record[2] == "/payments/create":
+            if record[5]:
+                created.add(record[5])
+            continue
+        for ref in _refs(record):
+            if ref not in created and ref not in needed:
+                needed[ref] = record[2] in _NEEDS_COMMIT
+    return needed
+
+
+class Replay:
+    """
+    Estado de una reproducción: tokens por referencia y resultados por ruta
+    """
+
+    def __init__(self, client: httpx.AsyncClient, pool: Dict[str, str], max_inflight: int):
+        self.client = client
+        self.tokens: Dict[str, str] = dict(pool)
+        self.created: Dict[str, asyncio.Event] = {}
+        self.semaphore = asyncio.Semaphore(max_inflight)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.mismatches = 0
+        self.lags: List[float] = []
+        self.first_send: Optional[float] = None
+        self.last_done = 0.0
+
+    async def token(self, ref: Optional[str]) -> str:
+        if ref is None:
+            return "replay"
+        event = self.created.get(ref)
+        if event is not None and ref not in self.tokens:
+            # El create de esta referencia sigue en curso
+            try:
+                await asyncio.wait_for(event.wait(), 30)
+            except asyncio.TimeoutError:
+                pass
+        return self.tokens.get(ref, "replay")
+
+    async def build(self, record: Record) -> Tuple[str, str, Optional[Dict[str, Any]]]:
+        _, method, route, _, _, ref, shape = record
+        shape = shape or {}
+        if route == "/payments/create":
+            body = create_body()
+            body["amount"] = shape.get("amount", body["amount"])
+            return method, route, body
+        if route == "/payments/confirm":
+            return method, route, {"token": await self.token(ref)}
+        if route == "/payments/refund":
+            return method, route, {"token": await self.token(ref), "amount": shape.get("amount", 1)}
+        if route == "/payments/status/batch":
+            return method, route, {"tokens": [await self.token(r) for r in shape.get("refs", [])] or ["replay"]}
+        if route == "/payments/refund/jobs":
+            refunds = [{"token": await self.token(r), "amount": a or 1} for r, a in shape.get("refunds", [])]
+            return method, route, {"refunds": refunds or [{"token": "replay", "amount": 1}]}
+        if route == "/payment/callback":
+            return method, f"{route}?token_ws={await self.token(ref)}", None
+        if route == "/notifications":
+            return method, route, {"categoria": True, "mensaje": "replay"}
+        path = route.replace("{token}", await self.token(ref)) if "{token}" in route else route
+        while "{" in path:
+            start, end = path.index("{"), path.index("}")
+            path = path[:start] + "replay" + path[end + 1:]
+        return method, path + DEFAULT_QUERIES.get(route, ""), None
+
+    async def send(self, record: Record, scheduled: float) -> None:
+        route, ref = record[2], record[5]
+        if route == "/payments/create" and ref:
+            self.created[ref] = asyncio.Event()
+        async with self.semaphore:
+            method, path, body = await self.build(record)
+            start = time.perf_counter()
+            self.lags.append(max(start - scheduled, 0))
+            if self.first_send is None:
+                self.first_send = start
+            status = None
+            try:
+                response = await self.client.request(method, path, json=body)
+                await response.aread()
+                status = response.status_code
+                if route == "/payments/create" and ref and status == 200:
+                    self.tokens[ref] = response.json()["token"]
+            except httpx.HTTPError:
+                pass
+            finally:
+                if route == "/payments/create" and ref:
+                    self.created[ref].set()
+            done = time.perf_counter()
+            self.last_done = max(self.last_done, done)
+            self.latencies[route].append(done - start)
+            if status is None or status >= 500:
+                self.errors[route] += 1
+            if status is None or status // 100 != record[3] // 100:
+                self.mismatches += 1
+
+
+async def replay(
+    target: str,
+    records: List[Record],
+    speed: float,
+    max_inflight: int
+) -> Dict[str, Any]:
+    """
+    Reproduce la captura a `speed` veces su velocidad original
+    """
+    limits = httpx.Limits(max_connections=max_inflight, max_keepalive_connections=min(max_inflight, 200), keepalive_expiry=2)
+    async with httpx.AsyncClient(base_url=target, limits=limits, timeout=60) as client:
+        needed = orphans(records)
+        pool: Dict[str, str] = {}
+        for commit in (False, True):
+            refs = [ref for ref, c in needed.items() if c == commit]
+            if refs:
+                tokens = await create_tokens(client, len(refs), commit=commit)
+                pool.update(zip(refs, tokens))
+
+        state = Replay(client, pool, max_inflight)
+        origin = records[0][0]
+        start = time.perf_counter()
+        tasks = []
+        for record in records:
+            scheduled = start + (record[0] - origin) / 1000 / speed
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(state.send(record, scheduled)))
+        await asyncio.gather(*tasks)
+
+    span = (records[-1][0] - origin) / 1000 / speed
+    elapsed = state.last_done - (state.first_send or start)
+    total = sum(len(v) for v in state.latencies.values())
+    routes = {
+        route: summarize(latencies, state.errors[route], elapsed)
+        for route, latencies in sorted(state.latencies.items())
+    }
+    overall = summarize([l for v in state.latencies.values() for l in v], sum(state.errors.values()), elapsed)
+    lags = sorted(state.lags)
+    offered = total / span if span > 0 else float("inf")
+    return {
+        "speed": speed,
+        "requests": total,
+        "offered_rps": offered,
+        "achieved_rps": overall["rps"],
+        "lag_p95_ms": percentile(lags, 95) * 1000,
+        "status_mismatches": state.mismatches,
+        "overall": overall,
+        "routes": routes,
+        "saturated": overall["rps"] < SATURATION_RATIO * offered,
+    }
+
+
+def format_runs(runs: List[Dict[str, Any]]) -> str:
+    header = f"{'velocidad':>10}{'reqs':>8}{'ofrecido':>11}{'logrado':>10}{'p50 ms':>9}{'p99 ms':>9}{'retraso p95':>13}{'errores':>9}"
+    lines = [header, "-" * len(header)]
+    for run in runs:
+        o = run["overall"]
+        lines.append(
+            f"{run['speed']:>9g}x{run['requests']:>8}{run['offered_rps']:>11.1f}{run['achieved_rps']:>10.1f}"
+            f"{o['p50_ms']:>9.1f}{o['p99_ms']:>9.1f}{run['lag_p95_ms']:>13.1f}{o['errors']:>9}"
+            + ("  saturado" if run["saturated"] else "")
+        )
+    sustained = [run for run in runs if not run["saturated"]]
+    if sustained:
+        best = max(sustained, key=lambda r: r["achieved_rps"])
+        lines.append(f"\nTecho: {best['achieved_rps']:.1f} req/s sostenidos a {best['speed']:g}x")
+    else:
+        lines.append("\nTecho: la API no siguió el ritmo ni a la velocidad más baja")
+    if any(run["saturated"] for run in runs):
+        peak = max(runs, key=lambda r: r["achieved_rps"])
+        lines.append(f"Máximo logrado: {peak['achieved_rps']:.1f} req/s a {peak['speed']:g}x")
+    return "\n".join(lines)
+
+
+async def run_all(target: str, records: List[Record], speeds: List[float], max_inflight: int) -> List[Dict[str, Any]]:
+    runs = []
+    for speed in speeds:
+        result = await replay(target, records, speed, max_inflight)
+        print(f"{speed:g}x: {result['achieved_rps']:.1f} req/s", file=sys.stderr)
+        print(format_table(result["routes"]) + "\n", file=sys.stderr)
+        runs.append(result)
+    return runs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reproduce una captura de tráfico contra un Transbank simulado")
+    parser.add_argument("capture", nargs="+", help="Archivos generados con TRAFFIC_CAPTURE_FILE (uno por worker)")
+    parser.add_argument("--target", help="URL de una instancia ya levantada")
+    parser.add_argument("--spawn", action="store_true", help="Levantar mock y API en procesos locales")
+    parser.add_argument("--speeds", default="1,10,100", help="Velocidades separadas por coma")
+    parser.add_argument("--limit", type=int, help="Reproducir solo los primeros N registros")
+    parser.add_argument("--max-inflight", type=int, default=1000, help="Peticiones simultáneas como máximo")
+    parser.add_argument("--latency-ms", type=float, default=150, help="Latencia del mock (--spawn)")
+    parser.add_argument("--jitter-ms", type=float, default=50, help="Variación de la latencia del mock (--spawn)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de errores del mock (--spawn)")
+    parser.add_argument("--json", dest="json_path", help="Guardar los resultados en un archivo JSON")
+    args = parser.parse_args()
+
+    if not args.target and not args.spawn:
+        parser.error("Indique --target o --spawn")
+    speeds = [float(s) for s in args.speeds.split(",") if s.strip()]
+    records = load(args.capture, args.limit)
+    if not records:
+        parser.error("La captura no tiene registros reproducibles")
+
+    if args.spawn:
+        # La instancia de prueba no debe capturar su propio tráfico
+        with spawn_stack(args.latency_ms, args.jitter_ms, args.error_rate, {"TRAFFIC_CAPTURE_FILE": ""}) as target:
+            runs = asyncio.run(run_all(target, records, speeds, args.max_inflight))
+    else:
+        runs = asyncio.run(run_all(args.target, records, speeds, args.max_inflight))
+
+    print(format_runs(runs))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(runs, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,418 @@
+"""
+Benchmark de las rutas de main.py contra un Transbank simulado (sin red)
+
+Uso:
+    # Levanta el mock y la API en procesos locales y mide todas las rutas
+    python -m bench.run_benchmark --spawn --requests 500 --concurrency 50
+
+    # Contra una instancia ya levantada (apuntando a bench.mock_transbank)
+    python -m bench.run_benchmark --target http://127.0.0.1:8000 --routes create,status
+
+Reporta por ruta: throughput (req/s) y latencias p50/p95/p99.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from .stats import format_table, summarize
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (método, ruta, cuerpo JSON)
+RequestSpec = Tuple[str, str, Optional[Dict[str, Any]]]
+
+
+async def create_tokens(client: httpx.AsyncClient, count: int, commit: bool = False) -> List[str]:
+    """
+    Crea transacciones (y opcionalmente las confirma) para usarlas en los escenarios
+    """
+    semaphore = asyncio.Semaphore(50)
+
+    async def crear() -> Optional[str]:
+        async with semaphore:
+            try:
+                response = await client.post("/payments/create", json=create_body())
+                if response.status_code != 200:
+                    return None
+                token = response.json()["token"]
+                if commit:
+                    await client.post("/payments/confirm", json={"token": token})
+            except httpx.HTTPError:
+                return None
+            return token
+
+    tokens = await asyncio.gather(*(crear() for _ in range(count)))
+    return [token for token in tokens if token]
+
+
+def create_body() -> Dict[str, Any]:
+    """
+    Cuerpo de /payments/create con buy_order y session_id únicos
+    """
+    suffix = uuid.uuid4().hex
+    return {
+        "buy_order": f"bench-{suffix[:20]}",
+        "session_id": f"session-{suffix}",
+        "amount": 10000,
+        "return_url": "http://127.0.0.1/payment/callback"
+    }
+
+
+async def _fresh(client: httpx.AsyncClient, n: int) -> List[str]:
+    return await create_tokens(client, n)
+
+
+async def _committed(client: httpx.AsyncClient, n: int) -> List[str]:
+    return await create_tokens(client, min(n, 200), commit=True)
+
+
+def _cycle(tokens: List[str], n: int, build: Callable[[str], RequestSpec]) -> List[RequestSpec]:
+    return [build(token) for token, _ in zip(itertools.cycle(tokens), range(n))]
+
+
+# Escenarios: nombre -> función que prepara n peticiones (la preparación no se mide)
+Scenario = Callable[[httpx.AsyncClient, int], Awaitable[List[RequestSpec]]]
+
+
+async def _index(client, n):
+    return [("GET", "/", None)] * n
+
+
+async def _health(client, n):
+    return [("GET", "/health", None)] * n
+
+
+async def _create(client, n):
+    return [("POST", "/payments/create", create_body()) for _ in range(n)]
+
+
+async def _confirm(client, n):
+    return [("POST", "/payments/confirm", {"token": t}) for t in await _fresh(client, n)]
+
+
+async def _callback(client, n):
+    return [("GET", f"/payment/callback?token_ws={t}", None) for t in await _fresh(client, n)]
+
+
+async def _status(client, n):
+    return _cycle(await _committed(client, n), n, lambda t: ("GET", f"/payments/status/{t}", None))
+
+
+async def _status_batch(client, n):
+    tokens = await _committed(client, 50)
+    return [
+        ("POST", "/payments/status/batch", {"tokens": tokens[i % len(tokens):][:10] or tokens[:10]})
+        for i in range(n)
+    ]
+
+
+async def _refund(client, n):
+    return _cycle(await _committed(client, n), n, lambda t: ("POST", "/payments/refund", {"token": t, "amount": 1}))
+
+
+async def _recorded(client: httpx.AsyncClient, tokens: List[str], timeout: float = 5) -> List[str]:
+    # El ledger escribe en segundo plano: se espera a que el último token esté registrado
+    deadline = time.monotonic() + timeout
+    while tokens and time.monotonic() < deadline:
+        if (await client.get(f"/payments/ledger/{tokens[-1]}")).status_code == 200:
+            break
+        await asyncio.sleep(0.05)
+    return tokens
+
+
+async def _ledger(client, n):
+    tokens = await _recorded(client, await _committed(client, n))
+    return _cycle(tokens, n, lambda t: ("GET", f"/payments/ledger/{t}", None))
+
+
+async def _reconciliation(client, n):
+    return [("GET", "/payments/reconciliation", None)] * n
+
+
+async def _notifications(client, n):
+    return [("POST", "/notifications", {"categoria": True, "mensaje": "Mesa 4 pagó"})] * n
+
+
+async def _legacy(client, n):
+    return [("GET", "/mensajePago/bench", None)] * n
+
+
+async def _health_upstream(client, n):
+    return [("GET", "/health/upstream", None)] * n
+
+
+async def _metrics(client, n):
+    return [("GET", "/metrics", None)] * n
+
+
+async def _events(client, n):
+    # Pagos ya confirmados: el evento se envía de inmediato y se cierra el stream
+    return _cycle(await _committed(client, n), n, lambda t: ("GET", f"/payments/events?token={t}&timeout=5", None))
+
+
+async def _ledger_find(client, n):
+    await _committed(client, n)
+    return [("GET", f"/payments/ledger?accounting_date={time.strftime('%m%d')}", None)] * n
+
+
+async def _export(client, n):
+    await _committed(client, n)
+    return [("GET", "/payments/ledger/export?buy_order_prefix=bench-&limit=100", None)] * n
+
+
+async def _settlement(client, n):
+    return [("GET", f"/reports/settlement?date={time.strftime('%m%d')}", None)] * n
+
+
+async def _refund_jobs(client, n):
+    return _cycle(
+        await _committed(client, n), n,
+        lambda t: ("POST", "/payments/refund/jobs", {"refunds": [{"token": t, "amount": 1}]})
+    )
+
+
+async def _refund_jobs_stats(client, n):
+    return [("GET", "/payments/refund/jobs", None)] * n
+
+
+async def _refund_job(client, n):
+    tokens = await _committed(client, 10)
+    job_ids = []
+    for token in tokens:
+        response = await client.post("/payments/refund/jobs", json={"refunds": [{"token": token, "amount": 1}]})
+        if response.status_code == 202:
+            job_ids.append(response.json()["job_id"])
+    return _cycle(job_ids, n, lambda job_id: ("GET", f"/payments/refund/jobs/{job_id}", None))
+
+
+async def _notifications_queue(client, n):
+    return [("GET", "/notifications/queue", None)] * n
+
+
+async def _callback_css(client, n):
+    return [("GET", "/static/callback.css", None)] * n
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "index": _index,
+    "health": _health,
+    "health_upstream": _health_upstream,
+    "metrics": _metrics,
+    "create": _create,
+    "confirm": _confirm,
+    "callback": _callback,
+    "status": _status,
+    "status_batch": _status_batch,
+    "events": _events,
+    "refund": _refund,
+    "refund_jobs": _refund_jobs,
+    "refund_jobs_stats": _refund_jobs_stats,
+    "refund_job": _refund_job,
+    "ledger": _ledger,
+    "ledger_find": _ledger_find,
+    "export": _export,
+    "settlement": _settlement,
+    "reconciliation": _reconciliation,
+    "notifications": _notifications,
+    "notifications_queue": _notifications_queue,
+    "callback_css": _callback_css,
+    "legacy": _legacy,
+}
+
+# Ruta de main.py que mide cada escenario (ver uncovered_routes)
+SCENARIO_ROUTES: Dict[str, str] = {
+    "index": "GET /",
+    "health": "GET /health",
+    "health_upstream": "GET /health/upstream",
+    "metrics": "GET /metrics",
+    "create": "POST /payments/create",
+    "confirm": "POST /payments/confirm",
+    "callback": "GET /payment/callback",
+    "status": "GET /payments/status/{token}",
+    "status_batch": "POST /payments/status/batch",
+    "events": "GET /payments/events",
+    "refund": "POST /payments/refund",
+    "refund_jobs": "POST /payments/refund/jobs",
+    "refund_jobs_stats": "GET /payments/refund/jobs",
+    "refund_job": "GET /payments/refund/jobs/{job_id}",
+    "ledger": "GET /payments/ledger/{token}",
+    "ledger_find": "GET /payments/ledger",
+    "export": "GET /payments/ledger/export",
+    "settlement": "GET /reports/settlement",
+    "reconciliation": "GET /payments/reconciliation",
+    "notifications": "POST /notifications",
+    "notifications_queue": "GET /notifications/queue",
+    "callback_css": "GET /static/callback.css",
+    "legacy": "GET /mensajePago/{id}",
+}
+
+# Rutas que no se miden: diagnóstico con ADMIN_TOKEN (el perfil muestrea durante segundos)
+UNMEASURED_ROUTES = ("GET /admin/profile", "GET /admin/slow-requests")
+
+
+def uncovered_routes(app: Any) -> List[str]:
+    """
+    Rutas de la app ("MÉTODO /ruta") sin escenario en SCENARIOS ni en UNMEASURED_ROUTES
+    """
+    from fastapi.routing import APIRoute
+
+    covered = set(SCENARIO_ROUTES.values()) | set(UNMEASURED_ROUTES)
+    return sorted(
+        f"{method} {route.path}"
+        for route in app.routes if isinstance(route, APIRoute)
+        for method in route.methods
+        if f"{method} {route.path}" not in covered
+    )
+
+
+async def drive(client: httpx.AsyncClient, specs: List[RequestSpec], concurrency: int) -> Dict[str, float]:
+    """
+    Ejecuta las peticiones con `concurrency` clientes simultáneos y resume las latencias
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    for spec in specs:
+        queue.put_nowait(spec)
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker() -> None:
+        nonlocal errors
+        while True:
+            try:
+                method, path, body = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                await response.aread()
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run(target: str, routes: List[str], requests: int, concurrency: int) -> Dict[str, Dict[str, float]]:
+    # keepalive_expiry menor al keep-alive de uvicorn (5s) para no reutilizar conexiones cerradas
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency, keepalive_expiry=2)
+    results = {}
+    async with httpx.AsyncClient(base_url=target, limits=limits, timeout=60) as client:
+        for name in routes:
+            specs = await SCENARIOS[name](client, requests)
+            if not specs:
+                print(f"{name}: sin peticiones (¿falló la preparación?)", file=sys.stderr)
+                continue
+            results[name] = await drive(client, specs, concurrency)
+            print(f"{name}: {results[name]['rps']:.1f} req/s", file=sys.stderr)
+    return results
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_port(port: int, process: subprocess.Popen, timeout: float = 20) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"El proceso del puerto {port} terminó con código {process.returncode}")
+        with contextlib.suppress(OSError), socket.create_connection(("127.0.0.1", port), timeout=0.5):
+            return
+        time.sleep(0.1)
+    raise RuntimeError(f"El puerto {port} no respondió en {timeout}s")
+
+
+@contextlib.contextmanager
+def spawn_stack(latency_ms: float, jitter_ms: float, error_rate: float, app_env: Optional[Dict[str, str]] = None):
+    """
+    Levanta bench.mock_transbank y main:app en procesos locales; entrega la URL de la API
+    """
+    mock_port, app_port = _free_port(), _free_port()
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    mock_env = {
+        **os.environ,
+        "MOCK_LATENCY_MS": str(latency_ms),
+        "MOCK_JITTER_MS": str(jitter_ms),
+        "MOCK_ERROR_RATE": str(error_rate)
+    }
+    env = {
+        **os.environ,
+        "WEBPAY_BASE_URL": f"http://127.0.0.1:{mock_port}",
+        "LEDGER_PATH": os.path.join(workdir, "ledger.db"),
+        # Todas las peticiones salen de la misma IP: se mide la ruta, no el rate limit
+        "RATE_LIMIT_ENABLED": os.environ.get("RATE_LIMIT_ENABLED", "false"),
+        # El log de acceso a stdout se mezclaría con el reporte
+        "ACCESS_LOG_ENABLED": os.environ.get("ACCESS_LOG_ENABLED", "false"),
+        **(app_env or {})
+    }
+    uvicorn = [sys.executable, "-m", "uvicorn", "--log-level", "warning", "--host", "127.0.0.1"]
+    processes = [
+        subprocess.Popen(uvicorn + ["--port", str(mock_port), "bench.mock_transbank:app"], cwd=ROOT_DIR, env=mock_env),
+        subprocess.Popen(uvicorn + ["--port", str(app_port), "main:app"], cwd=ROOT_DIR, env=env),
+    ]
+    try:
+        _wait_port(mock_port, processes[0])
+        _wait_port(app_port, processes[1])
+        yield f"http://127.0.0.1:{app_port}"
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(10)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de la API de pagos contra un Transbank simulado")
+    parser.add_argument("--target", help="URL de una instancia ya levantada")
+    parser.add_argument("--spawn", action="store_true", help="Levantar mock y API en procesos locales")
+    parser.add_argument("--routes", default="all", help=f"Rutas separadas por coma: {','.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=500, help="Peticiones por ruta")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=150, help="Latencia del mock (--spawn)")
+    parser.add_argument("--jitter-ms", type=float, default=50, help="Variación de la latencia del mock (--spawn)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de errores del mock (--spawn)")
+    parser.add_argument("--json", dest="json_path", help="Guardar los resultados en un archivo JSON")
+    args = parser.parse_args()
+
+    routes = list(SCENARIOS) if args.routes == "all" else [r.strip() for r in args.routes.split(",")]
+    unknown = [r for r in routes if r not in SCENARIOS]
+    if unknown:
+        parser.error(f"Rutas desconocidas: {', '.join(unknown)}")
+    if not args.target and not args.spawn:
+        parser.error("Indique --target o --spawn")
+
+    if args.spawn:
+        with spawn_stack(args.latency_ms, args.jitter_ms, args.error_rate) as target:
+            results = asyncio.run(run(target, routes, args.requests, args.concurrency))
+    else:
+        results = asyncio.run(run(args.target, routes, args.requests, args.concurrency))
+
+    print(format_table(results))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Cálculo de percentiles y resumen de resultados de carga
+"""
+
+import math
+from typing import Dict, List, Sequence
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """
+    Percentil por rango más cercano sobre una lista ya ordenada
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: List[float], errors: int, wall_time: float) -> Dict[str, float]:
+    """
+    Resume latencias (en segundos) como throughput y percentiles en milisegundos
+    """
+    values = sorted(latencies)
+    total = len(values)
+    return {
+        "requests": total,
+        "errors": errors,
+        "rps": total / wall_time if wall_time > 0 else 0.0,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": (values[-1] * 1000) if values else 0.0
+    }
+
+
+def format_table(rows: Dict[str, Dict[str, float]]) -> str:
+    """
+    Tabla de texto con una fila por ruta
+    """
+    header = f"{'ruta':<20}{'reqs':>8}{'errores':>9}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    lines = [header, "-" * len(header)]
+    for name, r in rows.items():
+        lines.append(
+            f"{name:<20}{r['requests']:>8}{r['errors']:>9}{r['rps']:>10.1f}"
+            f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}"
+        )
+    return "\n".join(lines)
@@ -1,16 +1,122 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional
-from Payment.webpay_service import webpay_service
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+from Payment.idempotency import IdempotencyConflictError, idempotency_store
+from Payment.models import Result
+from Payment.tenants import tenant_registry
+from Payment.webpay_service import WebpayService, webpay_service
+from Payment.ledger import EXPORT_COLUMNS, transaction_ledger
+from Payment.reconciliation import reconciliation_worker
+from Payment.refund_jobs import JobQueueFullError, refund_jobs
+from Pages import CALLBACK_CSS, render_error, render_rejected, render_success, static_response
+from Notifications import QueueFullError, notification_dispatcher
+from Server import metrics
+from Server.access_log import AccessLogMiddleware, access_log
+from Server.capture import CaptureMiddleware, traffic_capture
+from Server.profiler import SlowRequestMiddleware, require_admin, sampling_profiler, slow_request_trap
+from Server.events import TooManySubscribersError, payment_events
+from Server.rate_limit import admission, body_session_id, ip_key, session_or_ip
+from Server.tenancy import TenantMiddleware, servicio_webpay
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import math
 import os
+import time
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson es opcional
+    orjson = None
+
+# Máximo de tokens por consulta de estado en lote
+STATUS_BATCH_MAX_TOKENS = int(os.environ.get("STATUS_BATCH_MAX_TOKENS", 1000))
+
+# Espera máxima (segundos) de una suscripción a /payments/events y cada cuánto se envía un ping
+PAYMENT_EVENTS_TIMEOUT = float(os.environ.get("PAYMENT_EVENTS_TIMEOUT", 600))
+PAYMENT_EVENTS_HEARTBEAT = float(os.environ.get("PAYMENT_EVENTS_HEARTBEAT", 15))
+
+# Máximo de reembolsos por trabajo asíncrono
+REFUND_JOB_MAX_ITEMS = int(os.environ.get("REFUND_JOB_MAX_ITEMS", 500))
+
+# Serialización rápida (opt-in): las rutas de pago devuelven el resultado ya
+# serializado con orjson, sin validarlo de nuevo contra el response_model
+FAST_JSON = os.environ.get("FAST_JSON", "false").lower() in ("1", "true", "yes")
+
+# Registrar cada resultado de Transbank en el ledger local
+webpay_service.add_result_listener(transaction_ledger.record)
+# Seguir las transacciones creadas hasta que se confirmen o expiren
+webpay_service.add_result_listener(reconciliation_worker.track)
+reconciliation_worker.on_expired = transaction_ledger.mark_expired
+# Avisar a las pantallas suscritas apenas se confirma un pago
+webpay_service.add_result_listener(payment_events.record)
+payment_events.lookup = transaction_ledger.final_results
+# Latencia y errores de cada llamada a Transbank
+webpay_service.add_call_listener(metrics.observe_upstream_call)
+# Duración y resultado de cada llamada en el log de acceso, con el id de la petición
+webpay_service.add_call_listener(access_log.observe_upstream_call)
+# La conciliación consulta cada token con las credenciales de su sucursal
+reconciliation_worker.resolve_service = tenant_registry.get
+# Un trabajo retomado por otro worker reembolsa con las credenciales de su sucursal
+refund_jobs.resolve_service = tenant_registry.get
+notification_dispatcher.add_delivery_listener(metrics.observe_notification_delivery)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Ciclo de vida de la aplicación: inicia el ledger y libera recursos al apagar"""
+    access_log.start()
+    traffic_capture.start()
+    slow_request_trap.start()
+    # Cliente HTTP (o SDK de respaldo) listo antes de la primera petición
+    webpay_service.preload()
+    webpay_service.connect()
+    transaction_ledger.start()
+    reconciliation_worker.start()
+    notification_dispatcher.start()
+    refund_jobs.start()
+    payment_events.start()
+    yield
+    await payment_events.stop()
+    await refund_jobs.stop()
+    await notification_dispatcher.stop()
+    await reconciliation_worker.stop()
+    await tenant_registry.aclose()
+    await webpay_service.aclose()
+    transaction_ledger.close()
+    traffic_capture.stop()
+    access_log.stop()
+
 
 app = FastAPI(
     title="Restaurant Payments API",
     description="Microservicio de pagos para restaurante usando Webpay Plus",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Muestras de pila de las peticiones lentas de crear_pago, confirmar_pago y payment_callback (solo con SLOW_REQUEST_MS)
+if slow_request_trap.enabled:
+    app.add_middleware(SlowRequestMiddleware, trap=slow_request_trap)
+
+# Captura de tráfico para bench.replay (solo con TRAFFIC_CAPTURE_FILE)
+if traffic_capture.enabled:
+    app.add_middleware(CaptureMiddleware, capture=traffic_capture)
+
+# Log JSON de cada petición con su X-Request-ID (dentro de TenantMiddleware para ver la ruta y la sucursal)
+app.add_middleware(AccessLogMiddleware, access_log=access_log)
+
+# Sucursal de cada petición (prefijo /tenants/{sucursal} o encabezado X-Tenant-Id)
+app.add_middleware(TenantMiddleware)
+
+# Métricas por ruta (latencia, en curso, errores); expuestas en /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Configurar CORS
 app.add_middleware(
     CORSMiddleware,
@@ -18,6 +124,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
 class Notificacion(BaseModel):
@@ -34,10 +141,121 @@ class TransaccionCrear(BaseModel):
 class TransaccionConfirmar(BaseModel):
     token: str = Field(..., description="Token de la transacción")
 
+class EstadoLote(BaseModel):
+    tokens: List[str] = Field(..., min_length=1, max_length=STATUS_BATCH_MAX_TOKENS, description="Tokens a consultar")
+    concurrency: Optional[int] = Field(None, gt=0, le=100, description="Consultas simultáneas hacia Transbank")
+
 class Reembolso(BaseModel):
     token: str = Field(..., description="Token de la transacción")
     amount: float = Field(..., gt=0, description="Monto a reembolsar")
 
+class LoteReembolsos(BaseModel):
+    refunds: List[Reembolso] = Field(..., min_length=1, max_length=REFUND_JOB_MAX_ITEMS, description="Reembolsos a procesar")
+
+Monto = Union[int, float]
+
+class TransaccionCreada(BaseModel):
+    success: bool
+    url: Optional[str] = None
+    token: Optional[str] = None
+    buy_order: str
+    session_id: str
+    amount: Monto
+
+class EstadoTransaccion(BaseModel):
+    success: bool
+    vci: Optional[str] = None
+    amount: Optional[Monto] = None
+    status: Optional[str] = None
+    buy_order: Optional[str] = None
+    session_id: Optional[str] = None
+    card_detail: Optional[Dict[str, Any]] = None
+    accounting_date: Optional[str] = None
+    transaction_date: Optional[str] = None
+    authorization_code: Optional[str] = None
+    payment_type_code: Optional[str] = None
+    response_code: Optional[int] = None
+    installments_amount: Optional[Monto] = None
+    installments_number: Optional[int] = None
+    balance: Optional[Monto] = None
+
+class ResultadoReembolso(BaseModel):
+    success: bool
+    type: Optional[str] = None
+    authorization_code: Optional[str] = None
+    authorization_date: Optional[str] = None
+    nullified_amount: Optional[Monto] = None
+    balance: Optional[Monto] = None
+    response_code: Optional[int] = None
+
+
+def _to_jsonable(value: Any) -> Any:
+    if isinstance(value, Result):
+        return value.to_dict()
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+class FastJSONResponse(JSONResponse):
+    """Respuesta JSON serializada con orjson (o json estándar si no está instalado)"""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, default=_to_jsonable)
+        return json.dumps(
+            content, default=_to_jsonable, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+
+
+def responder(resultado: Result):
+    """Con FAST_JSON serializa directamente; si no, FastAPI valida contra el response_model"""
+    if FAST_JSON:
+        return FastJSONResponse(resultado)
+    return resultado
+
+def error_http(resultado: Result) -> HTTPException:
+    """
+    Traduce un resultado fallido a HTTPException
+
+    Si Transbank no está disponible (circuito abierto, 5xx, error de conexión) responde
+    503 con Retry-After; si la llamada excedió su timeout responde 504; los errores de
+    negocio siguen respondiendo 400.
+    """
+    code = resultado.get("code")
+    if code in ("circuit_open", "upstream_unavailable"):
+        retry_after = webpay_service.breaker.snapshot()["retry_after"]
+        return HTTPException(
+            status_code=503,
+            detail=resultado.get("error"),
+            headers={"Retry-After": str(max(math.ceil(retry_after), 1))}
+        )
+    if code == "timeout":
+        return HTTPException(status_code=504, detail=resultado.get("error"))
+    return HTTPException(status_code=400, detail=resultado.get("error"))
+
+async def idempotente(
+    servicio: WebpayService,
+    operacion: str,
+    clave: Optional[str],
+    cuerpo: BaseModel,
+    llamada: Callable[[], Awaitable[Result]]
+) -> Result:
+    """
+    Ejecuta la llamada una sola vez por Idempotency-Key
+
+    Los reintentos con la misma clave reciben el resultado guardado sin llamar a Transbank;
+    si la clave se reutiliza con otro cuerpo responde 422.
+    """
+    if not clave:
+        return await llamada()
+    huella = hashlib.sha256(cuerpo.model_dump_json().encode()).hexdigest()
+    try:
+        return await idempotency_store.run_async(f"{servicio.tenant or ''}:{operacion}:{clave}", huella, llamada)
+    except IdempotencyConflictError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+# Encabezado opcional para reintentos seguros de create, confirm y refund
+IdempotencyKey = Header(None, alias="Idempotency-Key", max_length=255)
+
 # Ruta base
 @app.get("/")
 def index():
@@ -50,72 +268,384 @@ def index():
 # Health check
 @app.get("/health")
 def health_check():
-    return {"status": "healthy"}
+    return {"status": "healthy", "upstream": webpay_service.breaker.state}
+
+# Disponibilidad de Transbank: 503 mientras el circuito está abierto
+@app.get("/health/upstream")
+def upstream_health():
+    breaker = webpay_service.breaker.snapshot()
+    if breaker["state"] == "open":
+        return JSONResponse(status_code=503, content={"status": "unavailable", "breaker": breaker})
+    return {"status": "available", "breaker": breaker}
+
+# Métricas en formato Prometheus
+@app.get("/metrics", include_in_schema=False)
+async def exportar_metricas():
+    metrics.collect(webpay_service, notification_dispatcher)
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
 
 # Crear transacción de pago
-@app.post("/payments/create")
-def crear_pago(transaccion: TransaccionCrear):
+@app.post("/payments/create", response_model=TransaccionCreada,
+          dependencies=[Depends(admission.limit("create", body_session_id))])
+async def crear_pago(
+    transaccion: TransaccionCrear,
+    idempotency_key: Optional[str] = IdempotencyKey,
+    servicio: WebpayService = Depends(servicio_webpay)
+):
     """Crea una nueva transacción de pago con Webpay Plus"""
     try:
-        resultado = webpay_service.create_transaction(
+        resultado = await idempotente(servicio, "create", idempotency_key, transaccion, lambda: servicio.create_transaction_async(
             buy_order=transaccion.buy_order,
             session_id=transaccion.session_id,
             amount=transaccion.amount,
             return_url=transaccion.return_url
-        )
+        ))
         
         if not resultado.get("success"):
-            raise HTTPException(status_code=400, detail=resultado.get("error"))
+            raise error_http(resultado)
         
-        return resultado
+        return responder(resultado)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Confirmar transacción
-@app.post("/payments/confirm")
-def confirmar_pago(confirmacion: TransaccionConfirmar):
+@app.post("/payments/confirm", response_model=EstadoTransaccion,
+          dependencies=[Depends(admission.limit("confirm", session_or_ip))])
+async def confirmar_pago(
+    confirmacion: TransaccionConfirmar,
+    idempotency_key: Optional[str] = IdempotencyKey,
+    servicio: WebpayService = Depends(servicio_webpay)
+):
     """Confirma una transacción después del pago"""
     try:
-        resultado = webpay_service.commit_transaction(token=confirmacion.token)
+        resultado = await idempotente(servicio, "confirm", idempotency_key, confirmacion, lambda: servicio.commit_transaction_async(
+            token=confirmacion.token
+        ))
         
         if not resultado.get("success"):
-            raise HTTPException(status_code=400, detail=resultado.get("error"))
+            raise error_http(resultado)
         
-        return resultado
+        return responder(resultado)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Obtener estado de pago
-@app.get("/payments/status/{token}")
-def estado_pago(token: str):
+@app.get("/payments/status/{token}", response_model=EstadoTransaccion,
+         dependencies=[Depends(admission.limit("status", ip_key))])
+async def estado_pago(token: str, servicio: WebpayService = Depends(servicio_webpay)):
     """Obtiene el estado de una transacción"""
     try:
-        resultado = webpay_service.get_status(token=token)
+        resultado = await servicio.get_status_async(token=token)
         
         if not resultado.get("success"):
-            raise HTTPException(status_code=400, detail=resultado.get("error"))
+            raise error_http(resultado)
         
-        return resultado
+        return responder(resultado)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Obtener estado de varios pagos
+@app.post("/payments/status/batch", dependencies=[Depends(admission.limit("status_batch", ip_key))])
+async def estado_pagos_lote(
+    lote: EstadoLote, stream: bool = False, servicio: WebpayService = Depends(servicio_webpay)
+):
+    """
+    Obtiene el estado de varias transacciones en una sola petición
+
+    Los tokens repetidos se consultan una sola vez. Con stream=true la respuesta es
+    NDJSON y cada resultado se envía apenas Transbank responde.
+    """
+    if stream:
+        async def generar():
+            async for token, resultado in servicio.iter_status_many(lote.tokens, lote.concurrency):
+                yield json.dumps({"token": token, **resultado.to_dict()}, default=str) + "\n"
+
+        return StreamingResponse(generar(), media_type="application/x-ndjson")
+
+    resultados = await servicio.get_status_many(lote.tokens, lote.concurrency)
+    return {
+        "success": True,
+        "count": len(resultados),
+        "results": resultados
+    }
+
+# Resultado de un pago en cuanto se confirma (Server-Sent Events), en vez de consultar el estado en un ciclo
+@app.get("/payments/events", dependencies=[Depends(admission.limit("events", ip_key, upstream=False))])
+async def eventos_pago(
+    token: Optional[str] = None,
+    buy_order: Optional[str] = None,
+    timeout: float = Query(PAYMENT_EVENTS_TIMEOUT, gt=0, le=3600, description="Segundos máximos de espera"),
+    servicio: WebpayService = Depends(servicio_webpay)
+):
+    """
+    Espera el resultado de un pago por token o buy_order y lo envía como evento SSE
+
+    Envía un único evento `payment` (o `timeout`) y cierra la conexión. Si el pago ya se
+    había confirmado, el evento se envía de inmediato.
+    """
+    if (token is None) == (buy_order is None):
+        raise HTTPException(status_code=400, detail="Indique token o buy_order")
+    clave = (servicio.tenant, "token", token) if token is not None else (servicio.tenant, "buy_order", buy_order)
+    try:
+        futuro = payment_events.subscribe(clave)
+    except TooManySubscribersError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+    # Suscrito antes de revisar: un commit posterior llega por el futuro. Un commit de otro
+    # worker lo entrega la revisión periódica del ledger del hub
+    evento = payment_events.recent(clave)
+    if evento is None:
+        registrada = (await asyncio.to_thread(transaction_ledger.final_results, [clave])).get(clave)
+        if registrada is not None:
+            evento = {"operation": "ledger", **registrada, "tenant": servicio.tenant}
+    if evento is not None:
+        futuro.cancel()
+
+    async def generar():
+        nonlocal evento
+        try:
+            if evento is None:
+                limite = time.monotonic() + timeout
+                while evento is None:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        yield "event: timeout\ndata: {}\n\n"
+                        return
+                    listo, _ = await asyncio.wait({futuro}, timeout=min(restante, PAYMENT_EVENTS_HEARTBEAT))
+                    if listo:
+                        evento = futuro.result()
+                    else:
+                        yield ": ping\n\n"
+            yield f"event: payment\ndata: {json.dumps(evento, default=str)}\n\n"
+        finally:
+            futuro.cancel()
+
+    return StreamingResponse(
+        generar(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Estado de la conciliación de transacciones pendientes
+@app.get("/payments/reconciliation")
+async def estado_conciliacion():
+    """Resumen de las transacciones creadas que aún no se confirman"""
+    return {"success": True, **reconciliation_worker.stats()}
+
+# Consultar transacciones en el ledger local (sin llamar a Transbank)
+@app.get("/payments/ledger")
+async def buscar_transacciones(
+    buy_order: Optional[str] = None,
+    session_id: Optional[str] = None,
+    accounting_date: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    servicio: WebpayService = Depends(servicio_webpay)
+):
+    """Busca transacciones registradas de la sucursal por buy_order, session_id o accounting_date"""
+    if buy_order is None and session_id is None and accounting_date is None:
+        raise HTTPException(status_code=400, detail="Indique buy_order, session_id o accounting_date")
+    # Las consultas a SQLite corren en un hilo para no bloquear el event loop
+    transacciones = await asyncio.to_thread(
+        transaction_ledger.find,
+        buy_order=buy_order,
+        session_id=session_id,
+        accounting_date=accounting_date,
+        limit=limit,
+        tenant=servicio.tenant
+    )
+    return {"success": True, "count": len(transacciones), "transactions": transacciones}
+
+# Exportar transacciones del ledger local en streaming (NDJSON o CSV)
+@app.get("/payments/ledger/export")
+async def exportar_transacciones(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    accounting_date: Optional[str] = Query(None, pattern=r"^\d{4}$", description="Fecha contable (MMDD)"),
+    accounting_date_from: Optional[str] = Query(None, pattern=r"^\d{4}$"),
+    accounting_date_to: Optional[str] = Query(None, pattern=r"^\d{4}$"),
+    status: Optional[str] = Query(None, description="Estados separados por coma"),
+    buy_order_prefix: Optional[str] = None,
+    cursor: Optional[int] = Query(None, ge=0, description="X-Next-Cursor de la página anterior"),
+    limit: Optional[int] = Query(None, ge=1, description="Filas por página (sin límite exporta todo)"),
+    servicio: WebpayService = Depends(servicio_webpay)
+):
+    """
+    Exporta las transacciones registradas de la sucursal sin llamar a Transbank
+
+    Las filas se generan a medida que se envían, en bloques de ~64 KB (cada iteración del
+    generador corre en el threadpool). Con limit, el encabezado X-Next-Cursor
+    indica el cursor de la página siguiente (no se envía en la última).
+    """
+    # La consulta del cursor siguiente corre en un hilo; las filas se leen al enviarlas
+    siguiente, filas = await asyncio.to_thread(
+        transaction_ledger.export,
+        accounting_date=accounting_date,
+        accounting_date_from=accounting_date_from,
+        accounting_date_to=accounting_date_to,
+        status=[s.strip() for s in status.split(",") if s.strip()] if status else None,
+        buy_order_prefix=buy_order_prefix,
+        cursor=cursor,
+        limit=limit,
+        tenant=servicio.tenant
+    )
+
+    if format == "csv":
+        def generar():
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+            writer.writeheader()
+            for fila in filas:
+                writer.writerow(fila)
+                if buffer.tell() >= 65536:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        media_type = "text/csv"
+    else:
+        def generar():
+            lineas, tamano = [], 0
+            for fila in filas:
+                linea = json.dumps(fila, ensure_ascii=False) + "\n"
+                lineas.append(linea)
+                tamano += len(linea)
+                if tamano >= 65536:
+                    yield "".join(lineas)
+                    lineas, tamano = [], 0
+            yield "".join(lineas)
+        media_type = "application/x-ndjson"
+
+    headers = {"Content-Disposition": f'attachment; filename="transactions.{format}"'}
+    if siguiente is not None:
+        headers["X-Next-Cursor"] = str(siguiente)
+    return StreamingResponse(generar(), media_type=media_type, headers=headers)
+
+@app.get("/payments/ledger/{token}")
+async def transaccion_registrada(
+    token: str, history: bool = False, servicio: WebpayService = Depends(servicio_webpay)
+):
+    """Obtiene una transacción registrada en el ledger local (solo de la sucursal de la petición)"""
+    transaccion = await asyncio.to_thread(transaction_ledger.get, token, servicio.tenant)
+    if transaccion is None:
+        raise HTTPException(status_code=404, detail="Transacción no registrada")
+    respuesta = {"success": True, "transaction": transaccion}
+    if history:
+        respuesta["history"] = await asyncio.to_thread(transaction_ledger.history, token)
+    return respuesta
+
+# Totales de liquidación de una fecha contable (mantenidos de forma incremental)
+@app.get("/reports/settlement")
+async def reporte_liquidacion(
+    date: str = Query(..., pattern=r"^\d{4}$", description="Fecha contable (MMDD)"),
+    servicio: WebpayService = Depends(servicio_webpay)
+):
+    """Montos autorizados, reembolsados y en cuotas del día de la sucursal, por tipo de pago"""
+    reporte = await asyncio.to_thread(transaction_ledger.settlement_report, date, servicio.tenant)
+    return {"success": True, **reporte}
+
 # Reembolsar pago
-@app.post("/payments/refund")
-def reembolsar_pago(reembolso: Reembolso):
+@app.post("/payments/refund", response_model=ResultadoReembolso,
+          dependencies=[Depends(admission.limit("refund", session_or_ip))])
+async def reembolsar_pago(
+    reembolso: Reembolso,
+    idempotency_key: Optional[str] = IdempotencyKey,
+    servicio: WebpayService = Depends(servicio_webpay)
+):
     """Realiza un reembolso de una transacción"""
     try:
-        resultado = webpay_service.refund_transaction(
+        resultado = await idempotente(servicio, "refund", idempotency_key, reembolso, lambda: servicio.refund_transaction_async(
             token=reembolso.token,
             amount=reembolso.amount
-        )
+        ))
         
         if not resultado.get("success"):
-            raise HTTPException(status_code=400, detail=resultado.get("error"))
+            raise error_http(resultado)
         
-        return resultado
+        return responder(resultado)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Reembolsos asíncronos: responde 202 con el id del trabajo sin esperar a Transbank
+@app.post("/payments/refund/jobs", status_code=202,
+          dependencies=[Depends(admission.limit("refund_jobs", session_or_ip, upstream=False))])
+async def crear_trabajo_reembolso(
+    lote: LoteReembolsos,
+    idempotency_key: Optional[str] = IdempotencyKey,
+    servicio: WebpayService = Depends(servicio_webpay)
+):
+    """
+    Encola uno o varios reembolsos; el progreso se consulta en /payments/refund/jobs/{job_id}
+
+    Con Idempotency-Key un reintento devuelve el mismo trabajo en vez de crear otro.
+    """
+    async def encolar():
+        job_id = await refund_jobs.submit(
+            [(reembolso.token, reembolso.amount) for reembolso in lote.refunds], servicio
+        )
+        return {"job_id": job_id}
+
+    try:
+        encolado = await idempotente(servicio, "refund_job", idempotency_key, lote, encolar)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+    trabajo = await refund_jobs.get(encolado["job_id"], servicio.tenant, include_items=False)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo de reembolso expirado")
+    return {
+        "success": True,
+        **trabajo,
+        "status_url": f"/payments/refund/jobs/{trabajo['job_id']}"
+    }
+
+# Estado de los trabajos de reembolso (cola y workers)
+@app.get("/payments/refund/jobs")
+async def estado_trabajos_reembolso():
+    return {"success": True, "jobs": await refund_jobs.stats()}
+
+# Progreso de un trabajo de reembolso, con el resultado de cada reembolso (lo responde cualquier worker)
+@app.get("/payments/refund/jobs/{job_id}")
+async def trabajo_reembolso(job_id: str, servicio: WebpayService = Depends(servicio_webpay)):
+    trabajo = await refund_jobs.get(job_id, servicio.tenant)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo de reembolso no encontrado")
+    return {"success": True, **trabajo}
+
+# Perfil por muestreo del proceso en vivo (formato collapsed para flamegraph/speedscope)
+@app.get("/admin/profile", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def perfil_proceso(
+    seconds: float = Query(10, gt=0, le=300, description="Segundos de muestreo"),
+    interval_ms: float = Query(5, ge=1, le=1000, description="Milisegundos entre muestras")
+):
+    """Muestrea las pilas de todos los hilos del worker que atiende la petición"""
+    try:
+        pilas, muestras = await asyncio.to_thread(sampling_profiler.run, seconds, interval_ms / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(pilas, headers={"X-Profile-Samples": str(muestras)})
+
+# Peticiones lentas capturadas con sus muestras de pila
+@app.get("/admin/slow-requests", dependencies=[Depends(require_admin)])
+async def peticiones_lentas(format: str = Query("json", pattern="^(json|collapsed)$")):
+    """Las más recientes primero; format=collapsed suma las pilas de todas"""
+    lentas = list(reversed(slow_request_trap.slow))
+    if format == "collapsed":
+        return PlainTextResponse("".join(lenta["stacks"] for lenta in lentas))
+    return {
+        "success": True,
+        "enabled": slow_request_trap.enabled,
+        "threshold_ms": slow_request_trap.threshold_ms,
+        "endpoints": sorted(slow_request_trap.endpoints),
+        "requests": lentas
+    }
+
 # Endpoint legacy - mantener para compatibilidad
 @app.get("/mensajePago/{id}")
 def mensaje_pago(id: str):
@@ -123,19 +653,37 @@ def mensaje_pago(id: str):
     return {"data": id, "message": "Use /payments/status/{token} instead"}
 
 # Enviar notificaciones
-@app.post("/notifications")
-def notification(notificacion: Notificacion):
-    """Envía una notificación"""
+@app.post("/notifications", status_code=202,
+          dependencies=[Depends(admission.limit("notifications", session_or_ip, upstream=False))])
+async def notification(notificacion: Notificacion):
+    """Encola una notificación; se entrega en segundo plano a los destinos configurados"""
+    try:
+        encolada = await notification_dispatcher.submit(
+            notificacion.categoria, notificacion.mensaje, notificacion.adicional
+        )
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
     return {
         "success": True,
-        "message": f"Notificación '{notificacion.mensaje}' enviada",
+        "id": encolada["id"],
+        "message": f"Notificación '{notificacion.mensaje}' encolada",
         "categoria": notificacion.categoria,
         "adicional": notificacion.adicional
     }
 
+# Estado de la cola de notificaciones (profundidad, entregas, retraso)
+@app.get("/notifications/queue")
+async def estado_notificaciones():
+    return {"success": True, "queue": notification_dispatcher.stats()}
+
 # Endpoint de retorno desde Webpay (ejemplo)
-@app.get("/payment/callback")
-def payment_callback(token_ws: str = None):
+@app.get("/payment/callback", response_class=HTMLResponse,
+         dependencies=[Depends(admission.limit("callback", ip_key))])
+async def payment_callback(token_ws: str = None, servicio: WebpayService = Depends(servicio_webpay)):
     """
     Endpoint de ejemplo para recibir el retorno de Webpay
     
@@ -145,195 +693,42 @@ def payment_callback(token_ws: str = None):
     Este endpoint:
     1. Recibe el token_ws de Webpay
     2. Confirma automáticamente la transacción
-    3. Muestra el resultado en HTML
+    3. Muestra el resultado en HTML (plantillas precompiladas en Pages/)
     """
-    from fastapi.responses import HTMLResponse
-    
     if not token_ws:
-        return HTMLResponse("""
-            <html>
-                <body style="font-family: Arial; text-align: center; padding: 50px;">
-                    <h1 style="color: red;">❌ Error</h1>
-                    <p>No se recibió el token de Webpay</p>
-                    <a href="/">Volver al inicio</a>
-                </body>
-            </html>
-        """)
+        return HTMLResponse(render_error("Error", "No se recibió el token de Webpay"))
     
     try:
         # Confirmar la transacción automáticamente
-        resultado = webpay_service.commit_transaction(token=token_ws)
+        resultado = await servicio.commit_transaction_async(token=token_ws)
         
         if not resultado.get("success"):
-            return HTMLResponse(f"""
-                <html>
-                    <body style="font-family: Arial; text-align: center; padding: 50px;">
-                        <h1 style="color: red;">❌ Error al confirmar</h1>
-                        <p>{resultado.get('error')}</p>
-                        <a href="/">Volver al inicio</a>
-                    </body>
-                </html>
-            """)
+            return HTMLResponse(render_error("Error al confirmar", resultado.get("error")))
         
         status = resultado.get("status")
-        amount = resultado.get("amount")
-        auth_code = resultado.get("authorization_code")
-        buy_order = resultado.get("buy_order")
         response_code = resultado.get("response_code")
         
         if status == "AUTHORIZED" and response_code == 0:
             # Pago exitoso
-            return HTMLResponse(f"""
-                <html>
-                    <head>
-                        <title>Pago Exitoso</title>
-                        <style>
-                            body {{
-                                font-family: Arial, sans-serif;
-                                text-align: center;
-                                padding: 50px;
-                                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                                color: white;
-                            }}
-                            .card {{
-                                background: white;
-                                color: #333;
-                                padding: 40px;
-                                border-radius: 15px;
-                                max-width: 500px;
-                                margin: 0 auto;
-                                box-shadow: 0 10px 40px rgba(0,0,0,0.2);
-                            }}
-                            .success {{
-                                color: #28a745;
-                                font-size: 60px;
-                                margin: 0;
-                            }}
-                            .info {{
-                                margin: 20px 0;
-                                padding: 15px;
-                                background: #f8f9fa;
-                                border-radius: 8px;
-                            }}
-                            .label {{
-                                font-weight: bold;
-                                color: #666;
-                            }}
-                            .value {{
-                                color: #333;
-                                font-size: 18px;
-                            }}
-                            a {{
-                                display: inline-block;
-                                margin-top: 20px;
-                                padding: 12px 30px;
-                                background: #667eea;
-                                color: white;
-                                text-decoration: none;
-                                border-radius: 5px;
-                                transition: background 0.3s;
-                            }}
-                            a:hover {{
-                                background: #764ba2;
-                            }}
-                        </style>
-                    </head>
-                    <body>
-                        <div class="card">
-                            <div class="success">✅</div>
-                            <h1>¡Pago Exitoso!</h1>
-                            <p>Tu transacción ha sido procesada correctamente</p>
-                            
-                            <div class="info">
-                                <div class="label">Monto</div>
-                                <div class="value">${amount:,} CLP</div>
-                            </div>
-                            
-                            <div class="info">
-                                <div class="label">Orden de Compra</div>
-                                <div class="value">{buy_order}</div>
-                            </div>
-                            
-                            <div class="info">
-                                <div class="label">Código de Autorización</div>
-                                <div class="value">{auth_code}</div>
-                            </div>
-                            
-                            <div class="info">
-                                <div class="label">Token</div>
-                                <div class="value" style="font-size: 12px; word-break: break-all;">{token_ws[:20]}...</div>
-                            </div>
-                            
-                            <a href="/">Volver al inicio</a>
-                        </div>
-                    </body>
-                </html>
-            """)
+            return HTMLResponse(render_success(
+                amount=resultado.get("amount"),
+                buy_order=resultado.get("buy_order"),
+                auth_code=resultado.get("authorization_code"),
+                token=token_ws
+            ))
         else:
             # Pago rechazado
-            return HTMLResponse(f"""
-                <html>
-                    <head>
-                        <title>Pago Rechazado</title>
-                        <style>
-                            body {{
-                                font-family: Arial, sans-serif;
-                                text-align: center;
-                                padding: 50px;
-                                background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
-                                color: white;
-                            }}
-                            .card {{
-                                background: white;
-                                color: #333;
-                                padding: 40px;
-                                border-radius: 15px;
-                                max-width: 500px;
-                                margin: 0 auto;
-                                box-shadow: 0 10px 40px rgba(0,0,0,0.2);
-                            }}
-                            .error {{
-                                color: #dc3545;
-                                font-size: 60px;
-                                margin: 0;
-                            }}
-                            a {{
-                                display: inline-block;
-                                margin-top: 20px;
-                                padding: 12px 30px;
-                                background: #dc3545;
-                                color: white;
-                                text-decoration: none;
-                                border-radius: 5px;
-                            }}
-                        </style>
-                    </head>
-                    <body>
-                        <div class="card">
-                            <div class="error">❌</div>
-                            <h1>Pago Rechazado</h1>
-                            <p>La transacción no pudo ser procesada</p>
-                            <p><strong>Estado:</strong> {status}</p>
-                            <p><strong>Código de respuesta:</strong> {response_code}</p>
-                            <a href="/">Intentar nuevamente</a>
-                        </div>
-                    </body>
-                </html>
-            """)
+            return HTMLResponse(render_rejected(status=status, response_code=response_code))
             
     except Exception as e:
-        return HTMLResponse(f"""
-            <html>
-                <body style="font-family: Arial; text-align: center; padding: 50px;">
-                    <h1 style="color: red;">❌ Error</h1>
-                    <p>Error al procesar el pago: {str(e)}</p>
-                    <a href="/">Volver al inicio</a>
-                </body>
-            </html>
-        """)
-
-# Punto de entrada para ejecución directa
+        return HTMLResponse(render_error("Error", f"Error al procesar el pago: {str(e)}"))
+
+# Hoja de estilos de las páginas de retorno (cacheable por navegador y CDN)
+@app.get("/static/callback.css", include_in_schema=False)
+async def callback_css(request: Request):
+    return static_response(request, CALLBACK_CSS)
+
+# Punto de entrada para ejecución directa (ver Server/serve.py)
 if __name__ == "__main__":
-    import uvicorn
-    port = int(os.environ.get("PORT", 8000))
-    uvicorn.run("main:app", host="0.0.0.0", port=port)
\ No newline at end of file
+    from Server.serve import main as serve
+    serve()
\ No newline at end of file
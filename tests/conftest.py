@@ -0,0 +1,46 @@
+import json
+
+import httpx
+import pytest
+
+from bench.run_benchmark import spawn_stack
+
+
+# Sucursales de prueba: credenciales distintas a las del comercio por defecto
+TENANTS = {
+    "b1": {"commerce_code": "597000000001", "api_key": "X"},
+    "b2": {"commerce_code": "597000000002", "api_key": "Y"},
+}
+
+
+@pytest.fixture(scope="session")
+def api_url():
+    """
+    Mock de Transbank y main:app en procesos locales (ver bench.run_benchmark.spawn_stack)
+    """
+    with spawn_stack(0, 0, 0, app_env={"TENANTS": json.dumps(TENANTS)}) as url:
+        yield url
+
+
+@pytest.fixture
+def client(api_url):
+    with httpx.Client(base_url=api_url, timeout=30) as client:
+        yield client
+
+
+@pytest.fixture
+def create_payment(client):
+    """
+    Crea una transacción (en la sucursal del prefijo, ej. /tenants/b1) y retorna su token
+    """
+    def create(prefix: str = "", buy_order: str = "test-order") -> str:
+        response = client.post(f"{prefix}/payments/create", json={
+            "buy_order": buy_order,
+            "session_id": "test-session",
+            "amount": 10000,
+            "return_url": "http://127.0.0.1/payment/callback"
+        })
+        assert response.status_code == 200, response.text
+        return response.json()["token"]
+
+    return create
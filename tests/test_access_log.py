@@ -0,0 +1,57 @@
+import json
+import logging
+
+import httpx
+
+from bench.run_benchmark import spawn_stack
+from Server.access_log import AccessLog, _upstream_calls, _UpstreamCalls, request_id, upstream_logger
+
+from test_ledger import _wait_for
+
+
+def test_batch_request_logs_its_upstream_calls(tmp_path):
+    log_file = tmp_path / "access.jsonl"
+    app_env = {"ACCESS_LOG_ENABLED": "true", "ACCESS_LOG_FILE": str(log_file)}
+    with spawn_stack(0, 0, 0, app_env=app_env) as url, httpx.Client(base_url=url, timeout=30) as client:
+        tokens = [
+            client.post("/payments/create", json={
+                "buy_order": f"log-order-{i}",
+                "session_id": "test-session",
+                "amount": 10000,
+                "return_url": "http://127.0.0.1/payment/callback"
+            }).json()["token"]
+            for i in range(3)
+        ]
+        response = client.post("/payments/status/batch", json={"tokens": tokens}, headers={"X-Request-ID": "batch-1"})
+        assert response.status_code == 200
+        assert response.headers["x-request-id"] == "batch-1"
+
+        def logged():
+            lines = [json.loads(line) for line in log_file.read_text().splitlines()] if log_file.exists() else []
+            return next((l for l in lines if l.get("request_id") == "batch-1" and l["message"] == "request"), None)
+
+        line = _wait_for(logged)
+        assert line["route"] == "/payments/status/batch"
+        assert [c["operation"] for c in line["upstream"]["calls"]] == ["status"] * 3
+
+
+def test_calls_after_the_request_finished_are_logged_separately(monkeypatch):
+    records = []
+    monkeypatch.setattr(upstream_logger, "info", lambda msg, extra: records.append(extra["fields"]))
+    access_log = AccessLog(enabled=True, sample_rate=1)
+
+    calls = _UpstreamCalls()
+    calls_token, rid_token = _upstream_calls.set(calls), request_id.set("req-1")
+    try:
+        access_log.observe_upstream_call("status", 0.01, None)
+        calls.closed = True
+        # Ej. una consulta compartida que termina después de que su petición se registró
+        access_log.observe_upstream_call("status", 0.02, None)
+    finally:
+        _upstream_calls.reset(calls_token)
+        request_id.reset(rid_token)
+
+    assert [c["duration_ms"] for c in calls] == [10.0]
+    assert [(r["request_id"], r["duration_ms"]) for r in records] == [("req-1", 20.0)]
+    logging.getLogger("payments.access").removeHandler(access_log.handler)
+    upstream_logger.removeHandler(access_log.handler)
@@ -0,0 +1,17 @@
+import asyncio
+
+from bench.run_benchmark import SCENARIO_ROUTES, SCENARIOS, run, uncovered_routes
+
+
+def test_every_route_has_a_scenario():
+    import main
+
+    assert set(SCENARIO_ROUTES) == set(SCENARIOS)
+    assert uncovered_routes(main.app) == []
+
+
+def test_scenarios_run_without_errors(api_url):
+    results = asyncio.run(run(api_url, list(SCENARIOS), requests=4, concurrency=2))
+
+    assert set(results) == set(SCENARIOS)
+    assert {name: r["errors"] for name, r in results.items() if r["errors"]} == {}
@@ -0,0 +1,40 @@
+import asyncio
+
+from Server.events import PaymentEventHub, _max_subscribers
+
+
+def test_one_ledger_lookup_per_sweep_for_all_subscribers():
+    async def scenario():
+        calls = []
+
+        def lookup(keys):
+            calls.append(sorted(keys, key=str))
+            return {(None, "token", "tok-1"): {"token": "tok-1", "status": "AUTHORIZED"}}
+
+        hub = PaymentEventHub(max_subscribers=100, ledger_interval=0.05, lookup=lookup)
+        hub.start()
+        paid = [hub.subscribe((None, "token", "tok-1")) for _ in range(20)]
+        waiting = [hub.subscribe((None, "token", "tok-2")) for _ in range(20)]
+
+        events = await asyncio.wait_for(asyncio.gather(*paid), timeout=2)
+        await hub.stop()
+
+        assert calls[0] == [(None, "token", "tok-1"), (None, "token", "tok-2")]
+        assert len(calls) == hub.stats()["ledger_sweeps"]
+        assert all(e == {"operation": "ledger", "token": "tok-1", "status": "AUTHORIZED", "tenant": None} for e in events)
+        assert not any(f.done() for f in waiting)
+        assert hub.stats()["subscribers"] == 20
+
+    asyncio.run(scenario())
+
+
+def test_subscribers_leave_room_for_other_connections(monkeypatch):
+    monkeypatch.setenv("WEB_LIMIT_CONCURRENCY", "1000")
+    monkeypatch.delenv("PAYMENT_EVENTS_MAX_SUBSCRIBERS", raising=False)
+    assert _max_subscribers() == 500
+
+    monkeypatch.setenv("PAYMENT_EVENTS_MAX_SUBSCRIBERS", "800")
+    assert _max_subscribers() == 800
+
+    monkeypatch.setenv("PAYMENT_EVENTS_MAX_SUBSCRIBERS", "5000")
+    assert _max_subscribers() == 500
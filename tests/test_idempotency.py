@@ -0,0 +1,98 @@
+import asyncio
+import uuid
+
+import pytest
+
+from Payment.idempotency import IdempotencyConflictError, IdempotencyStore
+from Payment.models import CreateResult, ErrorResult
+
+
+def _created(token: str) -> CreateResult:
+    return CreateResult("http://webpay/init", token, "order", "session", 10000)
+
+
+def test_same_key_and_body_returns_the_stored_result():
+    async def scenario():
+        store = IdempotencyStore(max_entries=10, ttl=60)
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            return _created(f"tok-{len(calls)}")
+
+        first = await store.run_async("create:k1", "body-a", loader)
+        second = await store.run_async("create:k1", "body-a", loader)
+
+        assert first["token"] == second["token"] == "tok-1"
+        assert len(calls) == 1
+        assert store.stats()["hits"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_same_key_with_another_body_is_a_conflict():
+    async def scenario():
+        store = IdempotencyStore(max_entries=10, ttl=60)
+
+        async def loader():
+            return _created("tok")
+
+        await store.run_async("create:k1", "body-a", loader)
+        with pytest.raises(IdempotencyConflictError):
+            await store.run_async("create:k1", "body-b", loader)
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_duplicates_share_one_upstream_call():
+    async def scenario():
+        store = IdempotencyStore(max_entries=10, ttl=60)
+        release = asyncio.Event()
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            await release.wait()
+            return _created("tok")
+
+        requests = [asyncio.create_task(store.run_async("confirm:k1", "body", loader)) for _ in range(10)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*requests)
+
+        assert len(calls) == 1
+        assert all(r["token"] == "tok" for r in results)
+
+    asyncio.run(scenario())
+
+
+def test_upstream_failures_are_not_stored():
+    async def scenario():
+        store = IdempotencyStore(max_entries=10, ttl=60)
+        outcomes = [ErrorResult("Transbank no disponible", code="upstream_unavailable"), _created("tok")]
+
+        async def loader():
+            return outcomes.pop(0)
+
+        assert (await store.run_async("refund:k1", "body", loader)).get("code") == "upstream_unavailable"
+        assert (await store.run_async("refund:k1", "body", loader))["success"]
+
+    asyncio.run(scenario())
+
+
+def test_create_with_reused_key_and_another_body_returns_422(client):
+    key = uuid.uuid4().hex
+    body = {
+        "buy_order": "idem-order",
+        "session_id": "test-session",
+        "amount": 10000,
+        "return_url": "http://127.0.0.1/payment/callback"
+    }
+
+    first = client.post("/payments/create", json=body, headers={"Idempotency-Key": key})
+    retry = client.post("/payments/create", json=body, headers={"Idempotency-Key": key})
+    assert first.status_code == retry.status_code == 200
+    assert first.json()["token"] == retry.json()["token"]
+
+    other = client.post("/payments/create", json={**body, "amount": 5000}, headers={"Idempotency-Key": key})
+    assert other.status_code == 422
@@ -0,0 +1,155 @@
+import csv
+import io
+import json
+import time
+import uuid
+
+from Payment.ledger import EXPORT_COLUMNS, TransactionLedger
+from Payment.models import TransactionResult
+
+
+def _wait_for(check, timeout: float = 5.0):
+    # El ledger escribe en segundo plano (lotes cada LEDGER_FLUSH_INTERVAL)
+    deadline = time.monotonic() + timeout
+    while True:
+        result = check()
+        if result or time.monotonic() > deadline:
+            return result
+        time.sleep(0.05)
+
+
+def test_ledger_reads_are_scoped_to_the_tenant(client, create_payment):
+    buy_order = f"t-{uuid.uuid4().hex[:20]}"
+    default_token = create_payment(buy_order=buy_order)
+    tenant_token = create_payment("/tenants/b1", buy_order=buy_order)
+
+    def found(prefix):
+        response = client.get(f"{prefix}/payments/ledger", params={"buy_order": buy_order})
+        return [t["token"] for t in response.json()["transactions"]]
+
+    assert _wait_for(lambda: found("") == [default_token])
+    assert _wait_for(lambda: found("/tenants/b1") == [tenant_token])
+    assert client.get(f"/tenants/b1/payments/ledger/{default_token}").status_code == 404
+    assert client.get(f"/payments/ledger/{tenant_token}").status_code == 404
+
+
+def test_export_is_scoped_to_the_tenant(client, create_payment):
+    buy_order = f"x-{uuid.uuid4().hex[:20]}"
+    default_token = create_payment(buy_order=buy_order)
+    tenant_token = create_payment("/tenants/b1", buy_order=buy_order)
+
+    def exported(prefix):
+        return client.get(f"{prefix}/payments/ledger/export", params={"buy_order_prefix": buy_order}).text
+
+    assert _wait_for(lambda: tenant_token in exported("/tenants/b1"))
+    assert default_token not in exported("/tenants/b1")
+    assert _wait_for(lambda: default_token in exported(""))
+    assert tenant_token not in exported("")
+
+
+def test_settlement_totals_are_per_tenant(client, create_payment):
+    token = create_payment()
+    committed = client.post("/payments/confirm", json={"token": token}).json()
+    date = committed["accounting_date"]
+
+    def authorized(prefix):
+        return client.get(f"{prefix}/reports/settlement", params={"date": date}).json()["authorized"]["count"]
+
+    before_b2 = authorized("/tenants/b2")
+    assert _wait_for(lambda: authorized("") >= 1)
+    assert authorized("/tenants/b2") == before_b2
+
+
+def test_events_do_not_fall_back_to_another_tenants_ledger_row(client, create_payment):
+    buy_order = f"e-{uuid.uuid4().hex[:20]}"
+    token = create_payment(buy_order=buy_order)
+    client.post("/payments/confirm", json={"token": token})
+    assert _wait_for(
+        lambda: (client.get(f"/payments/ledger/{token}").json().get("transaction") or {}).get("status") == "AUTHORIZED"
+    )
+
+    own = client.get("/payments/events", params={"buy_order": buy_order, "timeout": 1})
+    assert "event: payment" in own.text
+    other = client.get("/payments/events", params={"buy_order": buy_order, "timeout": 1},
+                       headers={"X-Tenant-Id": "b1"})
+    assert "event: timeout" in other.text
+
+
+def _ledger(tmp_path) -> TransactionLedger:
+    ledger = TransactionLedger(path=str(tmp_path / "ledger.db"), flush_interval=0.01)
+    rows = [
+        ("tok-1", "mesa-1-a", "AUTHORIZED", "1230"),
+        ("tok-2", "mesa-1-b", "FAILED", "1231"),
+        ("tok-3", "mesa-2-a", "AUTHORIZED", "0101"),
+        ("tok-4", "mesa-1-c", "AUTHORIZED", "0102"),
+        ("tok-5", "mesa-2-b", "AUTHORIZED", "0315"),
+    ]
+    for token, buy_order, status, accounting_date in rows:
+        ledger.record("commit", token, TransactionResult(
+            "TSY", 1000, status, buy_order, "session", None, accounting_date, None, "1213", "VN", 0, None, None, None
+        ))
+    ledger.flush()
+    return ledger
+
+
+def _tokens(ledger: TransactionLedger, **filters) -> list:
+    _, rows = ledger.export(**filters)
+    return [row["token"] for row in rows]
+
+
+def test_export_filters(tmp_path):
+    ledger = _ledger(tmp_path)
+    try:
+        assert _tokens(ledger, accounting_date="0101") == ["tok-3"]
+        assert _tokens(ledger, accounting_date_from="0101", accounting_date_to="0102") == ["tok-3", "tok-4"]
+        assert _tokens(ledger, status=["FAILED"]) == ["tok-2"]
+        assert _tokens(ledger, buy_order_prefix="mesa-1-") == ["tok-1", "tok-2", "tok-4"]
+        assert _tokens(ledger, buy_order_prefix="mesa-1-", status=["AUTHORIZED"]) == ["tok-1", "tok-4"]
+    finally:
+        ledger.close()
+
+
+def test_export_range_across_the_year_boundary(tmp_path):
+    ledger = _ledger(tmp_path)
+    try:
+        assert _tokens(ledger, accounting_date_from="1231", accounting_date_to="0102") == ["tok-2", "tok-3", "tok-4"]
+        assert _tokens(ledger, accounting_date_from="1231", accounting_date_to="0101", limit=1) == ["tok-2"]
+    finally:
+        ledger.close()
+
+
+def test_export_cursor_continues_across_pages(tmp_path):
+    ledger = _ledger(tmp_path)
+    try:
+        exported, cursor = [], None
+        while True:
+            cursor, rows = ledger.export(limit=2, cursor=cursor)
+            exported.extend(row["token"] for row in rows)
+            if cursor is None:
+                break
+        assert exported == ["tok-1", "tok-2", "tok-3", "tok-4", "tok-5"]
+    finally:
+        ledger.close()
+
+
+def test_export_ndjson_and_csv_pages(client, create_payment):
+    buy_order = f"e-{uuid.uuid4().hex[:20]}"
+    tokens = [create_payment(buy_order=f"{buy_order}-{i}") for i in range(3)]
+
+    def page(**params):
+        return client.get("/payments/ledger/export", params={"buy_order_prefix": buy_order, **params})
+
+    assert _wait_for(lambda: len(page().text.splitlines()) == 3)
+
+    first = page(limit=2)
+    assert first.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in first.text.splitlines()]
+    assert [row["token"] for row in rows] == tokens[:2]
+    assert set(rows[0]) == set(EXPORT_COLUMNS)
+
+    last = page(limit=2, cursor=first.headers["x-next-cursor"], format="csv")
+    assert last.headers["content-type"].startswith("text/csv")
+    assert "x-next-cursor" not in last.headers
+    reader = csv.DictReader(io.StringIO(last.text))
+    assert reader.fieldnames == list(EXPORT_COLUMNS)
+    assert [row["token"] for row in reader] == tokens[2:]
@@ -0,0 +1,51 @@
+import asyncio
+
+from Notifications.dispatcher import NotificationDispatcher
+from Notifications.sinks import Sink
+
+
+class FlakySink(Sink):
+    name = "flaky"
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.attempts = 0
+        self.delivered = []
+
+    async def deliver(self, categoria, notificaciones):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise ConnectionError("destino no disponible")
+        self.delivered.extend(notificaciones)
+
+
+def _dispatcher(sink: Sink, retries: int) -> NotificationDispatcher:
+    return NotificationDispatcher(sinks=[sink], workers=1, batch_wait=0, retries=retries, retry_backoff=0.01)
+
+
+def test_failing_sink_is_retried_until_it_succeeds():
+    async def scenario():
+        sink = FlakySink(failures=2)
+        dispatcher = _dispatcher(sink, retries=3)
+        await dispatcher.submit(True, "Mesa 4 pagó")
+        await dispatcher.stop()
+
+        assert [n["mensaje"] for n in sink.delivered] == ["Mesa 4 pagó"]
+        stats = dispatcher.stats()
+        assert (stats["delivered"], stats["retried"], stats["dead_letter"]) == (1, 2, 0)
+
+    asyncio.run(scenario())
+
+
+def test_sink_that_keeps_failing_goes_to_dead_letter():
+    async def scenario():
+        sink = FlakySink(failures=10)
+        dispatcher = _dispatcher(sink, retries=2)
+        await dispatcher.submit(True, "Mesa 4 pagó")
+        await dispatcher.stop()
+
+        assert sink.attempts == 3
+        stats = dispatcher.stats()
+        assert (stats["delivered"], stats["retried"], stats["dead_letter"]) == (0, 2, 1)
+
+    asyncio.run(scenario())
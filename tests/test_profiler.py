@@ -0,0 +1,60 @@
+import threading
+
+import httpx
+
+from bench.run_benchmark import create_body, spawn_stack
+from Server.profiler import SamplingProfiler, collapse
+
+
+def test_collapse_counts_identical_stacks():
+    stacks = [("main", "a", "b"), ("main", "a", "c"), ("main", "a", "b")]
+    assert collapse(stacks) == "main;a;b 2\nmain;a;c 1\n"
+
+
+def test_sampling_profiler_sees_other_threads():
+    stop = threading.Event()
+
+    def waiting_for_transbank():
+        stop.wait()
+
+    thread = threading.Thread(target=waiting_for_transbank, name="worker-x")
+    thread.start()
+    try:
+        stacks, samples = SamplingProfiler().run(0.05, 0.005)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert samples > 1
+    lines = [line for line in stacks.splitlines() if line.startswith("worker-x;")]
+    assert lines and "waiting_for_transbank" in lines[0]
+    # Cada línea termina en la cantidad de muestras de esa pila
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in stacks.splitlines())
+
+
+def test_admin_routes_are_hidden_without_admin_token(client):
+    assert client.get("/admin/slow-requests").status_code == 404
+    assert client.get("/admin/profile", params={"seconds": 0.01}).status_code == 404
+
+
+def test_slow_requests_are_captured_for_admins():
+    app_env = {"ADMIN_TOKEN": "secreto", "SLOW_REQUEST_MS": "20", "SLOW_REQUEST_SAMPLE_INTERVAL": "0.005"}
+    with spawn_stack(100, 0, 0, app_env=app_env) as url, httpx.Client(base_url=url, timeout=30) as client:
+        assert client.get("/admin/slow-requests", headers={"X-Admin-Token": "otro"}).status_code == 401
+        assert client.get("/admin/slow-requests", headers={"Authorization": "Bearer otro"}).status_code == 401
+
+        assert client.post("/payments/create", json=create_body(), headers={"X-Request-ID": "slow-1"}).status_code == 200
+
+        headers = {"Authorization": "Bearer secreto"}
+        lentas = client.get("/admin/slow-requests", headers=headers).json()["requests"]
+        lenta = next(l for l in lentas if l["request_id"] == "slow-1")
+        assert lenta["endpoint"] == "crear_pago"
+        assert lenta["duration_ms"] >= 100
+        assert lenta["samples"] > 0 and lenta["stacks"]
+
+        collapsed = client.get("/admin/slow-requests", headers=headers, params={"format": "collapsed"}).text
+        assert "crear_pago" in collapsed
+
+        perfil = client.get("/admin/profile", headers=headers, params={"seconds": 0.1, "interval_ms": 10})
+        assert perfil.status_code == 200
+        assert int(perfil.headers["x-profile-samples"]) > 0
@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from Server.rate_limit import AdmissionControl
+
+
+def test_upstream_cap_applies_with_rate_limiting_disabled():
+    async def scenario():
+        admission = AdmissionControl(enabled=False, max_concurrency=1)
+        dependency = admission.limit("create")
+
+        first = dependency(None)
+        await first.__anext__()
+        with pytest.raises(HTTPException) as rejected:
+            await dependency(None).__anext__()
+        assert rejected.value.status_code == 503
+        assert rejected.value.headers["Retry-After"] == "1"
+
+        # Al terminar la primera petición se libera el cupo
+        await first.aclose()
+        second = dependency(None)
+        await second.__anext__()
+        assert admission.stats()["upstream_active"] == 1
+        await second.aclose()
+        assert admission.stats()["upstream_active"] == 0
+
+    asyncio.run(scenario())
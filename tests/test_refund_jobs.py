@@ -0,0 +1,75 @@
+import time
+
+import httpx
+
+from bench.run_benchmark import spawn_stack
+from Payment.refund_jobs import INTERRUPTED_RESULT, SCHEMA, RefundJobManager
+from Payment.webpay_service import webpay_service
+
+
+def _wait_finished(client, job_url: str, timeout: float = 10) -> dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        trabajo = client.get(job_url).json()
+        if trabajo.get("finished_at") or time.monotonic() > deadline:
+            return trabajo
+        time.sleep(0.05)
+
+
+def test_refund_job_is_visible_only_to_its_tenant(client, create_payment):
+    token = create_payment("/tenants/b1")
+    assert client.post("/tenants/b1/payments/confirm", json={"token": token}).status_code == 200
+
+    creado = client.post("/tenants/b1/payments/refund/jobs", json={"refunds": [{"token": token, "amount": 10000}]})
+    assert creado.status_code == 202, creado.text
+    job_id = creado.json()["job_id"]
+
+    trabajo = _wait_finished(client, f"/tenants/b1/payments/refund/jobs/{job_id}")
+    assert trabajo["status"] == "completed"
+    assert trabajo["tenant"] == "b1"
+    assert trabajo["items"][0]["result"]["success"]
+
+    assert client.get(f"/payments/refund/jobs/{job_id}").status_code == 404
+    assert client.get(f"/tenants/b2/payments/refund/jobs/{job_id}").status_code == 404
+
+
+def test_refund_job_can_be_polled_from_another_server(tmp_path):
+    # Dos servidores con el mismo archivo de ledger, como dos workers de un despliegue
+    app_env = {"LEDGER_PATH": str(tmp_path / "ledger.db")}
+    with spawn_stack(0, 0, 0, app_env=app_env) as first, spawn_stack(0, 0, 0, app_env=app_env) as second:
+        with httpx.Client(base_url=first, timeout=30) as client:
+            token = client.post("/payments/create", json={
+                "buy_order": "job-order",
+                "session_id": "test-session",
+                "amount": 10000,
+                "return_url": "http://127.0.0.1/payment/callback"
+            }).json()["token"]
+            assert client.post("/payments/confirm", json={"token": token}).status_code == 200
+            creado = client.post("/payments/refund/jobs", json={"refunds": [{"token": token, "amount": 10000}]})
+            assert creado.status_code == 202, creado.text
+            job_id = creado.json()["job_id"]
+
+        with httpx.Client(base_url=second, timeout=30) as client:
+            trabajo = _wait_finished(client, f"/payments/refund/jobs/{job_id}")
+            assert trabajo["status"] == "completed"
+            assert trabajo["progress"]["succeeded"] == 1
+
+
+def test_orphaned_job_is_claimed_without_repeating_running_refunds(tmp_path):
+    path = str(tmp_path / "ledger.db")
+    dead = RefundJobManager(webpay_service, path=path, lease=30)
+    dead.owner = "host:1:dead"
+    dead._conn().executescript(SCHEMA)
+    dead._insert("job-1", "b1", [("tok-a", 100), ("tok-b", 200)], time.time() - 60)
+    dead._start_item("job-1", 0, time.time() - 60)
+
+    alive = RefundJobManager(webpay_service, path=path, lease=30)
+    alive.owner = "host:2:alive"
+    claimed = alive._sweep(time.time(), capacity=10)
+
+    assert claimed == [("job-1", 1, "b1", "tok-b", 200)]
+    trabajo = alive._load("job-1", "b1", include_items=True)
+    assert trabajo["progress"] == {"pending": 1, "running": 0, "succeeded": 0, "failed": 1}
+    assert trabajo["items"][0]["result"] == INTERRUPTED_RESULT
+    # El lease renovado impide que un tercer proceso lo tome de nuevo
+    assert RefundJobManager(webpay_service, path=path, lease=30)._sweep(time.time(), capacity=10) == []
@@ -0,0 +1,30 @@
+import json
+
+from bench.replay import load
+
+
+def _write_capture(path, started_at, records):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"version": 1, "started_at": started_at}) + "\n")
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def test_load_merges_worker_captures_on_one_timeline(tmp_path):
+    first, second = tmp_path / "capture.100.jsonl", tmp_path / "capture.200.jsonl"
+    _write_capture(first, 1000.0, [
+        [0, "POST", "/payments/create", 200, 5, "a", {"amount": 10}],
+        [3000, "GET", "/payments/status/{token}", 200, 5, "a", None],
+    ])
+    _write_capture(second, 1001.0, [
+        [500, "POST", "/payments/confirm", 200, 5, "a", None],
+        [600, "GET", "/metrics", 200, 1, None, None],
+    ])
+
+    records = load([str(second), str(first)])
+    assert [(r[0], r[2]) for r in records] == [
+        (0, "/payments/create"),
+        (1500, "/payments/confirm"),
+        (3000, "/payments/status/{token}"),
+    ]
+    assert len(load([str(first), str(second)], limit=2)) == 2
@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+import pytest
+
+from Payment.resilience import CircuitBreaker, CircuitOpenError
+from Payment.webpay_service import WebpayError
+
+
+def _breaker() -> CircuitBreaker:
+    return CircuitBreaker(failure_rate=0.5, window=4, min_calls=4, reset_timeout=0.05)
+
+
+def _open(breaker: CircuitBreaker) -> None:
+    for _ in range(4):
+        breaker.record(WebpayError("no disponible", 503), breaker.before_call())
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_opens_on_failure_rate_over_the_window():
+    breaker = _breaker()
+    # Los errores de negocio (4xx) no cuentan como fallas
+    for error in (None, WebpayError("ya confirmada", 422), None, WebpayError("no disponible", 503)):
+        breaker.record(error, breaker.before_call())
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    # La ventana descarta la llamada más antigua: 2 fallas de 4
+    breaker.record(WebpayError("no disponible", 503), breaker.before_call())
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_only_the_trial_call_resolves_half_open():
+    breaker = _breaker()
+    stale = breaker.before_call()
+    _open(breaker)
+    time.sleep(0.06)
+
+    trial = breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # Una llamada iniciada con el circuito cerrado no cierra ni reabre el circuito
+    breaker.record(None, stale)
+    breaker.record(WebpayError("no disponible", 503), stale)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    breaker.record(None, trial)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.snapshot()["calls"] == 0
+
+
+def test_failed_trial_reopens_the_circuit():
+    breaker = _breaker()
+    _open(breaker)
+    time.sleep(0.06)
+
+    breaker.record(WebpayError("no disponible", 503), breaker.before_call())
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_cancelled_trial_releases_the_slot_without_changing_state():
+    breaker = _breaker()
+    _open(breaker)
+    time.sleep(0.06)
+
+    trial = breaker.before_call()
+    breaker.record(asyncio.CancelledError(), trial)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    # El cupo de prueba queda libre para la siguiente llamada
+    breaker.record(None, breaker.before_call())
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_calls_do_not_count_in_the_window():
+    breaker = _breaker()
+    for _ in range(4):
+        breaker.record(asyncio.CancelledError(), breaker.before_call())
+    assert breaker.snapshot()["calls"] == 0
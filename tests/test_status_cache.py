@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from Payment.status_cache import StatusCache
+
+
+def test_cancelled_leader_does_not_fail_followers():
+    async def scenario():
+        cache = StatusCache(max_entries=10, pending_ttl=2)
+        release = asyncio.Event()
+
+        async def loader(token):
+            await release.wait()
+            return {"success": True, "status": "AUTHORIZED", "token": token}
+
+        leader = asyncio.create_task(cache.get_or_load_async("tok", loader))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.get_or_load_async("tok", loader))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        assert (await follower)["status"] == "AUTHORIZED"
+        assert cache.get("tok")["status"] == "AUTHORIZED"
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    asyncio.run(scenario())
+
+
+def test_loader_errors_reach_every_waiter_and_are_not_cached():
+    async def scenario():
+        cache = StatusCache(max_entries=10, pending_ttl=2)
+
+        async def loader(token):
+            await asyncio.sleep(0.01)
+            raise ConnectionError("sin conexión")
+
+        results = await asyncio.gather(
+            cache.get_or_load_async("tok", loader),
+            cache.get_or_load_async("tok", loader),
+            return_exceptions=True
+        )
+        assert all(isinstance(result, ConnectionError) for result in results)
+        assert cache.get("tok") is None
+        assert cache.stats()["inflight"] == 0
+
+    asyncio.run(scenario())
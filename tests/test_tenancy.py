@@ -0,0 +1,36 @@
+def test_tenant_cannot_read_or_confirm_another_tenants_token(client, create_payment):
+    token = create_payment()
+    confirmed = client.post("/payments/confirm", json={"token": token})
+    assert confirmed.status_code == 200
+    assert confirmed.json()["status"] == "AUTHORIZED"
+    # El resultado queda en la caché de estados y de commits del comercio por defecto
+    assert client.get(f"/payments/status/{token}").status_code == 200
+
+    assert client.get(f"/tenants/b1/payments/status/{token}").status_code == 400
+    assert client.post("/tenants/b1/payments/confirm", json={"token": token}).status_code == 400
+    assert client.get(f"/payments/status/{token}", headers={"X-Tenant-Id": "b1"}).status_code == 400
+
+
+def test_tenant_token_is_not_visible_to_other_tenants(client, create_payment):
+    token = create_payment("/tenants/b1")
+    assert client.post("/tenants/b1/payments/confirm", json={"token": token}).status_code == 200
+
+    assert client.get(f"/tenants/b1/payments/status/{token}").status_code == 200
+    assert client.get(f"/tenants/b2/payments/status/{token}").status_code == 400
+    assert client.get(f"/payments/status/{token}").status_code == 400
+    assert client.post("/payments/confirm", json={"token": token}).status_code == 400
+
+
+def _route_count(client, route: str) -> float:
+    for line in client.get("/metrics").text.splitlines():
+        if line.startswith("http_request_duration_seconds_count{") and f'route="{route}"' in line:
+            return float(line.rsplit(" ", 1)[1])
+    return 0
+
+
+def test_tenant_prefixed_requests_keep_their_route_label(client):
+    before = _route_count(client, "/mensajePago/{id}")
+    unmatched = _route_count(client, "unmatched")
+    assert client.get("/tenants/b1/mensajePago/42").status_code == 200
+    assert _route_count(client, "/mensajePago/{id}") == before + 1
+    assert _route_count(client, "unmatched") == unmatched
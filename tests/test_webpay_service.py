@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from bench.run_benchmark import create_body
+from Payment.webpay_service import WebpayService
+
+
+INVALID_CREATES = [
+    {"buy_order": "   "},
+    {"session_id": "s" * 62},
+    {"session_id": ""},
+    {"return_url": "http://127.0.0.1/" + "x" * 250},
+]
+
+
+@pytest.mark.parametrize("override", INVALID_CREATES)
+def test_async_create_validates_like_the_sdk(override):
+    body = {**create_body(), **override}
+    args = (body["buy_order"], body["session_id"], body["amount"], body["return_url"])
+
+    # Ninguna de las dos rutas llega a la red: la validación ocurre antes de la llamada
+    sync = WebpayService(use_async_client=False).create_transaction(*args)
+    service = WebpayService(use_async_client=True)
+    resultado = asyncio.run(service.create_transaction_async(*args))
+
+    assert not resultado["success"] and resultado.get("code") is None
+    assert resultado["error"] == sync["error"]
+    assert service.breaker.snapshot()["calls"] == 0
+
+
+def test_async_commit_validates_the_token_like_the_sdk():
+    token = "t" * 65
+    sync = WebpayService(use_async_client=False).commit_transaction(token)
+    resultado = asyncio.run(WebpayService(use_async_client=True).commit_transaction_async(token))
+
+    assert resultado["error"] == sync["error"]
+
+
+def test_invalid_create_returns_400(client):
+    response = client.post("/payments/create", json={**create_body(), "session_id": "s" * 62})
+    assert response.status_code == 400
+    assert "session_id" in response.json()["detail"]